@@ -0,0 +1,296 @@
+import threading
+from time import time, monotonic, strftime, localtime
+import numpy as np
+
+
+class SampleFrame:
+    '''
+    One acquisition cycle with a fixed schema: every channel is read exactly once and stored as float64, NaN if the instrument did not answer.
+    The same frame goes to the plots, the csv writer, updateFlow and the purge/dose threads so the value shown is the value saved.
+    '''
+    CHANNELS = ('Reaction Pressure','Cryo Pressure','Cryo Temperature','Reaction Temperature','Ar sccm','H2S sccm','H2 sccm',
+                'Heater Output','Cryo Setpoint','Setpoint Ramping')
+    INDEX = {channel: i for i, channel in enumerate(CHANNELS)}
+    ## csv columns in the order LoggingThread always wrote them, channels added since (H2 sccm, the Lakeshore heater and
+    ## setpoint) come after the original ones; readers (process_video, LogCache) look columns up by name
+    CSV_FIELDS = ('Time','DateTime') + CHANNELS
+    LOG_COLUMNS = ('time_ns',) + CHANNELS # BinaryLog schema, see log_row
+
+    __slots__ = ('seq','time','values','stamps')
+
+    def __init__(self, seq, time, values=None, stamps=None):
+        self.seq = seq
+        self.time = time
+        self.values = np.full(len(self.CHANNELS), np.nan) if values is None else values
+        self.stamps = np.full(len(self.CHANNELS), np.nan) if stamps is None else stamps
+
+    @classmethod
+    def from_readings(cls, seq, time, readings):
+        ''' readings is {channel: (value, timestamp)} as returned by AcquisitionEngine.poll '''
+        frame = cls(seq, time)
+        for channel, (value, stamp) in readings.items():
+            i = cls.INDEX.get(channel)
+            if i is not None and value is not None:
+                frame.values[i] = value
+                frame.stamps[i] = stamp
+        return frame
+
+    def __getitem__(self, channel):
+        return float(self.values[self.INDEX[channel]])
+
+    def has(self, *channels):
+        return not any(np.isnan(self.values[self.INDEX[channel]]) for channel in channels)
+
+    def copy(self):
+        return SampleFrame(self.seq, self.time, self.values.copy(), self.stamps.copy())
+
+    def fill_missing(self, fallback):
+        ''' Put fallback values (dict of channel: value) into any channel that is NaN, e.g. the last good readings for display '''
+        for channel, value in fallback.items():
+            i = self.INDEX[channel]
+            if np.isnan(self.values[i]):
+                self.values[i] = value
+
+    def log_row(self):
+        ''' Values in LOG_COLUMNS order for BinaryLogWriter.append, time as float64 ns since the epoch '''
+        return (self.time*1e9, *self.values)
+
+    def as_row(self):
+        ''' Row for csv.DictWriter with CSV_FIELDS as the header, missing channels are left blank. Time is HHMMSS as before '''
+        stamp = localtime(self.time)
+        row = {'Time':strftime('%H%M%S',stamp), 'DateTime':strftime('%Y%m%d-%H%M%S',stamp)}
+        for channel, value in zip(self.CHANNELS, self.values):
+            row[channel] = '' if np.isnan(value) else repr(float(value))
+        return row
+
+
+class PeriodStats:
+    '''
+    Achieved period, jitter and missed deadlines for one periodic task.
+    Jitter is the standard deviation of the achieved period, busy time is how long the reads themselves took.
+    '''
+    __slots__ = ('period','count','missed','max_lateness','busy','_first_start','_last_start','_last_end','_sum','_sumsq')
+
+    def __init__(self, period):
+        self.period = period
+        self.reset()
+
+    def reset(self):
+        self.count = 0
+        self.missed = 0
+        self.max_lateness = 0.0
+        self.busy = 0.0
+        self._first_start = None
+        self._last_start = None
+        self._last_end = None
+        self._sum = 0.0
+        self._sumsq = 0.0
+
+    def record(self, deadline, start, end):
+        lateness = start - deadline
+        if lateness > self.max_lateness:
+            self.max_lateness = lateness
+        if self._last_start is not None:
+            achieved = start - self._last_start
+            self._sum += achieved
+            self._sumsq += achieved*achieved
+        else:
+            self._first_start = start
+        self._last_start = start
+        self._last_end = end
+        self.busy += end - start
+        self.count += 1
+
+    def summary(self):
+        intervals = self.count - 1
+        mean = self._sum/intervals if intervals > 0 else float('nan')
+        jitter = max(self._sumsq/intervals - mean*mean, 0.0)**0.5 if intervals > 0 else float('nan')
+        elapsed = self._last_end - self._first_start if self.count > 0 else 0.0
+        return {
+            'period':self.period,
+            'achieved_period':mean,
+            'jitter':jitter,
+            'max_lateness':self.max_lateness,
+            'missed':self.missed,
+            'count':self.count,
+            'utilization':self.busy/elapsed if elapsed > 0 else float('nan'),
+            }
+
+
+class Deadline:
+    '''
+    Absolute deadlines on the monotonic clock for a periodic task, so the period does not drift by the time spent working.
+    If a run overruns one or more deadlines they are counted as missed and skipped rather than run back to back.
+    '''
+    __slots__ = ('period','next','stats')
+
+    def __init__(self, period):
+        self.period = period
+        self.next = monotonic()
+        self.stats = PeriodStats(period)
+
+    def remaining(self):
+        return self.next - monotonic()
+
+    def advance(self, start, end):
+        self.stats.record(self.next, start, end)
+        self.next += self.period
+        if self.next < end:
+            skipped = int((end - self.next)//self.period) + 1
+            self.stats.missed += skipped
+            self.next += skipped*self.period
+
+    def set_period(self, period):
+        ''' New period from now on: the next run is no later than one new period away '''
+        self.period = period
+        self.stats.period = period
+        self.next = min(self.next, monotonic() + period)
+
+
+class PollTask:
+    ''' One read function (returning a dict of channel: value) with its own rate on a bus, failed if its last read raised '''
+    __slots__ = ('name','read','deadline','failed')
+
+    def __init__(self, name, read, period):
+        self.name = name
+        self.read = read
+        self.deadline = Deadline(period)
+        self.failed = False
+
+
+class SampleCollector:
+    '''
+    Thread-safe store for the latest timestamped reading of every channel.
+    Bus workers publish into it, the logging thread takes the fresh readings once per frame.
+    '''
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._latest = {}  # channel: (value, timestamp)
+        self._fresh = set()  # channels published since the last take()
+
+    def publish(self, readings):
+        ''' readings is a dict of channel: (value, timestamp) '''
+        with self._lock:
+            self._latest.update(readings)
+            self._fresh.update(readings)
+
+    def take(self):
+        ''' Returns {channel: (value, timestamp)} for every channel published since the last take '''
+        with self._lock:
+            readings = {channel: self._latest[channel] for channel in self._fresh}
+            self._fresh.clear()
+            return readings
+
+    def latest(self, channel):
+        with self._lock:
+            return self._latest.get(channel)
+
+
+class BusWorker(threading.Thread):
+    '''
+    Polls every instrument on one physical port (e.g. COM3, ASRL8) from its own thread.
+    Each task runs at its own rate on absolute deadlines; the most overdue task goes next. A task that hangs only holds up this bus.
+    '''
+
+    def __init__(self, name, collector, logger):
+        super().__init__(name=f'BusWorker-{name}', daemon=True)
+        self.bus = name
+        self.collector = collector
+        self.logger = logger
+        self.tasks = []
+        self.running = False
+        self._halt = threading.Event()
+        self._wake = threading.Event() # set on stop or a rate change, ends the wait for the next deadline early
+
+    def add_task(self, name, read, period):
+        self.tasks.append(PollTask(name, read, period))
+
+    def set_period(self, name, period):
+        for task in self.tasks:
+            if task.name == name:
+                task.deadline.set_period(period)
+        self._wake.set()
+
+    def stop(self):
+        self.running = False
+        self._halt.set()
+        self._wake.set()
+
+    def run(self):
+        self.running = True
+        now = monotonic()
+        for task in self.tasks:
+            task.deadline.next = now
+        while self.running and self.tasks:
+            task = min(self.tasks, key=lambda task: task.deadline.next)
+            wait = task.deadline.remaining()
+            if wait > 0 and self._wake.wait(wait):
+                self._wake.clear()
+                if self._halt.is_set():
+                    break
+                continue # a rate changed, pick the next task again
+            start = monotonic()
+            try:
+                values = task.read()
+                stamp = time()
+                self.collector.publish({channel: (value, stamp) for channel, value in values.items()})
+                task.failed = False
+            except Exception as e:
+                task.failed = True
+                self.logger.warning(f'{self.bus}: failed to read {task.name}: {e}')
+            task.deadline.advance(start, monotonic())
+
+    def utilization(self):
+        ''' Fraction of wall time this bus spent inside reads, summed over its tasks '''
+        return sum(task.deadline.stats.summary()['utilization'] for task in self.tasks)
+
+
+class AcquisitionEngine:
+    '''
+    Runs one BusWorker per physical port so each bus is polled independently instead of one after another.
+    Every task has its own rate, e.g. reaction pressure at 5 Hz, flows at 1 Hz and cryo temperatures at 0.2 Hz.
+    Usage:
+        engine.add_task('COM3', 'Reaction Pressure', lambda: {'Reaction Pressure': gauge.get_pressure()}, rate=5)
+        engine.start()
+        readings = engine.take()  # {channel: (value, timestamp)} read since the last take
+    '''
+
+    def __init__(self, logger):
+        self.logger = logger
+        self.collector = SampleCollector()
+        self.workers = {}
+
+    def add_task(self, bus, name, read, rate):
+        ''' rate in Hz '''
+        if bus not in self.workers:
+            self.workers[bus] = BusWorker(bus, self.collector, self.logger)
+        self.workers[bus].add_task(name, read, 1/rate)
+
+    def tasks(self):
+        return {task.name: task for worker in self.workers.values() for task in worker.tasks}
+
+    def set_rate(self, name, rate):
+        for worker in self.workers.values():
+            if any(task.name == name for task in worker.tasks):
+                worker.set_period(name, 1/rate)
+                return
+        raise KeyError(name)
+
+    def start(self):
+        for worker in self.workers.values():
+            worker.start()
+
+    def stop(self):
+        for worker in self.workers.values():
+            worker.stop()
+
+    def take(self):
+        return self.collector.take()
+
+    def stats(self):
+        ''' {task name: PeriodStats.summary()} plus the utilization of each bus under 'bus:<name>' '''
+        stats = {name: task.deadline.stats.summary() for name, task in self.tasks().items()}
+        for bus, worker in self.workers.items():
+            stats[f'bus:{bus}'] = {'utilization':worker.utilization()}
+        return stats
@@ -0,0 +1,543 @@
+'''
+Append-only binary log with a fixed schema, replacing the per-row csv writes of LoggingThread.
+Every column is float64; the first one is the time in ns since the epoch (float64, so resolution is about 0.25 us today).
+
+File layout (little endian):
+    MAGIC                       8 bytes
+    header length               uint32, followed by a json header (columns, dtype, codec, created) padded to a multiple of 8
+    chunks, one after the other:
+        'CHNK' header           'CHNK', rows uint32, first time, last time (float64), columns int64   -> 32 bytes
+        data                    columns x rows float64, one column after the other
+      or, for a compressed log:
+        'CHNZ' header           as above plus the compressed length int64                            -> 40 bytes
+        data                    the (columns, rows) block encoded with the log's codec (see CODECS)
+    index (written by close):   'INDX', count uint32, then (offset, rows, first time, last time) per chunk
+    summary (written by close): 'SUMM', columns uint32, then min, max, sum and count of finite values per column
+    trailer:                    index offset int64, END_MAGIC
+
+An uncompressed chunk is one C-ordered (columns, rows) block, so np.memmap reads it without parsing anything.
+A file that wasn't closed (crash, power cut) has no index; the reader then walks the chunk headers and stops at the first
+incomplete chunk, and a writer reopening it carries on from there.
+
+    python BinaryLog.py export logs/CryoTest_20260121-153222.cryolog   # csv next to it, same layout LoggingThread used to write
+    python BinaryLog.py info logs/CryoTest_20260121-153222.cryolog     # rows, chunks, codec and the summary per channel
+'''
+import json, os, struct, zlib
+from time import strftime
+import numpy as np
+
+MAGIC = b'CRYOLOG\x01'
+END_MAGIC = b'CRYOEND\x00'
+EXTENSION = '.cryolog'
+DTYPE = np.dtype('<f8')
+TIME_COLUMN = 'time_ns'
+
+_LENGTH = struct.Struct('<I')
+_CHUNK = struct.Struct('<4sIddq')
+_ZCHUNK = struct.Struct('<4sIddqq')
+_INDEX = struct.Struct('<4sI')
+_ENTRY = struct.Struct('<qqdd')
+_SUMMARY = struct.Struct('<4sI')
+_TRAILER = struct.Struct('<q8s')
+
+
+class LogFormatError(Exception):
+    pass
+
+
+def _shuffle(data):
+    ''' Bytes of a (columns, rows) float64 block regrouped by significance, sign/exponent bytes of a column end up together '''
+    columns, rows = data.shape
+    return np.ascontiguousarray(data, dtype=DTYPE).view(np.uint8).reshape(columns, rows, 8).transpose(0, 2, 1).tobytes()
+
+
+def _unshuffle(raw, columns, rows):
+    return np.frombuffer(raw, dtype=np.uint8).reshape(columns, 8, rows).transpose(0, 2, 1).copy().view(DTYPE).reshape(columns, rows)
+
+
+## Gorilla-style encoding, byte aligned so both directions are numpy operations instead of a loop over bits.
+## Each column is turned into a stream of 64-bit words that are mostly zero bits:
+##   integral columns (the ns timestamps, counters) and readings with a fixed number of decimals (gauges, thermocouples),
+##   as the integer count of the last decimal, stored as deltas or delta-of-deltas (whichever is smaller), zigzagged,
+##   anything else as the XOR of each value's bits with the previous value's.
+## A column is stored as its mode byte, a bitmap of the nonzero words, then for each nonzero word a control byte
+## (8*(significant bytes - 1) + trailing zero bytes) and its significant bytes. A steady clock or an unchanged reading
+## costs one bit, a slowly drifting one a byte or two.
+## Decimal scaling is only used when dividing back gives the same bits for every value, so every value round-trips
+## bit for bit (NaN payloads and -0.0 included, those columns fall back to XOR).
+_XOR = 0
+_BYTE = np.arange(8)
+_MAX_DECIMALS = 15
+
+
+def _zigzag(ints):
+    return ((ints << 1) ^ (ints >> 63)).view(np.uint64)
+
+
+def _words(column):
+    ''' (mode, uint64 words) for one float64 column, mode is 16*(1 for deltas, 2 for delta-of-deltas) + decimals or _XOR '''
+    bits = column.view(np.uint64)
+    if np.isfinite(column).all():
+        for decimals in range(_MAX_DECIMALS + 1):
+            scaled = np.round(column*10.0**decimals)
+            if not (np.abs(scaled) < 2.0**62).all():
+                break
+            ints = scaled.astype(np.int64)
+            if np.array_equal((ints/10.0**decimals).view(np.uint64), bits):
+                delta = np.diff(ints, prepend=0)
+                dod = np.diff(delta, prepend=0)
+                if np.log2(np.abs(dod[1:]) + 1.0).sum() < np.log2(np.abs(delta[1:]) + 1.0).sum():
+                    return 32 + decimals, _zigzag(dod)
+                return 16 + decimals, _zigzag(delta)
+    return _XOR, bits ^ np.concatenate([np.zeros(1, np.uint64), bits[:-1]])
+
+
+def _unwords(mode, words):
+    if mode == _XOR:
+        return np.bitwise_xor.accumulate(words).view(DTYPE)
+    ints = (words >> np.uint64(1)).view(np.int64) ^ -(words & np.uint64(1)).view(np.int64)
+    for i in range(mode//16):
+        ints = np.cumsum(ints)
+    return ints/10.0**(mode%16)
+
+
+def _gorilla_encode(data):
+    out = []
+    for column in np.ascontiguousarray(data, dtype=DTYPE):
+        mode, words = _words(column)
+        nonzero = words != 0
+        raw = words[nonzero].astype('<u8').view(np.uint8).reshape(-1, 8)
+        set_bytes = raw != 0
+        trailing = set_bytes.argmax(axis=1)
+        n = 8 - set_bytes[:, ::-1].argmax(axis=1) - trailing
+        keep = (_BYTE >= trailing[:, None]) & (_BYTE < (trailing + n)[:, None])
+        out += [bytes([mode]), np.packbits(nonzero).tobytes(), (8*(n - 1) + trailing).astype(np.uint8).tobytes(), raw[keep].tobytes()]
+    return b''.join(out)
+
+
+def _gorilla_decode(raw, columns, rows, select):
+    buffer = np.frombuffer(raw, dtype=np.uint8)
+    out = np.empty((len(select), rows), dtype=DTYPE)
+    wanted = {}
+    for i, column in enumerate(select):
+        wanted.setdefault(column, []).append(i)
+    offset = 0
+    for column in range(max(select, default=-1) + 1):
+        mode = buffer[offset]
+        offset += 1
+        nonzero = np.unpackbits(buffer[offset:offset + (rows + 7)//8], count=rows).astype(bool)
+        offset += (rows + 7)//8
+        count = int(nonzero.sum())
+        control = buffer[offset:offset + count]
+        offset += count
+        n, trailing = control//8 + 1, control%8
+        size = int(n.sum(dtype=np.int64))
+        if column in wanted: # the others are only stepped over
+            keep = (_BYTE >= trailing[:, None]) & (_BYTE < (trailing + n)[:, None])
+            raw_words = np.zeros((count, 8), dtype=np.uint8)
+            raw_words[keep] = buffer[offset:offset + size]
+            words = np.zeros(rows, dtype=np.uint64)
+            words[nonzero] = raw_words.view('<u8').ravel()
+            out[wanted[column]] = _unwords(mode, words)
+        offset += size
+    return out
+
+
+## name: (encode (columns, rows) float64 -> bytes, decode (bytes, columns, rows, select) -> (len(select), rows) float64)
+## select is the list of column numbers wanted, in the order wanted
+CODECS = {
+    'zlib':(lambda data: zlib.compress(_shuffle(data), 1),
+            lambda raw, columns, rows, select: _unshuffle(zlib.decompress(raw), columns, rows)[select]),
+    'gorilla':(_gorilla_encode, _gorilla_decode),
+    }
+
+
+def log_path_for(path):
+    ''' Binary log path for a csv-style log path, e.g. logs/CryoTest_x.csv -> logs/CryoTest_x.cryolog '''
+    return os.path.splitext(path)[0] + EXTENSION
+
+
+def _read_header(f):
+    if f.read(len(MAGIC)) != MAGIC:
+        raise LogFormatError(f'{f.name} is not a binary log')
+    (length,) = _LENGTH.unpack(f.read(_LENGTH.size))
+    header = json.loads(f.read(length))
+    return header, f.tell()
+
+
+def _read_index(f, data_start):
+    '''
+    [(offset, rows, first, last)] of every complete chunk, where the next chunk would go, the summary (None if not there)
+    and whether the log was closed. Uses the index written by close() when there is one, otherwise walks the chunk headers.
+    '''
+    size = os.fstat(f.fileno()).st_size
+    if size >= data_start + _TRAILER.size:
+        f.seek(size - _TRAILER.size)
+        index_offset, magic = _TRAILER.unpack(f.read(_TRAILER.size))
+        if magic == END_MAGIC and data_start <= index_offset < size:
+            f.seek(index_offset)
+            tag, count = _INDEX.unpack(f.read(_INDEX.size))
+            if tag == b'INDX':
+                entries = [_ENTRY.unpack(f.read(_ENTRY.size)) for i in range(count)]
+                summary = None
+                tag, columns = _SUMMARY.unpack(f.read(_SUMMARY.size))
+                if tag == b'SUMM':
+                    summary = np.frombuffer(f.read(4*columns*DTYPE.itemsize), dtype=DTYPE).reshape(4, columns).copy()
+                return entries, index_offset, summary, True
+    entries = []
+    offset = data_start
+    while offset + _CHUNK.size <= size:
+        f.seek(offset)
+        head = f.read(_ZCHUNK.size)
+        tag = head[:4]
+        if tag == b'CHNK':
+            tag, rows, first, last, columns = _CHUNK.unpack(head[:_CHUNK.size])
+            end = offset + _CHUNK.size + rows*columns*DTYPE.itemsize
+        elif tag == b'CHNZ' and len(head) == _ZCHUNK.size:
+            tag, rows, first, last, columns, length = _ZCHUNK.unpack(head)
+            end = offset + _ZCHUNK.size + length
+        else:
+            break # the index, or a chunk header cut short
+        if end > size:
+            break # chunk cut short, everything before it is good
+        entries.append((offset, rows, first, last))
+        offset = end
+    return entries, offset, None, False
+
+
+def _summarize(data):
+    ''' (4, columns) of min, max, sum and count over the finite values of a (columns, rows) block '''
+    finite = np.isfinite(data)
+    return np.stack([np.where(finite, data, np.inf).min(axis=1, initial=np.inf),
+                     np.where(finite, data, -np.inf).max(axis=1, initial=-np.inf),
+                     np.where(finite, data, 0).sum(axis=1), finite.sum(axis=1)])
+
+
+def _merge_summary(a, b):
+    return np.stack([np.minimum(a[0], b[0]), np.maximum(a[1], b[1]), a[2] + b[2], a[3] + b[3]])
+
+
+class BinaryLogWriter:
+    '''
+    Rows are collected in a preallocated (columns, chunk_rows) block and written as one chunk when it is full,
+    when flush_interval seconds of rows are waiting, or on flush()/close().
+    codec is None for plain chunks (memmap-able) or a name from CODECS. resolution (s) is recorded in the header
+    for logs that were downsampled. Opening an existing log appends to it in its own codec, as long as the columns match.
+    Usage:
+        log = BinaryLogWriter('logs/run.cryolog', SampleFrame.LOG_COLUMNS, codec='gorilla')
+        log.append(*frame.log_row())
+        log.close()
+    '''
+    def __init__(self, path, columns, chunk_rows=256, flush_interval=10.0, codec=None, resolution=None):
+        self.path = path
+        self.columns = tuple(columns)
+        self.chunk_rows = chunk_rows
+        self.flush_interval = flush_interval*1e9 # ns, compared with the time column
+        self._block = np.empty((len(self.columns), chunk_rows), dtype=DTYPE)
+        self._rows = 0
+        if os.path.exists(path) and os.path.getsize(path) > 0:
+            self._file = open(path, 'r+b')
+            self.header, data_start = _read_header(self._file)
+            if tuple(self.header['columns']) != self.columns:
+                self._file.close()
+                raise LogFormatError(f'{path} has columns {self.header["columns"]}, not {list(self.columns)}')
+            self.index, end, self.summary, closed = _read_index(self._file, data_start)
+            self.codec = self.header.get('codec')
+            if self.summary is None and self.index:
+                ## not closed last time (or written before logs had summaries), rebuild it from what's in the file
+                self.summary = _summarize(BinaryLog(path, _index=(self.header, self.index)).read_block())
+            self._file.seek(end)
+            self._file.truncate() # drop the old index, it's rewritten by close()
+        else:
+            if codec is not None and codec not in CODECS:
+                raise ValueError(f'unknown codec {codec!r}, one of {list(CODECS)}')
+            self._file = open(path, 'w+b')
+            self.codec = codec
+            self.header = {'columns':list(self.columns), 'dtype':DTYPE.str, 'time_column':self.columns[0], 'codec':codec,
+                           'created':strftime('%Y-%m-%d %H:%M:%S'), 'version':1}
+            if resolution is not None:
+                self.header['resolution'] = resolution
+            header = json.dumps(self.header).encode()
+            header += b' '*(-(len(MAGIC) + _LENGTH.size + len(header)) % 8)
+            self._file.write(MAGIC + _LENGTH.pack(len(header)) + header)
+            self.index = []
+            self.summary = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def append(self, *values):
+        ''' One row, a value per column in schema order (missing readings as NaN) '''
+        self._block[:, self._rows] = values
+        self._rows += 1
+        if self._rows == self.chunk_rows or self._block[0, self._rows - 1] - self._block[0, 0] >= self.flush_interval:
+            self.flush()
+
+    def flush(self):
+        if self._rows == 0:
+            return
+        self.write_chunk(self._block[:, :self._rows])
+        self._rows = 0
+
+    def write_chunk(self, data):
+        '''
+        Write a (columns, rows) array as one chunk straight away. If the write fails the file is cut back
+        to where the chunk started, so a retry doesn't leave a broken chunk in the middle of the log.
+        '''
+        data = np.ascontiguousarray(data, dtype=DTYPE)
+        if data.ndim != 2 or data.shape[0] != len(self.columns):
+            raise ValueError(f'expected a ({len(self.columns)}, rows) block, got {data.shape}')
+        rows = data.shape[1]
+        if self.codec is None:
+            head = _CHUNK.pack(b'CHNK', rows, data[0, 0], data[0, -1], len(self.columns))
+            body = data.tobytes()
+        else:
+            body = CODECS[self.codec][0](data)
+            head = _ZCHUNK.pack(b'CHNZ', rows, data[0, 0], data[0, -1], len(self.columns), len(body))
+        offset = self._file.tell()
+        try:
+            self._file.write(head)
+            self._file.write(body)
+            self._file.flush()
+        except OSError:
+            self._file.seek(offset)
+            self._file.truncate()
+            raise
+        self.index.append((offset, rows, float(data[0, 0]), float(data[0, -1])))
+        summary = _summarize(data)
+        self.summary = summary if self.summary is None else _merge_summary(self.summary, summary)
+
+    def sync(self):
+        ''' Make everything written so far durable (fsync) '''
+        os.fsync(self._file.fileno())
+
+    def size(self):
+        return self._file.tell()
+
+    def close(self, sync=False):
+        ''' Write the index, summary and trailer and close the file, sync: fsync it first (see downsample) '''
+        if self._file.closed:
+            return
+        self.flush()
+        index_offset = self._file.tell()
+        self._file.write(_INDEX.pack(b'INDX', len(self.index)))
+        for entry in self.index:
+            self._file.write(_ENTRY.pack(*entry))
+        if self.summary is None:
+            self.summary = _summarize(np.empty((len(self.columns), 0)))
+        self._file.write(_SUMMARY.pack(b'SUMM', len(self.columns)))
+        self._file.write(np.ascontiguousarray(self.summary, dtype=DTYPE).tobytes())
+        self._file.write(_TRAILER.pack(index_offset, END_MAGIC))
+        if sync:
+            self._file.flush()
+            os.fsync(self._file.fileno())
+        self._file.close()
+
+
+class BinaryLog:
+    '''
+    Read side of a binary log. Plain chunks come back as np.memmap views of the file, compressed ones decoded; read() joins them.
+    closed is False for a log that is still being written or wasn't closed, its summary is None then.
+    Usage:
+        log = BinaryLog('logs/run.cryolog')
+        data = log.read()                   # {column: array}
+        t = data['time_ns']/1e9
+        log.summary()['Cryo Temperature']   # {'min':..., 'max':..., 'mean':..., 'count':...} without reading any chunk
+    '''
+    def __init__(self, path, _index=None):
+        self.path = path
+        self._summary = None
+        self._times = None
+        self.closed = False
+        if _index is None:
+            with open(path, 'rb') as f:
+                self.header, data_start = _read_header(f)
+                self.index, end, self._summary, self.closed = _read_index(f, data_start)
+        else:
+            self.header, self.index = _index
+        self.columns = tuple(self.header['columns'])
+        self.codec = self.header.get('codec')
+        self.resolution = self.header.get('resolution')
+        self.rows = sum(entry[1] for entry in self.index)
+
+    def __len__(self):
+        return self.rows
+
+    def span(self):
+        ''' (first, last) time in ns, None if empty '''
+        if not self.index:
+            return None
+        return self.index[0][2], self.index[-1][3]
+
+    def summary(self):
+        ''' {column: {'min', 'max', 'mean', 'count'}} over finite values, None for a log without a summary '''
+        if self._summary is None:
+            return None
+        low, high, total, count = self._summary
+        with np.errstate(invalid='ignore', divide='ignore'):
+            mean = total/count
+        return {column: {'min':float(low[i]), 'max':float(high[i]), 'mean':float(mean[i]), 'count':int(count[i])}
+                for i, column in enumerate(self.columns)}
+
+    def _decode(self, buffer, offset, rows, select):
+        if self.codec is None:
+            start = offset + _CHUNK.size
+            block = np.frombuffer(buffer[start:start + len(self.columns)*rows*DTYPE.itemsize], dtype=DTYPE)
+            return block.reshape(len(self.columns), rows)[select]
+        length = _ZCHUNK.unpack_from(buffer, offset)[5]
+        start = offset + _ZCHUNK.size
+        return CODECS[self.codec][1](buffer[start:start + length], len(self.columns), rows, select)
+
+    def chunk(self, i):
+        ''' (columns, rows) array of chunk i, a memmap for plain chunks '''
+        offset, rows, first, last = self.index[i]
+        if self.codec is None:
+            return np.memmap(self.path, dtype=DTYPE, mode='r', offset=offset + _CHUNK.size, shape=(len(self.columns), rows))
+        with open(self.path, 'rb') as f:
+            f.seek(offset)
+            length = _ZCHUNK.unpack(f.read(_ZCHUNK.size))[5]
+            return CODECS[self.codec][1](f.read(length), len(self.columns), rows, list(range(len(self.columns))))
+
+    def chunks_between(self, start=None, stop=None):
+        '''
+        Numbers of the chunks that can hold rows with start <= time_ns <= stop (either None for open ended).
+        A binary search over the index when time only goes forward, as it does unless the clock was set back mid-run.
+        '''
+        if self._times is None:
+            entries = np.array([(entry[2], entry[3]) for entry in self.index], dtype=DTYPE).reshape(-1, 2)
+            self._times = entries[:, 0], entries[:, 1]
+        first, last = self._times
+        if (first[1:] >= last[:-1]).all() and (first <= last).all():
+            lo = 0 if start is None else np.searchsorted(last, start, 'left')
+            hi = len(first) if stop is None else np.searchsorted(first, stop, 'right')
+            return np.arange(lo, max(lo, hi))
+        inside = np.ones(len(first), dtype=bool)
+        if start is not None:
+            inside &= np.maximum(first, last) >= start
+        if stop is not None:
+            inside &= np.minimum(first, last) <= stop
+        return np.flatnonzero(inside)
+
+    def read_block(self, columns=None, start=None, stop=None):
+        '''
+        (len(columns), rows) float64 array, columns defaults to all of them. With start/stop (ns) only the rows in that time
+        range: the chunks are found in the index and only those are read and decoded, and only the columns asked for.
+        '''
+        names = self.columns if columns is None else columns
+        select = [self.columns.index(name) for name in names]
+        ranged = start is not None or stop is not None
+        if ranged:
+            select.append(self.columns.index(self.header.get('time_column', TIME_COLUMN)))
+        chunks = self.chunks_between(start, stop) if ranged else np.arange(len(self.index))
+        if len(chunks) == 0:
+            return np.empty((len(names), 0), dtype=DTYPE)
+        begin = self.index[chunks[0]][0]
+        end = self.index[chunks[-1] + 1][0] if chunks[-1] + 1 < len(self.index) else os.path.getsize(self.path)
+        if self.codec is None:
+            ## mapped, so only the pages of the columns asked for are read from the disk
+            buffer = np.memmap(self.path, dtype=np.uint8, mode='r', offset=begin, shape=(end - begin,))
+        else:
+            with open(self.path, 'rb') as f:
+                f.seek(begin)
+                buffer = f.read(end - begin) # one read, cheaper than a read per chunk for small chunks
+        out = np.concatenate([self._decode(buffer, self.index[i][0] - begin, self.index[i][1], select) for i in chunks], axis=1)
+        if ranged:
+            inside = np.ones(out.shape[1], dtype=bool)
+            if start is not None:
+                inside &= out[-1] >= start
+            if stop is not None:
+                inside &= out[-1] <= stop
+            out = out[:-1, inside]
+        return out
+
+    def read(self, columns=None, start=None, stop=None):
+        ''' {column: float64 array}, columns defaults to all of them, optionally only between start and stop (ns) '''
+        names = self.columns if columns is None else columns
+        return dict(zip(names, self.read_block(names, start, stop)))
+
+
+def downsample(path, resolution, codec='zlib'):
+    '''
+    Rewrite a closed log at a coarser resolution (s): every resolution-wide time bucket becomes one row holding
+    the mean time and the mean of each channel's finite values. The summary of the original (true min/max) is kept.
+    The new file is on the disk (fsync) before it replaces the old one in one rename, so a power cut leaves either
+    the old log or the new one, never a cut short file in its place. Returns the number of rows left.
+    '''
+    log = BinaryLog(path)
+    if not log.closed:
+        raise LogFormatError(f'{path} is still being written or was not closed, not downsampling it')
+    data = log.read_block()
+    if data.shape[1]:
+        data = data[:, np.argsort(data[0], kind='stable')]
+        buckets = np.floor(data[0]/(resolution*1e9))
+        starts = np.flatnonzero(np.r_[True, buckets[1:] != buckets[:-1]])
+        finite = np.isfinite(data)
+        with np.errstate(invalid='ignore', divide='ignore'):
+            data = np.add.reduceat(np.where(finite, data, 0), starts, axis=1)/np.add.reduceat(finite, starts, axis=1)
+    temporary = path + '.tmp'
+    if os.path.exists(temporary):
+        os.remove(temporary)
+    writer = BinaryLogWriter(temporary, log.columns, codec=codec, resolution=resolution)
+    for start in range(0, data.shape[1], writer.chunk_rows):
+        writer.write_chunk(data[:, start:start + writer.chunk_rows])
+    if log._summary is not None:
+        writer.summary = log._summary
+    writer.close(sync=True)
+    os.replace(temporary, path)
+    _sync_directory(os.path.dirname(os.path.abspath(path)))
+    return data.shape[1]
+
+
+def _sync_directory(directory):
+    ''' Make a rename in directory durable, POSIX only (Windows can't open a folder for fsync) '''
+    if os.name == 'nt':
+        return
+    descriptor = os.open(directory, os.O_RDONLY)
+    try:
+        os.fsync(descriptor)
+    finally:
+        os.close(descriptor)
+
+
+def export_csv(log_path, csv_path=None):
+    ''' Write a binary log of SampleFrames out as the csv LoggingThread used to write (Time, DateTime, then the channels) '''
+    import csv
+    from Acquisition import SampleFrame
+    csv_path = os.path.splitext(log_path)[0] + '.csv' if csv_path is None else csv_path
+    log = BinaryLog(log_path)
+    data = log.read(SampleFrame.LOG_COLUMNS)
+    with open(csv_path, 'w', newline='') as csvfile:
+        w = csv.DictWriter(csvfile, SampleFrame.CSV_FIELDS)
+        w.writeheader()
+        values = np.stack([data[channel] for channel in SampleFrame.CHANNELS], axis=1)
+        for seq, (time_ns, row) in enumerate(zip(data[TIME_COLUMN], values)):
+            w.writerow(SampleFrame(seq, time_ns/1e9, row).as_row())
+    return csv_path
+
+
+if __name__ == '__main__':
+    import argparse
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    commands = parser.add_subparsers(dest='command', required=True)
+    export = commands.add_parser('export', help='convert a binary log to csv')
+    export.add_argument('log')
+    export.add_argument('csv', nargs='?', help='default: the log path with .csv')
+    info = commands.add_parser('info', help='columns, rows, chunks and summary of a binary log')
+    info.add_argument('log')
+    args = parser.parse_args()
+    if args.command == 'export':
+        print(f'wrote {export_csv(args.log, args.csv)}')
+    else:
+        log = BinaryLog(args.log)
+        print(f'{args.log}: {log.rows} rows in {len(log.index)} chunks, codec {log.codec}, created {log.header.get("created")}'
+              + (f', downsampled to {log.resolution} s' if log.resolution else ''))
+        summary = log.summary()
+        for column in log.columns:
+            if summary is None:
+                print(f'  {column}')
+            else:
+                s = summary[column]
+                print(f'  {column:<24}min {s["min"]:<12.6g}max {s["max"]:<12.6g}mean {s["mean"]:<12.6g}n {s["count"]}')
@@ -6,7 +6,7 @@ import pyqtgraph as pg
 import numpy as np
 import logging
 from Control_Parameters import CryoTree
-from Plots import LoggingPlot, BoxedPlot
+from Plots import LoggingPlot, BoxedPlot, DisplayRefresh, TimeAxis, ScatterTrail
 # from Control_Parameters import CtrlParamTree, ProcessTree
 # from Brooks0254_BuildUp import Brooks0254, MassFlowController
 # from PressureGauge_BuildUp import PressureGauge
@@ -19,6 +19,14 @@ import lakeshore
 os.environ["QT_AUTO_SCREEN_SCALE_FACTOR"]= "1"
 os.environ["QT_ENABLE_HIGHDPI_SCALING"] = "1"
 
+## per-task sample rates in Hz, anything not listed runs at the logging interval
+## e.g. {'Reaction Pressure':5, 'Cryo Pressure':5, 'Flows':1, 'Temperatures':0.2}
+CHANNEL_RATES = None
+## plots and flow labels are redrawn at most this often (Hz), frames arriving in between are drawn together
+DISPLAY_RATE = 20
+## points shown on the dose P-T plot
+DOSE_TRAIL = 2000
+
 
 class MainControlWindow(qw.QMainWindow):
     def __init__(self, logger, csv_path, max_points,testing = False):
@@ -37,17 +45,20 @@ class MainControlWindow(qw.QMainWindow):
 
         self.initUI()
 
-        self.logging_delay = int(self.logInput.text())
+        self.logging_delay = float(self.logInput.text())
         self.logInput.returnPressed.connect(self.updateLogInterval)
 
         self.initThreads()
 
         ## connect logging plots, if testing the logging thread will give dummy data
-        self.logging_thread.new_cryo_pressure_data.connect(self.cryoVac_grp.update_plot)
-        self.logging_thread.new_rxn_pressure_data.connect(self.rxnVac_grp.update_plot)
-        self.logging_thread.new_cryo_temp_data.connect(self.cryoTemp_grp.update_plot)
-        self.logging_thread.new_rxn_temp_data.connect(self.rxnTemp_grp.update_plot)
-        self.logging_thread.new_flow_data.connect(self.updateFlow)
+        ## every consumer gets the same SampleFrames so plotted values match the saved ones
+        ## frames are batched and applied once per display tick, the sample rate doesn't set the repaint rate
+        self.display_refresh = DisplayRefresh(DISPLAY_RATE,self)
+        for plot in [self.cryoVac_grp,self.rxnVac_grp,self.cryoTemp_grp,self.rxnTemp_grp]:
+            self.display_refresh.add(plot.update_frames)
+        self.display_refresh.add(self.time_axis.update) ## after the plots have their new points
+        self.display_refresh.add(self.updateFlow)
+        self.logging_thread.new_frame.connect(self.display_refresh.queue)
 
         self.logButton.clicked.connect(self.toggle_logging)
         self.setCryoButton.clicked.connect(self.change_cryo)
@@ -101,18 +112,21 @@ class MainControlWindow(qw.QMainWindow):
             self.logger.info('scrollPurge valve is closed, opening valve')
             self.daq.open_scrollPurge()
 
-    def updateFlow(self,new_data):
-        (Ar_sccm,H2S_sccm) = new_data
-        self.Arflow.setText(str(Ar_sccm))
-        self.H2Sflow.setText(str(H2S_sccm))
+    def updateFlow(self,frames):
+        ## newest reading of each flow in the batch, one setText per label
+        for channel, label in (('Ar sccm',self.Arflow),('H2S sccm',self.H2Sflow),('H2 sccm',self.H2flow)):
+            for frame in reversed(frames):
+                if frame.has(channel):
+                    label.setText(str(frame[channel]))
+                    break
         # self.flow.setText(str(new_data))
         # old_total = float(self.vol.text())
         # new_total = old_total + self.logging_delay/60*new_data
         # self.vol.setText(str(new_total))
 
     def updateLogInterval(self):
-        self.logging_delay = int(self.logInput.text())
-        self.logging_thread.delay = self.logging_delay
+        self.logging_delay = float(self.logInput.text())
+        self.logging_thread.set_delay(self.logging_delay)
         print(f'Updating log interval to {self.logging_delay}s')
 
    
@@ -184,9 +198,10 @@ class MainControlWindow(qw.QMainWindow):
                 print("Failed to connect to instrument")
                 self.close()
         
-        self.logging_thread = LoggingThread(self.logger,self.csv_path,self.ls335,self.b0254,self.mks902,self.mks925,self.save_csv.isChecked(),self.logging_delay,self.testing) 
-        self.purge_thread = PurgeThread(self.testing, self.logger, self.b0254,self.mks925,self.daq)
-        self.dose_thread = DoseThread(self.testing, self.logger, self.b0254,self.mks925,self.daq, self.ls335)
+        self.logging_thread = LoggingThread(self.logger,self.csv_path,self.ls335,self.b0254,self.mks902,self.mks925,self.save_csv.isChecked(),self.logging_delay,self.testing,rates=CHANNEL_RATES) 
+        ## mks925 is logged as 'Cryo Pressure', process threads take their readings from the logging frames
+        self.purge_thread = PurgeThread(self.testing, self.logger, self.b0254,self.mks925,self.daq,frames=self.logging_thread,pressure_channel='Cryo Pressure')
+        self.dose_thread = DoseThread(self.testing, self.logger, self.b0254,self.mks925,self.daq, self.ls335,frames=self.logging_thread,pressure_channel='Cryo Pressure')
 
     def setAr(self):
         self.ArRate = float(self.ArRateInput.text())
@@ -237,10 +252,9 @@ class MainControlWindow(qw.QMainWindow):
         self.currentProcessPlot_grp.group.setTitle("Dose Process")
         self.currentProcessPlot.setLabel('left',"Pressure", units='Torr')
         self.currentProcessPlot.setLabel('bottom',"Temperature",units='K')
-        self.currentProcessPlot_grp.trace = pg.ScatterPlotItem(symbol='o',size=10,color='b')
-        self.currentProcessPlot_grp.last_point = pg.ScatterPlotItem(symbol='+',size=30,color='#08F7FE')
+        ## newest DOSE_TRAIL points, fading with age, the newest one marked with a cross
+        self.currentProcessPlot_grp.trace = ScatterTrail(color='b',size=10,trail=DOSE_TRAIL,last_color='#08F7FE',last_size=30)
         self.currentProcessPlot.addItem(self.currentProcessPlot_grp.trace)
-        self.currentProcessPlot.addItem(self.currentProcessPlot_grp.last_point)
         self.dose_thread.new_data.connect(self.currentProcessPlot_grp.update_xy)
         self.dose_thread.finished.connect(self.doseFinished)
         # setup and run thread
@@ -257,10 +271,9 @@ class MainControlWindow(qw.QMainWindow):
         self.currentProcessPlot_grp.group.setTitle("Dose Process")
         self.currentProcessPlot.setLabel('left',"Pressure", units='Torr')
         self.currentProcessPlot.setLabel('bottom',"Temperature",units='K')
-        self.currentProcessPlot_grp.trace = pg.ScatterPlotItem(symbol='o',size=10,color='b')
-        self.currentProcessPlot_grp.last_point = pg.ScatterPlotItem(symbol='+',size=30,color='#08F7FE')
+        ## newest DOSE_TRAIL points, fading with age, the newest one marked with a cross
+        self.currentProcessPlot_grp.trace = ScatterTrail(color='b',size=10,trail=DOSE_TRAIL,last_color='#08F7FE',last_size=30)
         self.currentProcessPlot.addItem(self.currentProcessPlot_grp.trace)
-        self.currentProcessPlot.addItem(self.currentProcessPlot_grp.last_point)
         self.dose_thread.new_data.connect(self.currentProcessPlot_grp.update_xy)
         self.dose_thread.finished.connect(self.doseFinished)
         # setup and run thread - 
@@ -283,13 +296,19 @@ class MainControlWindow(qw.QMainWindow):
             ramp_enable = 0
         ramp_rate = self.cryoTree.getCryoValue('Ramp Rate (K/min)')
         setpoint = self.cryoTree.getCryoValue('Setpoint (K)')
+        ## ramp and setpoint are sent separately, so a refused ramp doesn't lose the setpoint
         try:
-            self.ls335.set_setpoint_ramp_parameter(loop,ramp_enable,ramp_rate)
+            self.ls335.command(f'RAMP {loop},{ramp_enable},{ramp_rate}')
         except lakeshore.generic_instrument.InstrumentException as ex:
-            self.logger.debug(f"Lakeshore error: {ex}")
-            print(f'Failed to change ramp parameter to enabled={ramp_enable}, rate={ramp_rate}')
-        self.ls335.set_control_setpoint(loop, setpoint)
-        self.logger.info(f'Setting cryostat loop {loop} to {setpoint} K at rate of {ramp_rate} K/min')
+            self.logger.warning(f'Failed to change ramp parameter to enabled={ramp_enable}, rate={ramp_rate}: {ex}')
+        else:
+            self.logger.info(f'Setting cryostat loop {loop} ramp to {ramp_rate} K/min (enabled={ramp_enable})')
+        try:
+            self.ls335.command(f'SETP {loop},{setpoint}')
+        except lakeshore.generic_instrument.InstrumentException as ex:
+            self.logger.warning(f'Failed to change setpoint of loop {loop} to {setpoint} K: {ex}')
+        else:
+            self.logger.info(f'Setting cryostat loop {loop} to {setpoint} K')
 
 
 
@@ -303,10 +322,10 @@ class MainControlWindow(qw.QMainWindow):
         layout = qw.QGridLayout()  # All the widgets will be in a grid in the main box
         self.mainbox.setLayout(layout)  # set the layout
 
-        self.cryoTemp_grp = LoggingPlot('Cryo Temperature',"#FF035B",self.max_points)
-        self.cryoVac_grp = LoggingPlot('Cryo Vacuum','#08F7FE',self.max_points)
-        self.rxnVac_grp = LoggingPlot('Process Pressure','#08F7FE',self.max_points)
-        self.rxnTemp_grp = LoggingPlot('Process Temperature','#FF035B',self.max_points)
+        self.cryoTemp_grp = LoggingPlot('Cryo Temperature',"#FF035B",self.max_points,glow=True)
+        self.cryoVac_grp = LoggingPlot('Cryo Vacuum','#08F7FE',self.max_points,channel='Cryo Pressure',glow=True)
+        self.rxnVac_grp = LoggingPlot('Process Pressure','#08F7FE',self.max_points,channel='Reaction Pressure',glow=True)
+        self.rxnTemp_grp = LoggingPlot('Process Temperature','#FF035B',self.max_points,channel='Reaction Temperature',glow=True)
         self.cryoTemp_plot = self.cryoTemp_grp.plot
         self.cryoVac_plot = self.cryoVac_grp.plot
         self.rxnVac_plot = self.rxnVac_grp.plot
@@ -319,9 +338,14 @@ class MainControlWindow(qw.QMainWindow):
         for plt in [self.cryoTemp_plot,self.cryoVac_plot,self.rxnTemp_plot,self.rxnVac_plot]:
             plt.setAxisItems({'bottom':pg.DateAxisItem()})
 
-        self.cryoVac_plot.setXLink(self.cryoTemp_plot)
-        self.rxnVac_plot.setXLink(self.rxnTemp_plot)
-        self.rxnTemp_plot.setXLink(self.cryoTemp_plot)
+        ## one time axis for all four plots (x-linked to cryoTemp_plot), scrolled once per display tick
+        ## panning or zooming a plot stops the scrolling until Follow Latest is pressed again
+        self.time_axis = TimeAxis([self.cryoTemp_grp,self.cryoVac_grp,self.rxnVac_grp,self.rxnTemp_grp],self)
+        self.followButton = qw.QPushButton("Follow Latest")
+        self.followButton.setCheckable(True)
+        self.followButton.setChecked(True)
+        self.followButton.clicked.connect(lambda checked: self.time_axis.follow() if checked else self.time_axis.freeze())
+        self.time_axis.following_changed.connect(self.followButton.setChecked)
 
         # self.currentProcessPlot_grp = BoxedPlot('Current Process','#08F7FE')
         # self.currentProcessPlot = self.currentProcessPlot_grp.plot
@@ -329,7 +353,7 @@ class MainControlWindow(qw.QMainWindow):
 
         self.save_csv = qw.QCheckBox('Save to csv')
         self.logInput = qw.QLineEdit('30')
-        self.logInput.setValidator(QtGui.QIntValidator())
+        self.logInput.setValidator(QtGui.QDoubleValidator(0.05,3600,2)) ## sub-second intervals are fine now
         ## TODO: write function to update interval when this value changes
         self.logLabel = qw.QLabel(' Interval (sec):')
         self.logButton = qw.QPushButton("Start Logging")
@@ -352,6 +376,8 @@ class MainControlWindow(qw.QMainWindow):
         # self.vol_units = qw.QLabel('cm3')
         self.H2Sflow = qw.QLabel('0.0')
         self.H2Sflow_units = qw.QLabel('sccm H2S')
+        self.H2flow = qw.QLabel('0.0')
+        self.H2flow_units = qw.QLabel('sccm H2')
         self.flowBox = qw.QWidget()
         masterLayoutflow = qw.QVBoxLayout()
         flowLayout = qw.QGridLayout()
@@ -361,6 +387,8 @@ class MainControlWindow(qw.QMainWindow):
         flowLayout.addWidget(self.H2Sflow,        0,0,1,1)
         flowLayout.addWidget(self.Arflow_units,   1,1,1,1)
         flowLayout.addWidget(self.H2Sflow_units,  0,1,1,1)
+        flowLayout.addWidget(self.H2flow,         2,0,1,1)
+        flowLayout.addWidget(self.H2flow_units,   2,1,1,1)
         masterLayoutflow.addWidget(flowgroup)
         self.flowBox.setLayout(masterLayoutflow)
 
@@ -423,6 +451,7 @@ class MainControlWindow(qw.QMainWindow):
         layout.addWidget(self.setArRateButton,   2,2,1,1)
         layout.addWidget(self.flowBox,           3,1,2,2)
         layout.addWidget(self.scrollPurgeButton, 5,1,1,1)
+        layout.addWidget(self.followButton,      6,1,1,1)
 
 
         
@@ -465,7 +494,7 @@ class MainControlWindow(qw.QMainWindow):
         self.mks902._connection.close()
         self.mks925._connection.close()
         if self.b0254 != 'Brooks0254':
-            self.b0254._connection.close()
+            self.b0254.close()
         if self.ls335 != 'Model335':
             self.ls335.disconnect_usb()
         self.daq.close_connections()
@@ -2,8 +2,11 @@ import re,pyvisa
 import nidaqmx
 # from lakeshore import Model335
 import numpy as np
-import time, serial
-from threading import Lock
+import time, serial, os, json
+import heapq, itertools
+from threading import Lock, Condition, Thread
+from concurrent.futures import Future
+import Protocol
 
 class DAQ():
     '''Class for communicating with ni daq that controls relays'''
@@ -128,46 +131,200 @@ class TemperatureControl():
         self.temperatureController.set_setpoint_ramp_parameter(self.loop,self.ramp_bool,self.ramp_rate)
 
 
+class CryoTelemetry:
+    '''
+    Everything the logging needs from the Lakeshore 335 in one round trip on top of the lakeshore.Model335 connection:
+    both temperatures, heater output (%), the active setpoint and the ramp status are sent as one semicolon-joined query.
+    The reply is parsed into the same preallocated float64 array every cycle.
+    '''
+    FIELDS = ('Cryo Temperature','Reaction Temperature','Heater Output','Cryo Setpoint','Setpoint Ramping')
+
+    def __init__(self,model335,loop=1):
+        self._instrument = model335
+        self.loop = loop
+        ## built once, the 335 answers multiple queries separated by ; with replies separated by ;
+        self._query = ';'.join(('KRDG? A','KRDG? B',f'HTR? {loop}',f'SETP? {loop}',f'RAMPST? {loop}'))
+        self.values = np.full(len(self.FIELDS),np.nan)
+
+    def read(self):
+        ''' Returns self.values (overwritten on every call), raises ValueError on a malformed reply '''
+        reply = self._instrument.query(self._query,check_errors=False)
+        fields = reply.split(';')
+        if len(fields) != len(self.FIELDS):
+            raise ValueError(f'Unexpected Lakeshore telemetry reply {reply}')
+        values = self.values
+        for i, field in enumerate(fields):
+            values[i] = float(field)
+        return values
+
+    def read_dict(self):
+        return dict(zip(self.FIELDS,self.read()))
+
+
 class PressureGauge:
     '''
     Object that holds the serial communication for a pressure gauge
+    MKS replies are framed as @<address>ACK<value>;FF (or NAK) with no newline, so reads stop at the ;FF terminator
+    and each command has its own latency budget instead of waiting on a blanket serial timeout.
     '''
+    TERMINATOR = Protocol.MKS_TERMINATOR
+    FRAME_OK = Protocol.OK
+    FRAME_NAK = Protocol.NAK # gauge answered but refused the command
+    FRAME_TIMEOUT = Protocol.TIMEOUT # no complete frame within the latency budget
+    FRAME_MALFORMED = Protocol.MALFORMED # complete frame that isn't @xxxACK...;FF or @xxxNAK...;FF
+
+    ## seconds the gauge gets to start answering each command type, the bytes on the wire are added on top
+    RESPONSE_BUDGETS = {'PR':0.1,'AD':0.1,'U':0.2,'BR':0.2,'TST':0.2}
+    DEFAULT_BUDGET = 0.2
+    REPLY_BYTES = 20 # longest reply we expect, e.g. @253ACK7.360E+02;FF
+
+    ## baud rate each port last agreed on with its gauge, so a renegotiated link comes back up at the same rate
+    ## (runtime state, kept with the logs rather than in the source folder)
+    BAUD_STORE = os.path.join(os.path.dirname(os.path.abspath(__file__)),'logs','gauge_baud.json')
+    DEFAULT_BAUD = 9600
+    BAUD_SETTLE = 0.05 # s to let the gauge switch rates after acknowledging BR!
+    BAUD_PROBES = 3
 
-    def __init__(self,testing,logger,com_port,deviceAddress='254'):
+    def __init__(self,testing,logger,com_port,deviceAddress='254',baudrate=None):
         '''com_port (e.g. 'COM3') and device Address is string of 3 ints
+        baudrate defaults to the rate stored for com_port by renegotiate_baud, 9600 if there is none;
+        a stored rate is checked with a first read, see recover_baud
         '''
+        stored = baudrate is None
+        if stored:
+            baudrate = self.stored_baud(com_port)
         self.testing = testing
         self.logger = logger
+        self.com_port = com_port
+        self.response_budgets = dict(self.RESPONSE_BUDGETS)
+        self.frame_stats = {self.FRAME_OK:0,self.FRAME_NAK:0,self.FRAME_TIMEOUT:0,self.FRAME_MALFORMED:0}
+        self.commands = Protocol.mks_commands(deviceAddress) # prebuilt command bytes for this address
+        self._budget_cache = {} # (command bytes, baud rate): budget
         if not self.testing:
-            self._connection = serial.Serial(port=com_port,baudrate=9600,parity=serial.PARITY_NONE,bytesize=8,stopbits=serial.STOPBITS_ONE,timeout=1)
+            self._connection = serial.Serial(port=com_port,baudrate=baudrate,parity=serial.PARITY_NONE,bytesize=8,stopbits=serial.STOPBITS_ONE,timeout=self.DEFAULT_BUDGET)
             self._address: str = deviceAddress
             self.logger = logger
             self.com_lock = Lock()
             self.virtual = False
         elif self.testing:
             try:
-                self._connection = serial.Serial(port=com_port,baudrate=9600,parity=serial.PARITY_NONE,bytesize=8,stopbits=serial.STOPBITS_ONE,timeout=1)
+                self._connection = serial.Serial(port=com_port,baudrate=baudrate,parity=serial.PARITY_NONE,bytesize=8,stopbits=serial.STOPBITS_ONE,timeout=self.DEFAULT_BUDGET)
                 self._address: str = deviceAddress
                 self.logger = logger
                 self.com_lock = Lock()
                 self.virtual = False
             except:
                 self.virtual = True
+        if stored and not self.virtual:
+            self.recover_baud()
+
+    def budget_for(self,message):
+        ''' Latency budget (s) for message (bytes or str): time for the command and reply bytes at the current baud rate plus the gauge's turnaround '''
+        if isinstance(message, str):
+            message = message.encode()
+        key = (message, self._connection.baudrate)
+        budget = self._budget_cache.get(key)
+        if budget is None:
+            budget = self._budget_cache[key] = self._turnaround(message) + self._wire_time(message)
+        return budget
+
+    def batch_budget(self,messages):
+        ''' Budget (s) for a pipelined batch: one turnaround (the longest) plus every command and reply on the wire '''
+        return max(self._turnaround(message) for message in messages) + sum(self._wire_time(message) for message in messages)
+
+    def _turnaround(self,message):
+        command = message[4:].split(b'?')[0].split(b'!')[0].decode() # b'@253PR1?;FF' -> 'PR1'
+        for prefix, budget in self.response_budgets.items():
+            if command.startswith(prefix):
+                return budget
+        return self.DEFAULT_BUDGET
 
+    def _wire_time(self,message):
+        return (len(message) + self.REPLY_BYTES)*10/self._connection.baudrate # 8N1 is 10 bits per byte
+
+    def _read_frame(self,budget):
+        ''' Returns as soon as ;FF arrives, or whatever came in once budget (s) runs out. Call with com_lock held '''
+        if self._connection.timeout != budget:
+            self._connection.timeout = budget
+        return self._connection.read_until(self.TERMINATOR)
+
+    def _exchange(self,message,budget=None):
+        ''' Write message (bytes or str) and return (raw reply, budget used) '''
+        if isinstance(message, str):
+            message = message.encode()
+        if budget is None:
+            budget = self.budget_for(message)
+        with self.com_lock:
+            self._connection.write(message)
+            return self._read_frame(budget), budget
+
+    def _count(self,status,message,reply,budget):
+        self.frame_stats[status] += 1
+        if status == self.FRAME_TIMEOUT:
+            self.logger.debug(f'{self.com_port}: no ;FF within {budget*1000:.0f} ms for {message}, received {reply}')
+        elif status == self.FRAME_MALFORMED:
+            self.logger.debug(f'{self.com_port}: malformed reply to {message}: {reply}')
+
+    def classify(self,reply):
+        ''' (status, payload bytes) for a raw reply '''
+        return Protocol.parse_mks(reply)
+
+    def query_frame(self,message,budget=None):
+        ''' Write message and read one framed reply. Returns (status, payload) where payload is the bytes between ACK/NAK and ;FF '''
+        reply, budget = self._exchange(message,budget)
+        status, payload = Protocol.parse_mks(reply)
+        self._count(status,message,reply,budget)
+        return status, payload
+
+    def query_pipeline(self,messages,timeout=None):
+        '''
+        Write every message (bytes or str) in one go, then read the framed replies in order, e.g. PR1-PR4 from one gauge
+        or PR1 from several addresses sharing an RS-485 line. The whole batch shares one deadline, timeout (s) defaults to batch_budget.
+        Returns a list of (status, payload) like query_frame, TIMEOUT for every reply that missed the deadline.
+        '''
+        messages = [message.encode() if isinstance(message, str) else message for message in messages]
+        if timeout is None:
+            timeout = self.batch_budget(messages)
+        replies = []
+        with self.com_lock:
+            deadline = time.monotonic() + timeout
+            self._connection.write(b''.join(messages))
+            for message in messages:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                replies.append(self._read_frame(remaining))
+            if len(replies) < len(messages) or not replies[-1].endswith(self.TERMINATOR):
+                self._connection.reset_input_buffer() # late replies would be taken for the next command's
+        results = []
+        for i, message in enumerate(messages):
+            reply = replies[i] if i < len(replies) else b''
+            status, payload = Protocol.parse_mks(reply)
+            self._count(status,message,reply,timeout)
+            results.append((status,payload))
+        return results
+
+    def read_pressures(self,addresses):
+        ''' PR1 from every gauge address on this port in one pipelined batch. Returns {address: pressure}, NaN where a gauge didn't answer '''
+        messages = [Protocol.mks_commands(address).pressure[1] for address in addresses]
+        pressures = {}
+        for address, (status, payload) in zip(addresses,self.query_pipeline(messages)):
+            try:
+                pressures[address] = float(payload) if status == self.FRAME_OK else np.nan
+            except ValueError:
+                pressures[address] = np.nan
+        return pressures
 
     def _ask_address(self):
         ''' function to get address of specific pressure gauge. 254 addresses all devices on port.
         Should return '@[ADR]AD[ADR];FF', most likely '@253AD253;FF'
         '''
-        self._connection.write(b'@254AD?;FF')
-        response = self._connection.readline()
+        response, budget = self._exchange(Protocol.mks_commands('254').address_query)
         return response
     
     def query(self,message):
-        ''' Helper function to write and read with com_lock. Takes message as string, may need to decode response'''
-        with self.com_lock:
-            self._connection.write(message.encode())
-            return self._connection.readline()
+        ''' Helper function to write and read with com_lock. Takes message as bytes or string, returns the raw reply bytes up to ;FF'''
+        return self._exchange(message)[0]
     
     def test(self,address='254'):
         ''' Function to test for communication with pressure gauge. Can supply address if multiple devices could be accessed by 254.
@@ -176,53 +333,273 @@ class PressureGauge:
         print(f"testing pressure gauge with address {address}")
         with self.com_lock:
             self._connection.write(f'@{address}TST!ON;FF'.encode())
-            response = str(self._connection.readline())
+            response = str(self._read_frame(self.budget_for('@254TST!ON;FF')))
             self.logger.debug(response)
             time.sleep(5) # wait 10 s to see flashing
             self._connection.write(f'@{address}TST!OFF;FF'.encode())
-            response = str(self._connection.readline())
+            response = str(self._read_frame(self.budget_for('@254TST!OFF;FF')))
             self.logger.debug(response)
 
     def get_all_pressures(self):
         '''
         testing method to try to figure out the difference between PR1,2,3, and 4
         '''
-        for i in range(1,5):
-            command = f'@{self._address}PR{i}?;FF'
-            with self.com_lock:
-                self._connection.write(command.encode('utf-8'))
-                # response = self._connection.read_bytes(15)
-                response = self._connection.readline()
-                # print(f'PR{i} = {response}')
+        results = self.query_pipeline(self.commands.pressure[1:])
+        for i, (status, response) in enumerate(results,start=1):
+            self.logger.debug(f'PR{i} = {status} {response}')
+        return results
+
+    def read_pressure(self):
+        ''' PR1 reading as a float, raises TimeoutError if the gauge didn't answer in time and ValueError for NAK or a malformed reply '''
+        command = self.commands.pressure[1]
+        reply, budget = self._exchange(command)
+        status, value = Protocol.parse_mks_float(reply)
+        self._count(status,command,reply,budget)
+        if status == self.FRAME_OK:
+            return value
+        if status == self.FRAME_TIMEOUT:
+            raise TimeoutError(f'{self.com_port}: no pressure reply within {budget*1000:.0f} ms')
+        raise ValueError(f'{self.com_port}: {status} pressure reply {reply}')
 
     def get_pressure(self):
-        '''NOTE: PR1 - PR4 exist, but seems like PR1-PR3 are the same, PR4 is scientific notation'''
-        command = f'@{self._address}PR1?;FF'
-        response = self.query(command).decode()
-        if re.search('\\d*ACK',response) is not None:
-            list = re.split('ACK|;',response)
-            # print(list)
-            value = list[1]
-            # print(value)
-            return float(value)
-        else:
-            self.logger.warning(f'Failed to receive pressure reading... Received {response}')
+        '''NOTE: PR1 - PR4 exist, but seems like PR1-PR3 are the same, PR4 is scientific notation
+        Returns -1 if the reading failed, see read_pressure for the reason'''
+        try:
+            return self.read_pressure()
+        except (TimeoutError,ValueError) as e:
+            self.logger.warning(f'Failed to receive pressure reading... {e}')
             return -1
     
     def set_gauge_params(self,unit='TORR',address='254',baud_rate='9600'):
         ''' From manuals, seems to be the same for both models. I have assumed these are the only settings of interest
         Note the ! sets, while ? is for queries'''
-        response = self.query( f'@{self._address}U!{unit};FF')
-        if re.search('\\d*ACK',response) is None:
-            self.logger.warning(f'Failed to set pressure unit... Received {response}')
-        response = self.query( f'@{self._address}AD!{address};FF')
-        if re.search(f'\\d*ACK',response) is None:
-            self.logger.warning(f'Failed to set address... Received {response}')
+        status, response = self.query_frame(self.commands.set('U',unit))
+        if status != self.FRAME_OK:
+            self.logger.warning(f'Failed to set pressure unit... Received {status} {response}')
+        status, response = self.query_frame(self.commands.set('AD',address))
+        if status != self.FRAME_OK:
+            self.logger.warning(f'Failed to set address... Received {status} {response}')
+        else:
+            self._address = address ## the gauge acknowledged the new address
+            self.commands = Protocol.mks_commands(address)
+        if not self.renegotiate_baud(int(baud_rate)):
+            self.logger.warning(f'Failed to set baud rate to {baud_rate}, staying at {self._connection.baudrate}')
+
+    def probe(self):
+        ''' True if the gauge answers a pressure query at the current host baud rate '''
+        for attempt in range(self.BAUD_PROBES):
+            status, payload = self.query_frame(self.commands.pressure[1])
+            if status == self.FRAME_OK:
+                return True
+        return False
+
+    def _set_host_baud(self,baudrate):
+        with self.com_lock:
+            self._connection.baudrate = baudrate
+            time.sleep(self.BAUD_SETTLE)
+            self._connection.reset_input_buffer()
+
+    def renegotiate_baud(self,baudrate):
+        '''
+        Switch the gauge (BR!) and the host port to baudrate together, then check the link with a probe query.
+        If the probe fails the gauge is told to go back (at the new rate) and the host returns to the old rate.
+        The agreed rate is stored in BAUD_STORE for the next startup. Returns True if the link runs at baudrate.
+        '''
+        old = self._connection.baudrate
+        if baudrate == old:
+            return True
+        status, response = self.query_frame(self.commands.set('BR',baudrate))
+        if status != self.FRAME_OK:
+            self.logger.warning(f'{self.com_port}: gauge refused baud rate {baudrate}: {status} {response}')
+            return False
+        ## the gauge acknowledges at the old rate, then switches
+        self._set_host_baud(baudrate)
+        if self.probe():
+            self.logger.info(f'{self.com_port}: baud rate changed from {old} to {baudrate}')
+            self.store_baud(baudrate)
+            return True
+
+        self.logger.warning(f'{self.com_port}: no reply at {baudrate} baud, rolling back to {old}')
+        self.query_frame(self.commands.set('BR',old)) # in case the gauge did switch but the probe reply was lost
+        self._set_host_baud(old)
+        if self.probe():
+            self.store_baud(old)
         else:
-            self._address = address ## assumes it succeded
-        response = self.query( f'@{self._address}BR!{baud_rate};FF')
-        if re.search("\\d*ACK",response) is None:
-            self.logger.warning(f'Failed to set baud rate... Received {response}')
+            self.logger.error(f'{self.com_port}: gauge does not answer at {old} or {baudrate} baud')
+        return False
+
+    def recover_baud(self):
+        '''
+        Check the link at the host's rate (the stored one at startup); if the first read fails try DEFAULT_BAUD
+        (a gauge that was reset or power cycled) and store whichever rate answers. True if one did
+        '''
+        if self.probe():
+            return True
+        tried = self._connection.baudrate
+        if tried != self.DEFAULT_BAUD:
+            self._set_host_baud(self.DEFAULT_BAUD)
+            if self.probe():
+                self.logger.warning(f'{self.com_port}: no reply at the stored {tried} baud, gauge answers at {self.DEFAULT_BAUD}')
+                self.store_baud(self.DEFAULT_BAUD)
+                return True
+            self._set_host_baud(tried)
+        self.logger.warning(f'{self.com_port}: gauge does not answer at {tried} or {self.DEFAULT_BAUD} baud')
+        return False
+
+    @classmethod
+    def stored_baud(cls,com_port):
+        try:
+            with open(cls.BAUD_STORE) as f:
+                return int(json.load(f).get(com_port,cls.DEFAULT_BAUD))
+        except (OSError,ValueError):
+            return cls.DEFAULT_BAUD
+
+    def store_baud(self,baudrate):
+        try:
+            with open(self.BAUD_STORE) as f:
+                rates = json.load(f)
+        except (OSError,ValueError):
+            rates = {}
+        rates[self.com_port] = baudrate
+        try:
+            os.makedirs(os.path.dirname(self.BAUD_STORE),exist_ok=True)
+            with open(self.BAUD_STORE,'w') as f:
+                json.dump(rates,f,indent=1)
+        except OSError as e:
+            self.logger.warning(f'Could not store baud rate for {self.com_port}: {e}')
+
+
+class CommandQueue:
+    '''
+    Serializes every transaction on one physical connection, e.g. the single pyvisa session MFC1-3 share on the Brooks 0254.
+    Waiting commands go out in priority order (EMERGENCY, then SETPOINT, then READ) and first come first served within a level,
+    so an abort or setpoint never waits behind a burst of logging reads. A read that is already waiting is not sent twice,
+    the second caller gets the same reply.
+    With raw=True replies are the undecoded bytes from read_raw (terminator included) for parsing with Protocol.
+    '''
+    EMERGENCY = 0
+    SETPOINT = 1
+    READ = 2
+
+    def __init__(self, connection, logger, name='connection', raw=False):
+        self._connection = connection
+        self.logger = logger
+        self.name = name
+        self.raw = raw
+        self._cond = Condition()
+        self._heap = []  # (priority, order, command, future, batch timeout)
+        self._waiting_reads = {}  # command: future, for coalescing
+        self._order = itertools.count()
+        self.running = True
+        self._worker = Thread(target=self._run, name=f'CommandQueue-{name}', daemon=True)
+        self._worker.start()
+
+    def submit(self, command, priority=READ, batch_timeout=None):
+        ''' Queue command and return a Future for the reply (str, or bytes if raw).
+        A tuple of commands is sent as one pipelined transaction and the future gives a list of replies in the same order,
+        None for any reply that didn't arrive within batch_timeout (s) of the first write'''
+        with self._cond:
+            if not self.running:
+                raise OSError(f'Command queue for {self.name} is closed')
+            if priority == CommandQueue.READ and command in self._waiting_reads:
+                return self._waiting_reads[command]
+            future = Future()
+            heapq.heappush(self._heap, (priority, next(self._order), command, future, batch_timeout))
+            if priority == CommandQueue.READ:
+                self._waiting_reads[command] = future
+            self._cond.notify()
+        return future
+
+    def query(self, command, priority=READ, timeout=None):
+        ''' Blocking write/read through the queue, raises whatever the connection raised (e.g. VisaIOError) '''
+        return self.submit(command, priority).result(timeout)
+
+    def query_batch(self, commands, priority=READ, timeout=None, batch_timeout=None):
+        ''' Blocking pipelined transaction: every command is written back to back, then the replies are read in order.
+        batch_timeout (s) bounds the whole transaction on the wire, timeout is how long to wait for it including time in the queue '''
+        return self.submit(tuple(commands), priority, batch_timeout).result(timeout)
+
+    def depth(self):
+        ''' Number of commands waiting (not counting the one on the wire) '''
+        with self._cond:
+            return len(self._heap)
+
+    def depth_by_priority(self):
+        with self._cond:
+            depths = {CommandQueue.EMERGENCY: 0, CommandQueue.SETPOINT: 0, CommandQueue.READ: 0}
+            for entry in self._heap:
+                depths[entry[0]] += 1
+            return depths
+
+    def close(self):
+        ''' Stop accepting commands, anything still waiting fails with OSError '''
+        with self._cond:
+            self.running = False
+            for priority, order, command, future, batch_timeout in self._heap:
+                future.set_exception(OSError(f'Command queue for {self.name} closed before {command} was sent'))
+            self._heap.clear()
+            self._waiting_reads.clear()
+            self._cond.notify()
+
+    def _run(self):
+        while True:
+            with self._cond:
+                self._cond.wait_for(lambda: self._heap or not self.running)
+                if not self.running:
+                    return
+                priority, order, command, future, batch_timeout = heapq.heappop(self._heap)
+                if self._waiting_reads.get(command) is future:
+                    del self._waiting_reads[command]
+            if not future.set_running_or_notify_cancel():
+                continue
+            try:
+                if isinstance(command, tuple):
+                    future.set_result(self._pipeline(command, batch_timeout))
+                else:
+                    future.set_result(self._query(command))
+            except Exception as e:
+                future.set_exception(e)
+
+    def _query(self, command):
+        if self.raw:
+            self._connection.write(command)
+            return self._connection.read_raw()
+        return self._connection.query(command)
+
+    def _pipeline(self, commands, batch_timeout=None):
+        ''' Write every command, then read the replies in order. Replies missing at the deadline (or the connection timeout) are None '''
+        read = self._connection.read_raw if self.raw else self._connection.read
+        replies = [None]*len(commands)
+        connection_timeout = self._connection.timeout # ms for pyvisa
+        deadline = None if batch_timeout is None else time.monotonic() + batch_timeout
+        for command in commands:
+            self._connection.write(command)
+        try:
+            for i in range(len(commands)):
+                if deadline is not None:
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0:
+                        break
+                    self._connection.timeout = max(remaining*1000, 1)
+                replies[i] = read()
+        except pyvisa.errors.VisaIOError as e:
+            if e.error_code != pyvisa.constants.StatusCode.error_timeout:
+                self._flush()
+                raise
+        finally:
+            if deadline is not None:
+                self._connection.timeout = connection_timeout
+        if replies[-1] is None:
+            self.logger.debug(f'{self.name}: {replies.count(None)} of {len(commands)} replies missing from batch')
+            self._flush()
+        return replies
+
+    def _flush(self):
+        ''' Don't leave late replies in the buffer for the next transaction to pick up '''
+        try:
+            self._connection.flush(pyvisa.constants.BufferOperation.discard_read_buffer)
+        except Exception as e:
+            self.logger.debug(f'Could not flush {self.name} read buffer: {e}')
 
 
 class Brooks0254:
@@ -286,12 +663,22 @@ class Brooks0254:
         'batch': 2,
         'blend': 3
     }
+
+    ## one row per installed MFC from read_all()
+    STATUS_OK = 0
+    STATUS_UNEXPECTED = 1 # reply was not a polled measured value response
+    STATUS_NO_REPLY = 2
+    STATUS_BAD_CHECKSUM = 3
+    READING_DTYPE = np.dtype([('channel','i4'),('pv','f8'),('totalizer','f8'),('status','i4'),('time','f8')])
+    BATCH_TIMEOUT = 2.0 # s for a whole pipelined transaction (one round trip plus the bytes for every command)
     
-    def __init__(self,testing, logger, instrument, deviceAddress='29751'):
+    def __init__(self,testing, logger, instrument, deviceAddress='29751', validate_checksum=False):
         '''
         pyvisaConnection = pyvisa.ResourceManager().open_resource()
         MFCs: list of str naming the gases being controlled
         deviceAddress: str of len 5
+        validate_checksum: reject replies whose <sum> field doesn't match, see Protocol.parse_brooks
+        (off until the <sum> algorithm is confirmed on the instrument)
 
         As if July 2025, MFCs are installed, H2S is top, Ar is middle, H2 is bottom,
         Let's call H2S = MFC1, Ar = MFC2, H2 = MFC3
@@ -299,6 +686,8 @@ class Brooks0254:
         '''
         self.logger = logger
         self.testing = testing
+        self.resource_name = instrument
+        self.validate_checksum = validate_checksum
         if self.testing:
             try:
                 self._connection = pyvisa.ResourceManager().open_resource(instrument)
@@ -312,9 +701,15 @@ class Brooks0254:
             self._address = deviceAddress
             self.virtual = False
 
-        self.MFC1 = MassFlowController(self.logger,channel=1,pyvisaConnection=self._connection,deviceAddress=self._address,virtual=self.virtual)
-        self.MFC2 = MassFlowController(self.logger,channel=2,pyvisaConnection=self._connection,deviceAddress=self._address,virtual=self.virtual)
-        self.MFC3 = MassFlowController(self.logger,channel=3,pyvisaConnection=self._connection,deviceAddress=self._address,virtual=self.virtual)
+        ## one queue for the one serial link, every MFC command goes through it
+        if self.virtual:
+            self.command_queue = None
+        else:
+            self.command_queue = CommandQueue(self._connection,self.logger,name=instrument,raw=True)
+
+        self.MFC1 = MassFlowController(self.logger,channel=1,commandQueue=self.command_queue,deviceAddress=self._address,virtual=self.virtual,validateChecksum=validate_checksum)
+        self.MFC2 = MassFlowController(self.logger,channel=2,commandQueue=self.command_queue,deviceAddress=self._address,virtual=self.virtual,validateChecksum=validate_checksum)
+        self.MFC3 = MassFlowController(self.logger,channel=3,commandQueue=self.command_queue,deviceAddress=self._address,virtual=self.virtual,validateChecksum=validate_checksum)
 
         self.MFC_list = [self.MFC1,self.MFC2, self.MFC3]
 
@@ -322,6 +717,82 @@ class Brooks0254:
 
     def readValue(self):
         return 0
+
+    def read_all(self):
+        '''
+        Process value, totalizer and status of every installed MFC in one transaction on the link:
+        the K polls for all channels are written back to back and the replies read in order.
+        Returns a structured array with READING_DTYPE, one row per MFC in MFC_list; NaN values where a channel did not answer.
+        '''
+        readings = np.zeros(len(self.MFC_list), dtype=self.READING_DTYPE)
+        readings['channel'] = [MFC.channel for MFC in self.MFC_list]
+        readings['pv'] = np.nan
+        readings['totalizer'] = np.nan
+        readings['status'] = self.STATUS_NO_REPLY
+        readings['time'] = time.time()
+        if self.virtual:
+            print([MFC.measure_command for MFC in self.MFC_list])
+            return readings
+        try:
+            replies = self.command_queue.query_batch([MFC.measure_command for MFC in self.MFC_list],CommandQueue.READ,batch_timeout=self.BATCH_TIMEOUT)
+        except pyvisa.errors.VisaIOError as e:
+            print("Failed to retrieve measured values from MFC controller")
+            self.logger.debug(f'Pyvisa error: {e}')
+            return readings
+        readings['time'] = time.time()
+        for i, reply in enumerate(replies):
+            if reply is None:
+                continue # status stays STATUS_NO_REPLY
+            status, pv, totalizer = Protocol.parse_brooks_measured(reply,self.validate_checksum)
+            if status == Protocol.OK:
+                readings['pv'][i] = pv
+                readings['totalizer'][i] = totalizer
+                readings['status'][i] = self.STATUS_OK
+            elif status == Protocol.CHECKSUM:
+                readings['status'][i] = self.STATUS_BAD_CHECKSUM
+            elif status == Protocol.TIMEOUT:
+                readings['status'][i] = self.STATUS_NO_REPLY
+            else:
+                readings['status'][i] = self.STATUS_UNEXPECTED
+        return readings
+
+    def setup_all(self,settings,timeout=None):
+        '''
+        Program every MFC in one pipelined transaction instead of one round trip per parameter.
+        settings: {channel: dict of MassFlowController.setup_commands keyword arguments}
+        Returns {channel: list of (command, reply fields or None)}; None means the controller didn't accept that command
+        '''
+        commands = []
+        owners = []
+        for MFC in self.MFC_list:
+            if MFC.channel in settings:
+                channel_commands = MFC.setup_commands(**settings[MFC.channel])
+                commands.extend(channel_commands)
+                owners.extend([MFC]*len(channel_commands))
+        self.logger.info(f'Programming MFCs {sorted(settings)} with {len(commands)} pipelined commands')
+        if self.virtual:
+            print(commands)
+            return {}
+        replies = self.command_queue.query_batch(commands,CommandQueue.SETPOINT,batch_timeout=self.BATCH_TIMEOUT if timeout is None else timeout)
+        results = {channel: [] for channel in settings}
+        for MFC, command, reply in zip(owners,commands,replies):
+            fields = None if reply is None else MFC._reply_fields(reply,command)
+            if fields is None:
+                self.logger.warning(f'MFC{MFC.channel} did not accept {command}')
+            results[MFC.channel].append((command,fields))
+        return results
+
+    def queue_depth(self):
+        ''' Commands waiting for the serial link, by priority '''
+        if self.command_queue is None:
+            return {}
+        return self.command_queue.depth_by_priority()
+
+    def close(self):
+        if self.command_queue is not None:
+            self.command_queue.close()
+        if not self.virtual:
+            self._connection.close()
     
     def closeAll(self):
         ''' Emergency button to close all'''
@@ -351,8 +822,8 @@ class Brooks0254:
     
 
 class MassFlowController:
-    TYPE_RESPONSE = '4'
-    TYPE_BATCH_CONTROL_STATUS = '5'
+    TYPE_RESPONSE = Protocol.BROOKS_TYPE_RESPONSE
+    TYPE_BATCH_CONTROL_STATUS = Protocol.BROOKS_TYPE_BATCH_CONTROL_STATUS
 
     ''' Note the value codes might need to be in hex'''
     Output_Program_Values = {
@@ -362,7 +833,8 @@ class MassFlowController:
     'SP_Rate':'01',
     'SP_Batch':'44',
     'SP_Blend':'45',
-    'SP_Source':'46'}
+    'SP_Source':'46',
+    'SP_VOR':'29'} # valve override, 0 = normal, 1 = closed, 2 = open
 
     
     Input_Program_Values = {
@@ -375,7 +847,7 @@ class MassFlowController:
         'PV_Full_Scale':'09'
     }
 
-    def __init__(self,logger,channel,pyvisaConnection,deviceAddress='',virtual=False):
+    def __init__(self,logger,channel,commandQueue,deviceAddress='',virtual=False,validateChecksum=False):
         '''
         Channel refers to each MFC (different gases)
         input for channel 1 = 1, output for channel 1 = 2
@@ -388,12 +860,14 @@ class MassFlowController:
         self._inputPort = 2 * channel - 1
         self._outputPort = 2 * channel
         self._address: str = deviceAddress  # this is a string because it needs to be zero-padded to be 5 chars long
-        self.com_lock = Lock()
+        self.commands = Protocol.brooks_commands(self._address,channel) # prebuilt command strings for this channel
+        self.measure_command = self.commands.measure
+        self.validate_checksum = validateChecksum
         self.virtual = virtual
         self.logger = logger
-        # PyVisa connection
+        # CommandQueue shared by every MFC on the controller, serializes and prioritizes the pyvisa session
         if not self.virtual:
-            self._connection: pyvisa = pyvisaConnection
+            self._queue: CommandQueue = commandQueue
 
 
     def setup_MFC(self,gas_factor=1,rate_units=18,time_base=2,decimal_point=1, SP_func = 1):
@@ -404,12 +878,24 @@ class MassFlowController:
         decimal point: 0 = xxx. , 1 = xx.x , 2 = x.xx , 3 = .xxx 
         SP Func: rate = 1, batch = 2, blend = 3
         '''
-        response = self.program_input_value('Measure_Units',rate_units)
-        self.program_input_value('Time_Base',time_base)
-        self.program_input_value('Decimal_Point',decimal_point)
-        self.program_input_value('Gas_Factor',f'{gas_factor:0<5}') ## format gas factor so it always has 4 sig figs
+        commands = self.setup_commands(gas_factor,rate_units,time_base,decimal_point,SP_func)
+        if self.virtual:
+            print(commands)
+            return None
+        replies = self._queue.query_batch(commands,CommandQueue.SETPOINT,batch_timeout=Brooks0254.BATCH_TIMEOUT)
+        response = [None if reply is None else self._reply_fields(reply,command) for command, reply in zip(commands,replies)]
+        self.logger.info(f'Programmed MFC{self.channel} input values, received following response {response}')
+        return response
 
-        self.logger.info('Successfully programmed MFC input values, received following response', response)
+    def setup_commands(self,gas_factor=1,rate_units=18,time_base=2,decimal_point=1,SP_func=1):
+        ''' The program commands setup_MFC sends, in order, for pipelining '''
+        return [
+            self.commands.program_input(self.Input_Program_Values['Measure_Units'],rate_units),
+            self.commands.program_input(self.Input_Program_Values['Time_Base'],time_base),
+            self.commands.program_input(self.Input_Program_Values['Decimal_Point'],decimal_point),
+            self.commands.program_input(self.Input_Program_Values['Gas_Factor'],f'{gas_factor:0<5}'), ## format gas factor so it always has 4 sig figs
+            self.commands.program_output(self.Output_Program_Values['SP_Function'],SP_func),
+            ]
 
 
     def get_measured_values(self):
@@ -418,23 +904,38 @@ class MassFlowController:
         Check for polled message type response ('4')
         Returns current process value, totalizer value, and datetime
         '''
-        command = f'AZ{self._address}.{self._inputPort}K'
+        command = self.measure_command
         if self.virtual:
             print(command)
         else:
-            with self.com_lock:
-                try:
-                    response = self._connection.query(command).split(sep=',')
-                    if response[2] == MassFlowController.TYPE_RESPONSE:
-                        return np.float16(response[5]), np.float32(response[4]), time.time()
-                    else:
-                        self.logger.warning('Request for measured values returned something unexpected')
-                        return None
-                except pyvisa.errors.VisaIOError as e:
-                    print("Failed to retrieve measured values from MFC controller")
-                    self.logger.debug(f'Pyvisa error: {e}')
-                    return -1.0,-1.0,time.time()
+            try:
+                values = self.parse_measured_values(self._queue.query(command,CommandQueue.READ),self.validate_checksum)
+                if values is not None:
+                    return values[0], values[1], time.time()
+                else:
+                    self.logger.warning('Request for measured values returned something unexpected')
+                    return None
+            except pyvisa.errors.VisaIOError as e:
+                print("Failed to retrieve measured values from MFC controller")
+                self.logger.debug(f'Pyvisa error: {e}')
+                return -1.0,-1.0,time.time()
+
 
+    @staticmethod
+    def parse_measured_values(response,validate=False):
+        ''' (process value, totalizer) from a K poll reply, None if it isn't a valid polled message response '''
+        status, pv, totalizer = Protocol.parse_brooks_measured(response,validate)
+        if status == Protocol.OK:
+            return pv, totalizer
+        return None
+
+    def _reply_fields(self,response,command):
+        ''' Reply fields as str (<sum> left out when validating), None if the reply is malformed or fails the checksum '''
+        status, fields = Protocol.parse_brooks(response,self.validate_checksum)
+        if status != Protocol.OK:
+            self.logger.warning(f'{status} reply to {command}: {response}')
+            return None
+        return [field.decode('ascii','replace') for field in fields]
 
     def clear_accumulated_value(self):
         ''' From manual: "allows any one channel input port accumulated value to be
@@ -442,12 +943,11 @@ class MassFlowController:
          I think this should reset the totalizer.
          Response should be None
          '''
-        command = f'AZ{self._address}.{self._inputPort}Z1'
+        command = self.commands.clear_totalizer
         if self.virtual:
             print(command)
         else:
-            with self.com_lock:
-                response = self._connection.query(command).split(sep=',')
+            response = self._reply_fields(self._queue.query(command,CommandQueue.SETPOINT),command)
             return response
 
     '''
@@ -460,40 +960,40 @@ class MassFlowController:
 
     def write_SP_rate(self,value):
         '''sends the command to make the setpoint rate equal to value (float)'''
-        command = f'AZ{self._address}.{self._outputPort}P01={value}'
-        with self.com_lock:
-            try:
-                response = self._connection.query(command).split(sep=',')
-                return response
-            except pyvisa.errors.VisaIOError as e:
-                print("Failed to write SP rate to MFC controller")
-                self.logger.debug(f'Pyvisa error: {e}')
-                return None
+        command = self.commands.program_output('01',value)
+        try:
+            response = self._reply_fields(self._queue.query(command,CommandQueue.SETPOINT),command)
+            return response
+        except pyvisa.errors.VisaIOError as e:
+            print("Failed to write SP rate to MFC controller")
+            self.logger.debug(f'Pyvisa error: {e}')
+            return None
 
     def write_SP_batch(self,value):
         '''sends command to make the batch setpoint equal to value (float)
         Note that it does not start the batch (I think)
          '''
-        command = f'AZ{self._address}.{self._outputPort}P44={value}'
-        with self.com_lock:
-            response = self._connection.query(command).split(sep=',')
+        command = self.commands.program_output('44',value)
+        response = self._reply_fields(self._queue.query(command,CommandQueue.SETPOINT),command)
         return response
 
-    def program_output_value(self,param,value):
+    def program_output_value(self,param,value,priority=None):
         '''
          Sends a program command to change the param (a str) to value (a float)
+         Valve override jumps the queue as an emergency command, everything else goes as a setpoint write
         '''
         if param not in self.Output_Program_Values:
             self.logger.info('Error: not an output parameter')
         else:
+            if priority is None:
+                priority = CommandQueue.EMERGENCY if param == 'SP_VOR' else CommandQueue.SETPOINT
             pcode = self.Output_Program_Values[param] # this is a string
-            command = f'AZ{self._address}.{self._outputPort}P{pcode}={value}'
+            command = self.commands.program_output(pcode,value)
             if self.virtual:
                 print(command)
             else:
                 try:
-                    with self.com_lock:
-                        response = self._connection.query(command).split(sep=',')
+                    response = self._reply_fields(self._queue.query(command,priority),command)
                     self.logger.info(f'Received response {response}')
                     return response
                 except pyvisa.errors.VisaIOError as e:
@@ -510,11 +1010,10 @@ class MassFlowController:
             return None
         else:
             pcode = self.Input_Program_Values[param] # this is a 2 chr string
-            command = f'AZ{self._address}.{self._inputPort}P{pcode}={value}'
+            command = self.commands.program_input(pcode,value)
             self.logger.info(f'Sending command {command} to controller.')
             try:
-                with self.com_lock:
-                    response = self._connection.query(command).split(sep=',')
+                response = self._reply_fields(self._queue.query(command,CommandQueue.SETPOINT),command)
                 self.logger.info(f'Received response {response}')
                 return response
             except pyvisa.errors.VisaIOError as e:
@@ -531,9 +1030,8 @@ class MassFlowController:
             return 'Error: not a parameter'
         else:
             pcode = self.Output_Program_Values[param] # this is a string
-            command = f'AZ{self._address}.{self._outputPort}P{pcode}?'
-            with self.com_lock:
-                response = self._connection.query(command).split(sep=',')
+            command = self.commands.read_output(pcode)
+            response = self._reply_fields(self._queue.query(command,CommandQueue.READ),command)
             return response
 
     def set_sccm(self,rate):
@@ -547,17 +1045,17 @@ class MassFlowController:
 
         
     def start_batch(self,batch_volume,batch_rate):
-        ### should com_lock wrap around all three program requests?
+        ### should all three program requests go through the queue as one transaction?
         ### competing thread would just ask for a measurement, so it would be fine to interleave
         ## program SP function to batch, SP Rate to desired rate, SP Batch to desired quantity, then start batch
         self.program_output_value('SP_Function','2')
         self.program_output_value('SP_Batch',batch_volume)
         self.program_output_value('SP_Rate',batch_rate)
-        command = f'AZ{self._address}.{self._outputPort}F*' # start channel batch
-        with self.com_lock:
-            response = self._connection.query(command).split(sep=",")
+        command = self.commands.start_batch # start channel batch
+        response = self._reply_fields(self._queue.query(command,CommandQueue.SETPOINT),command)
         return response
     
     def valve_override(self,value):
         # 0 = Normal, 1 = Closed, 2 = Open
-        response = self.program_output_value('SP_VOR',value)
\ No newline at end of file
+        response = self.program_output_value('SP_VOR',value)
+        return response
\ No newline at end of file
@@ -0,0 +1,189 @@
+'''
+Cache of parsed csv logs, so re-running an analysis script on the same run doesn't parse a multi-GB text file again.
+The first read_csv() of a log parses it with pandas and saves every column as a .npy file in the cache folder;
+later reads memory-map those files, which takes milliseconds whatever the size of the log.
+
+An entry belongs to one log path (and the parse options used). It is used as long as the file has the same size and
+mtime as when it was parsed; if only the mtime changed (copied back from Dropbox, touched) the content hash decides.
+A log that was appended to since is parsed again. The folder is kept under a size budget by dropping the least
+recently used entries.
+
+    data = read_csv('logs/CryoTest_20260121-153222.csv', dates={'DateTime':'%Y%m%d-%H%M%S'})
+    data['Reaction Temperature']    # float64 array, NaN where the csv was blank
+    data['DateTime']                # datetime64[s], local wall time like the csv
+
+    python LogCache.py              # what is in the cache
+    python LogCache.py clear
+'''
+import hashlib, json, os, shutil
+from time import time
+import numpy as np
+
+CACHE_DIR = os.path.join(os.environ.get('LOCALAPPDATA') or os.path.join(os.path.expanduser('~'), '.cache'), 'ControlSoftware', 'logs')
+CACHE_BUDGET = 10*2**30 # bytes
+MANIFEST = 'manifest.json'
+
+
+def file_digest(path, block=2**24):
+    ''' blake2b of the whole file, read in blocks '''
+    digest = hashlib.blake2b(digest_size=20)
+    with open(path, 'rb') as f:
+        while True:
+            data = f.read(block)
+            if not data:
+                return digest.hexdigest()
+            digest.update(data)
+
+
+def _parse_csv(path, dates):
+    import pandas as pd # only needed on a miss
+    frame = pd.read_csv(path, encoding='utf-8-sig')
+    columns = {}
+    for name in frame.columns:
+        series = frame[name]
+        if name in dates:
+            columns[name] = pd.to_datetime(series, format=dates[name], errors='coerce').to_numpy(dtype='datetime64[s]')
+        elif series.dtype.kind in 'biuf':
+            columns[name] = series.to_numpy(dtype=float)
+        else:
+            converted = pd.to_numeric(series, errors='coerce')
+            if converted.notna().sum() == series.notna().sum():
+                columns[name] = converted.to_numpy(dtype=float) # numbers with blanks in between
+            else:
+                columns[name] = np.array(series.fillna('').astype(str).tolist(), dtype=str)
+    return columns
+
+
+class ParsedLogCache:
+    '''
+    Folder of parsed logs, one subfolder per (log path, parse options) holding a .npy per column and a manifest
+    (path, size, mtime, content hash, column names). The manifest's mtime is its last use, for the LRU eviction.
+    Usage:
+        cache = ParsedLogCache()
+        columns = cache.get(path, options)      # None on a miss
+        cache.put(path, options, columns, os.stat(path), file_digest(path))   # both taken before parsing
+    '''
+    def __init__(self, directory=CACHE_DIR, budget_bytes=CACHE_BUDGET):
+        self.directory = directory
+        self.budget_bytes = budget_bytes
+
+    def entry(self, path, options):
+        key = json.dumps([os.path.abspath(path), options], sort_keys=True)
+        return os.path.join(self.directory, hashlib.blake2b(key.encode(), digest_size=16).hexdigest())
+
+    def _manifest(self, entry):
+        try:
+            with open(os.path.join(entry, MANIFEST)) as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return None
+
+    def get(self, path, options=None):
+        ''' {column: array} memory-mapped from the cache, None if there is no entry for the file as it is now '''
+        entry = self.entry(path, options)
+        manifest = self._manifest(entry)
+        if manifest is None:
+            return None
+        stat = os.stat(path)
+        if stat.st_size != manifest['size']:
+            return None
+        if stat.st_mtime_ns != manifest['mtime_ns']:
+            if file_digest(path) != manifest['digest']:
+                return None
+            manifest['mtime_ns'] = stat.st_mtime_ns
+            self._write_manifest(entry, manifest)
+        try:
+            columns = {name: np.load(os.path.join(entry, f'{i}.npy'), mmap_mode='r') for i, name in enumerate(manifest['columns'])}
+        except (OSError, ValueError):
+            return None # half deleted, parse again
+        os.utime(os.path.join(entry, MANIFEST)) # last use
+        return columns
+
+    def put(self, path, options, columns, stat, digest):
+        '''
+        Save parsed columns for the file, then drop old entries until the cache fits the budget.
+        stat and digest are of the file as it was before parsing, so a log appended to during the parse isn't
+        taken to match the columns. OSError if the old entry can't be replaced (Windows, still memory-mapped).
+        '''
+        entry = self.entry(path, options)
+        temporary = entry + '.tmp'
+        shutil.rmtree(temporary, ignore_errors=True)
+        os.makedirs(temporary)
+        size = 0
+        for i, values in enumerate(columns.values()):
+            np.save(os.path.join(temporary, f'{i}.npy'), np.asarray(values), allow_pickle=False)
+            size += os.path.getsize(os.path.join(temporary, f'{i}.npy'))
+        self._write_manifest(temporary, {'path':os.path.abspath(path), 'options':options, 'size':stat.st_size,
+                                         'mtime_ns':stat.st_mtime_ns, 'digest':digest,
+                                         'columns':list(columns), 'bytes':size, 'created':time()})
+        try:
+            if os.path.exists(entry):
+                shutil.rmtree(entry)
+            os.replace(temporary, entry)
+        except OSError:
+            ## the old entry is kept open by someone's mmap; it no longer matches the file so get() skips it
+            shutil.rmtree(temporary, ignore_errors=True)
+            raise
+        self.evict(keep=entry)
+
+    def _write_manifest(self, entry, manifest):
+        with open(os.path.join(entry, MANIFEST), 'w') as f:
+            json.dump(manifest, f)
+
+    def entries(self):
+        ''' [(last use, bytes, folder, manifest)], oldest first '''
+        found = []
+        if not os.path.isdir(self.directory):
+            return found
+        for name in os.listdir(self.directory):
+            entry = os.path.join(self.directory, name)
+            manifest = self._manifest(entry)
+            if manifest is not None and not name.endswith('.tmp'):
+                found.append((os.path.getmtime(os.path.join(entry, MANIFEST)), manifest['bytes'], entry, manifest))
+        return sorted(found, key=lambda item: item[0])
+
+    def evict(self, keep=None):
+        entries = self.entries()
+        total = sum(item[1] for item in entries)
+        for used, size, entry, manifest in entries:
+            if total <= self.budget_bytes:
+                break
+            if entry != keep:
+                shutil.rmtree(entry, ignore_errors=True)
+                total -= size
+
+    def clear(self):
+        shutil.rmtree(self.directory, ignore_errors=True)
+
+
+def read_csv(path, dates=None, cache=None):
+    '''
+    {column: numpy array} for a csv log, from the cache when the file hasn't changed since it was last parsed.
+    Number columns come back as float64 (NaN for blanks), dates ({column: strptime format}) as datetime64[s],
+    anything else as str arrays. cache=False parses without the cache.
+    '''
+    dates = {} if dates is None else dict(dates)
+    if cache is False:
+        return _parse_csv(path, dates)
+    cache = ParsedLogCache() if cache is None else cache
+    columns = cache.get(path, dates)
+    if columns is None:
+        stat, digest = os.stat(path), file_digest(path)
+        columns = _parse_csv(path, dates)
+        try:
+            cache.put(path, dates, columns, stat, digest)
+        except OSError as e:
+            print(f'Could not cache {path}: {e}') # still got the data, just slow next time
+    return columns
+
+
+if __name__ == '__main__':
+    import sys
+    cache = ParsedLogCache()
+    if sys.argv[1:] == ['clear']:
+        cache.clear()
+    else:
+        entries = cache.entries()
+        for used, size, entry, manifest in entries:
+            print(f'{size/2**20:8.1f} MB  {manifest["path"]}')
+        print(f'{sum(item[1] for item in entries)/2**20:.1f} MB of {cache.budget_bytes/2**20:.0f} MB in {cache.directory}')
@@ -0,0 +1,112 @@
+'''
+Read side for a run's worth of binary logs: one .cryolog file, or a folder of them (the segments LogWriterThread rotates
+through, several runs). Asks for a time range and gets numpy columns back without parsing the rest of the logs:
+segments outside the range are never opened past their index, the chunks inside are found by binary search on
+each log's index, and only the columns asked for are decoded.
+
+    store = LogStore('logs')
+    data = store.read(datetime(2026, 1, 21, 15, 40), datetime(2026, 1, 21, 15, 50), ['Reaction Temperature'])
+    t = data['time_ns']/1e9
+
+    python LogStore.py logs 2026-01-21T15:40 2026-01-21T15:50 "Reaction Temperature"
+'''
+import glob, os
+from datetime import datetime
+import numpy as np
+from BinaryLog import BinaryLog, LogFormatError, EXTENSION, TIME_COLUMN, DTYPE
+
+
+def _ns(moment):
+    ''' datetime (local time if naive) or seconds since the epoch -> ns since the epoch, None stays None '''
+    if moment is None:
+        return None
+    if isinstance(moment, datetime):
+        moment = moment.timestamp()
+    return float(moment)*1e9
+
+
+class LogStore:
+    '''
+    Time-indexed access to one binary log or every binary log in a folder.
+    Logs that can't be read (not a binary log, cut short before the header) are skipped and listed in skipped.
+    Logs written with a different set of channels are fine, a channel a log doesn't have reads as NaN.
+    Call refresh() to pick up new segments and chunks written since the store was opened.
+    '''
+    def __init__(self, path):
+        self.path = path
+        self.logs = []
+        self.skipped = []
+        self.refresh()
+
+    def refresh(self):
+        paths = sorted(glob.glob(os.path.join(self.path, '*' + EXTENSION))) if os.path.isdir(self.path) else [self.path]
+        self.logs = []
+        self.skipped = []
+        for path in paths:
+            try:
+                log = BinaryLog(path)
+            except (OSError, LogFormatError, ValueError):
+                self.skipped.append(path)
+                continue
+            if log.span() is not None:
+                self.logs.append(log)
+        self.logs.sort(key=lambda log: log.span()[0])
+        self.columns = []
+        for log in self.logs:
+            self.columns += [column for column in log.columns if column not in self.columns]
+
+    def __len__(self):
+        return sum(log.rows for log in self.logs)
+
+    def span(self):
+        ''' (first, last) time as datetimes, None if there is nothing logged '''
+        if not self.logs:
+            return None
+        return (datetime.fromtimestamp(min(log.span()[0] for log in self.logs)/1e9),
+                datetime.fromtimestamp(max(log.span()[1] for log in self.logs)/1e9))
+
+    def read(self, start=None, stop=None, columns=None):
+        '''
+        {column: float64 array} of the rows with start <= time <= stop, in time order, always including time_ns.
+        start/stop are datetimes or seconds since the epoch, None for open ended; columns defaults to all of them.
+        '''
+        names = [column for column in (self.columns if columns is None else columns) if column != TIME_COLUMN]
+        missing = [column for column in names if column not in self.columns]
+        if missing:
+            raise KeyError(f'no logged channel {missing} in {self.path}')
+        start, stop = _ns(start), _ns(stop)
+        parts = []
+        for log in self.logs:
+            first, last = log.span()
+            if (start is not None and max(first, last) < start) or (stop is not None and min(first, last) > stop):
+                continue
+            present = [TIME_COLUMN] + [column for column in names if column in log.columns]
+            block = log.read_block(present, start, stop)
+            if len(present) < len(names) + 1:
+                full = np.full((len(names) + 1, block.shape[1]), np.nan, dtype=DTYPE)
+                full[[0] + [names.index(column) + 1 for column in present[1:]]] = block
+                block = full
+            parts.append(block)
+        data = np.concatenate(parts, axis=1) if parts else np.empty((len(names) + 1, 0), dtype=DTYPE)
+        if (np.diff(data[0]) < 0).any():
+            data = data[:, np.argsort(data[0], kind='stable')] # overlapping logs, or the clock went back
+        return dict(zip([TIME_COLUMN] + names, data))
+
+
+if __name__ == '__main__':
+    import argparse
+    from time import perf_counter
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('path', help='a .cryolog file or a folder of them')
+    parser.add_argument('start', nargs='?', type=datetime.fromisoformat, help='e.g. 2026-01-21T15:40, default the first sample')
+    parser.add_argument('stop', nargs='?', type=datetime.fromisoformat, help='default the last sample')
+    parser.add_argument('columns', nargs='*', help='default all of them')
+    args = parser.parse_args()
+    store = LogStore(args.path)
+    print(f'{args.path}: {len(store.logs)} logs, {len(store)} rows, {store.span()}')
+    begin = perf_counter()
+    data = store.read(args.start, args.stop, args.columns or None)
+    print(f'{len(data[TIME_COLUMN])} rows in {1e3*(perf_counter() - begin):.1f} ms')
+    for column, values in data.items():
+        if column != TIME_COLUMN and np.isfinite(values).any():
+            print(f'  {column:<24}min {np.nanmin(values):<12.6g}max {np.nanmax(values):<12.6g}')
@@ -0,0 +1,316 @@
+'''
+Writes SampleFrames to disk from a thread of its own, so a slow disk (Dropbox folder, network drive) can't hold up sampling.
+LoggingThread hands each frame to LogWriterThread.submit(), which never blocks: the frame goes on a bounded queue,
+or is dropped and counted if the queue is full, and the caller is told so it can report back-pressure.
+
+The writer keeps the file open and commits in groups: everything queued goes out as one write when batch_rows frames are
+waiting or the oldest has waited batch_interval seconds. A commit is one chunk of a BinaryLog (or a block of csv lines),
+optionally followed by an fsync, so after a crash the log reads back complete up to the last commit.
+
+Logs are written in segments that rotate by size or age. LogMaintenanceThread thins closed segments as they get older
+(DOWNSAMPLE_POLICY), so weeks of history fit in a bounded amount of disk while each segment's summary keeps the true min/max.
+'''
+import csv, glob, os, queue, threading
+from time import monotonic, sleep, time
+import numpy as np
+from Acquisition import SampleFrame
+from BinaryLog import BinaryLog, BinaryLogWriter, LogFormatError, downsample, EXTENSION
+
+FSYNC_POLICIES = ('commit','interval','never')
+## (age in days, resolution in s): a closed segment whose newest sample is older than the age is thinned to that resolution
+DOWNSAMPLE_POLICY = ((7, 10), (30, 60), (180, 600))
+
+
+class BinaryFrameLog:
+    ''' SampleFrames into a BinaryLog, one chunk per commit '''
+
+    def __init__(self, path, codec='gorilla'):
+        self.log = BinaryLogWriter(path, SampleFrame.LOG_COLUMNS, codec=codec)
+
+    def write_frames(self, frames):
+        self.log.write_chunk(np.array([frame.log_row() for frame in frames]).T)
+
+    def sync(self):
+        self.log.sync()
+
+    def size(self):
+        return self.log.size()
+
+    def close(self):
+        self.log.close()
+
+
+class CsvFrameLog:
+    ''' SampleFrames as csv rows in the layout LoggingThread always wrote, header only on a new file '''
+
+    def __init__(self, path, codec=None):
+        self._file = open(path, 'a', newline='')
+        self._writer = csv.DictWriter(self._file, SampleFrame.CSV_FIELDS)
+        if self._file.tell() == 0:
+            self._writer.writeheader()
+
+    def write_frames(self, frames):
+        start = self._file.tell()
+        try:
+            self._writer.writerows(frame.as_row() for frame in frames)
+            self._file.flush()
+        except Exception:
+            ## cut back to the last full commit so a retry doesn't leave half a line
+            self._file.seek(start)
+            self._file.truncate()
+            raise
+
+    def sync(self):
+        os.fsync(self._file.fileno())
+
+    def size(self):
+        return self._file.tell()
+
+    def close(self):
+        self._file.close()
+
+
+class LogWriterThread(threading.Thread):
+    '''
+    Background writer for one log.
+    batch_rows / batch_interval (s): commit when this many frames are waiting or the oldest has waited this long.
+    fsync: 'commit' after every commit, 'interval' at most every fsync_interval (s), 'never' leaves it to the OS.
+    rotate_bytes / rotate_seconds: start a new segment (path_001, path_002, ...) once the current one is this big or this old,
+    None never rotates. codec compresses binary segments (see BinaryLog.CODECS), None writes plain memmap-able chunks.
+    A failed write is logged and the same batch retried; meanwhile the queue fills up and submit() reports back-pressure.
+    A batch that can't be written at all (malformed frame) is logged and dropped, so the thread keeps going.
+    Usage:
+        writer = LogWriterThread(logger, 'logs/run.cryolog')
+        writer.start()
+        if not writer.submit(frame): ...    # queue full, frame dropped
+        writer.close()                      # commits what is left and closes the file
+    '''
+    CLOSE_RETRIES = 3 # failed commits of the last frames before close() gives up on them
+    def __init__(self, logger, path, log_format='binary', queue_size=10000, batch_rows=256, batch_interval=1.0,
+                 fsync='commit', fsync_interval=10.0, rotate_bytes=None, rotate_seconds=None, codec='gorilla'):
+        super().__init__(name='LogWriter', daemon=True)
+        if fsync not in FSYNC_POLICIES:
+            raise ValueError(f'fsync must be one of {FSYNC_POLICIES}, not {fsync!r}')
+        self.logger = logger
+        self.path = path
+        self.log_format = log_format
+        self.batch_rows = batch_rows
+        self.batch_interval = batch_interval
+        self.fsync = fsync
+        self.fsync_interval = fsync_interval
+        self.rotate_bytes = rotate_bytes
+        self.rotate_seconds = rotate_seconds
+        self.codec = codec
+        self.queue = queue.Queue(queue_size)
+        self.stats = {'written':0,'dropped':0,'commits':0,'syncs':0,'rotations':0,'errors':0,'max_commit':0.0}
+        self._log = None
+        self._opened = None
+        self._segment = self._last_segment()
+        self._last_sync = monotonic()
+
+    def submit(self, frame):
+        ''' Queue a frame for writing, never blocks. False if the queue is full and the frame was dropped '''
+        try:
+            self.queue.put_nowait(frame)
+            return True
+        except queue.Full:
+            self.stats['dropped'] += 1
+            return False
+
+    def backlog(self):
+        return self.queue.qsize()
+
+    def close(self, timeout=None):
+        self.queue.put(None)
+        self.join(timeout)
+
+    def segment_path(self, n):
+        if n == 0:
+            return self.path
+        stem, extension = os.path.splitext(self.path)
+        return f'{stem}_{n:03d}{extension}'
+
+    def _last_segment(self):
+        ''' Carry on in the newest segment of an earlier run '''
+        n = 0
+        while os.path.exists(self.segment_path(n + 1)):
+            n += 1
+        return n
+
+    def current_path(self):
+        return self.segment_path(self._segment)
+
+    def _open(self):
+        path = self.segment_path(self._segment)
+        self._opened = monotonic()
+        if self.log_format == 'binary':
+            try:
+                return BinaryFrameLog(path, self.codec)
+            except LogFormatError as e:
+                ## e.g. a segment from before a schema change, leave it alone and start the next one
+                self.logger.warning(f'{e}, starting a new segment')
+                self._segment += 1
+                return self._open()
+        return CsvFrameLog(path)
+
+    def run(self):
+        pending = []
+        first = None # when the oldest pending frame arrived
+        stopping = False
+        failures = 0
+        while not stopping or pending:
+            if not stopping and len(pending) < self.batch_rows:
+                timeout = self.batch_interval if first is None else max(first + self.batch_interval - monotonic(), 0)
+                try:
+                    frame = self.queue.get(timeout=timeout)
+                    if frame is None:
+                        stopping = True
+                    else:
+                        if first is None:
+                            first = monotonic()
+                        pending.append(frame)
+                        ## take whatever else is already queued, up to a full batch
+                        while len(pending) < self.batch_rows:
+                            frame = self.queue.get_nowait()
+                            if frame is None:
+                                stopping = True
+                                break
+                            pending.append(frame)
+                except queue.Empty:
+                    pass
+            if pending and (stopping or len(pending) >= self.batch_rows or monotonic() - first >= self.batch_interval):
+                if self.commit(pending):
+                    pending = []
+                    first = None
+                    failures = 0
+                elif stopping and failures >= self.CLOSE_RETRIES:
+                    self.logger.error(f'Log writer giving up on {len(pending)} frames for {self.segment_path(self._segment)}')
+                    break
+                else:
+                    failures += 1
+                    sleep(self.batch_interval) # back off, the queue takes up the slack meanwhile
+        if self._log is not None:
+            try:
+                self._log.close()
+            except Exception as e:
+                self.stats['errors'] += 1
+                self.logger.exception(e)
+
+    def commit(self, frames):
+        '''
+        Write one group of frames. True when the group is done with: written, or dropped because it can't be written
+        at all (a malformed frame); False after a disk error, to be retried.
+        '''
+        start = monotonic()
+        try:
+            if self._log is None:
+                self._log = self._open()
+            self._log.write_frames(frames)
+        except OSError as e:
+            self.stats['errors'] += 1
+            self.logger.warning(f'Log write to {self.segment_path(self._segment)} failed ({e}), will retry')
+            return False
+        except Exception as e:
+            ## retrying the same frames would fail the same way, so drop them rather than let the writer thread die
+            self.stats['errors'] += 1
+            self.stats['dropped'] += len(frames)
+            self.logger.exception(f'Log write to {self.segment_path(self._segment)} failed, dropping {len(frames)} frames: {e}')
+            return True
+        if self.fsync == 'commit' or (self.fsync == 'interval' and start - self._last_sync >= self.fsync_interval):
+            try:
+                self._log.sync()
+                self._last_sync = start
+                self.stats['syncs'] += 1
+            except OSError as e:
+                ## the frames are written, just not known to be on the disk yet, so don't write them twice
+                self.stats['errors'] += 1
+                self.logger.warning(f'fsync of {self.segment_path(self._segment)} failed ({e})')
+        self.stats['written'] += len(frames)
+        self.stats['commits'] += 1
+        self.stats['max_commit'] = max(self.stats['max_commit'], monotonic() - start)
+        if ((self.rotate_bytes is not None and self._log.size() >= self.rotate_bytes)
+                or (self.rotate_seconds is not None and monotonic() - self._opened >= self.rotate_seconds)):
+            self.rotate()
+        return True
+
+    def rotate(self):
+        try:
+            self._log.close()
+        except Exception as e:
+            ## the segment is left without an index, readers recover it by walking the chunks
+            self.stats['errors'] += 1
+            self.logger.exception(f'Closing {self.segment_path(self._segment)} failed: {e}')
+        self._log = None
+        self._segment += 1
+        self.stats['rotations'] += 1
+        self.logger.info(f'Log rotated to {self.segment_path(self._segment)}')
+
+
+class LogMaintenanceThread(threading.Thread):
+    '''
+    Thins old log segments in the background. Every interval (s) it looks at the closed binary logs matching pattern
+    and downsamples each one to the coarsest resolution its age calls for under policy ((days, seconds), ...).
+    Segments still being written (no index yet) and the writer's current segment are left alone.
+    If budget_bytes is set and the logs still take more than that, it is logged as a warning; nothing is deleted.
+    '''
+    def __init__(self, logger, pattern=os.path.join('logs', '*' + EXTENSION), policy=DOWNSAMPLE_POLICY, interval=3600,
+                 budget_bytes=None, active=None):
+        super().__init__(name='LogMaintenance', daemon=True)
+        self.logger = logger
+        self.pattern = pattern
+        self.policy = sorted(policy)
+        self.interval = interval
+        self.budget_bytes = budget_bytes
+        self.active = active # callable giving the path being written, if any
+        self.stats = {'passes':0,'downsampled':0,'bytes_saved':0}
+        self._halt = threading.Event()
+
+    def stop(self):
+        self._halt.set()
+
+    def run(self):
+        while not self._halt.is_set():
+            try:
+                self.maintain()
+            except Exception as e:
+                self.logger.exception(e)
+            self._halt.wait(self.interval)
+
+    def target_resolution(self, age_days):
+        resolution = None
+        for days, seconds in self.policy:
+            if age_days >= days:
+                resolution = seconds
+        return resolution
+
+    def maintain(self, now=None):
+        ''' One pass over the segments, returns the paths it downsampled '''
+        now = time() if now is None else now
+        active = self.active() if self.active is not None else None
+        done = []
+        total = 0
+        for path in sorted(glob.glob(self.pattern)):
+            if self._halt.is_set():
+                break
+            try:
+                log = BinaryLog(path)
+            except (OSError, LogFormatError, ValueError):
+                continue
+            size = os.path.getsize(path)
+            span = log.span()
+            writing = active is not None and os.path.exists(active) and os.path.samefile(path, active)
+            if log.closed and span is not None and not writing:
+                resolution = self.target_resolution((now - span[1]/1e9)/86400)
+                if resolution is not None and (log.resolution or 0) < resolution:
+                    rows = downsample(path, resolution) # means don't keep the decimals gorilla relies on, zlib does better
+                    saved = size - os.path.getsize(path)
+                    self.logger.info(f'Downsampled {path} to {resolution} s: {log.rows} -> {rows} rows, {saved/2**20:.1f} MB saved')
+                    self.stats['downsampled'] += 1
+                    self.stats['bytes_saved'] += saved
+                    done.append(path)
+                    size -= saved
+            total += size
+        self.stats['passes'] += 1
+        if self.budget_bytes is not None and total > self.budget_bytes:
+            self.logger.warning(f'Logs matching {self.pattern} take {total/2**20:.0f} MB, over the {self.budget_bytes/2**20:.0f} MB budget')
+        return done
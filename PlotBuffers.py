@@ -0,0 +1,168 @@
+'''
+Data storage for the live plots, kept apart from the widgets in Plots.py.
+'''
+import numpy as np
+
+
+class RingBuffer:
+    '''
+    Fixed-capacity circular buffer of float64 columns (e.g. time and value) for plot traces.
+    Every sample is written twice, at i and i + capacity, so the newest n samples are always one contiguous slice:
+    view() hands numpy views straight to setData without copying the history, and memory stays at 2*capacity per column.
+    Usage:
+        buffer = RingBuffer(86400, columns=2)
+        buffer.append(t, p)
+        x, y = buffer.view()          # everything kept, oldest first
+        x, y = buffer.view(last=120)  # just the newest 120 samples
+    '''
+
+    def __init__(self, capacity, columns=2):
+        self.capacity = int(capacity)
+        self.columns = columns
+        self._data = np.full((columns, 2*self.capacity), np.nan)
+        self._next = 0 # slot the next sample goes into
+        self._count = 0
+
+    def __len__(self):
+        return self._count
+
+    def clear(self):
+        self._next = 0
+        self._count = 0
+
+    def append(self, *values):
+        i = self._next
+        self._data[:, i] = values
+        self._data[:, i + self.capacity] = values
+        self._next = (i + 1) % self.capacity
+        if self._count < self.capacity:
+            self._count += 1
+
+    def extend(self, *columns):
+        ''' Append many samples at once, one array per column '''
+        columns = np.asarray(columns, dtype=float)
+        if columns.ndim == 1:
+            columns = columns[:, None]
+        n = columns.shape[1]
+        if n >= self.capacity:
+            columns = columns[:, -self.capacity:]
+            n = self.capacity
+        first = min(n, self.capacity - self._next)
+        for start, chunk in ((self._next, columns[:, :first]), (0, columns[:, first:])):
+            width = chunk.shape[1]
+            if width:
+                self._data[:, start:start + width] = chunk
+                self._data[:, start + self.capacity:start + self.capacity + width] = chunk
+        self._next = (self._next + n) % self.capacity
+        self._count = min(self._count + n, self.capacity)
+
+    def view(self, last=None):
+        ''' Tuple of one read-only view per column, oldest first. Valid until the next append '''
+        n = self._count if last is None else min(int(last), self._count)
+        end = self._next if self._count < self.capacity else self._next + self.capacity
+        views = tuple(self._data[c, end - n:end] for c in range(self.columns))
+        for column in views:
+            column.flags.writeable = False
+        return views
+
+    def last(self):
+        ''' Newest sample as a tuple, None if empty '''
+        if self._count == 0:
+            return None
+        i = self._next - 1 + self.capacity
+        return tuple(self._data[:, i])
+
+
+class MinMaxPyramid:
+    '''
+    Level-of-detail store for a time series: the raw samples in a RingBuffer plus min/max decimation levels,
+    each level bucketing FACTOR buckets of the one below. Levels are updated incrementally as samples arrive
+    (amortized O(1) per sample) and every level spans about the same history as the raw buffer.
+    select() picks the finest level that fits the number of pixels across the view and returns only the visible range,
+    so drawing cost depends on the widget width and not on how long the run has been going.
+    '''
+    FACTOR = 4
+    MIN_LEVEL_SIZE = 64
+    POINTS_PER_PIXEL = 2
+
+    def __init__(self, capacity):
+        self.raw = RingBuffer(capacity, columns=2)
+        self.levels = [] # RingBuffers of (first x, last x, min y, max y) per bucket
+        size = capacity//self.FACTOR
+        while size >= self.MIN_LEVEL_SIZE:
+            self.levels.append(RingBuffer(size + 1, columns=4))
+            size //= self.FACTOR
+        self._pending = [[0.0, 0.0, 0.0, 0.0, 0] for level in self.levels] # bucket being filled on each level
+
+    def __len__(self):
+        return len(self.raw)
+
+    def clear(self):
+        self.raw.clear()
+        for level, pending in zip(self.levels, self._pending):
+            level.clear()
+            pending[4] = 0
+
+    def append(self, x, y):
+        self.raw.append(x, y)
+        first, last, low, high = x, x, y, y
+        for level, pending in zip(self.levels, self._pending):
+            if pending[4] == 0:
+                pending[0], pending[2], pending[3] = first, low, high
+            else:
+                if low < pending[2]:
+                    pending[2] = low
+                if high > pending[3]:
+                    pending[3] = high
+            pending[1] = last
+            pending[4] += 1
+            if pending[4] < self.FACTOR:
+                break
+            ## bucket complete, it becomes one sample of the next level up
+            level.append(pending[0], pending[1], pending[2], pending[3])
+            first, last, low, high = pending[:4]
+            pending[4] = 0
+
+    def _tail(self, level):
+        ''' Newest samples not yet in a complete bucket of levels[level], merged into one bucket (None if there are none) '''
+        tail = None
+        for pending in reversed(self._pending[:level + 1]): # oldest first
+            if pending[4] == 0:
+                continue
+            if tail is None:
+                tail = list(pending[:4])
+            else:
+                tail[1] = pending[1]
+                tail[2] = min(tail[2], pending[2])
+                tail[3] = max(tail[3], pending[3])
+        return tail
+
+    def select(self, x_min, x_max, pixels):
+        '''
+        (x, y, level) to draw for the x range [x_min, x_max] on a view pixels wide, with one point of margin on each side.
+        Level 0 returns views of the raw samples, higher levels a min/max envelope as (first x, min), (last x, max) pairs.
+        '''
+        budget = max(int(pixels), 1)*self.POINTS_PER_PIXEL
+        x, y = self.raw.view()
+        start = max(np.searchsorted(x, x_min, 'left') - 1, 0)
+        stop = min(np.searchsorted(x, x_max, 'right') + 1, len(x))
+        if stop - start <= budget or not self.levels:
+            return x[start:stop], y[start:stop], 0
+        for k, level in enumerate(self.levels):
+            first, last, low, high = level.view()
+            start = max(np.searchsorted(last, x_min, 'left') - 1, 0)
+            stop = min(np.searchsorted(first, x_max, 'right') + 1, len(first))
+            tail = self._tail(k) if stop == len(first) else None
+            start = min(start, stop)
+            n = stop - start + (tail is not None)
+            if 2*n <= budget or k == len(self.levels) - 1:
+                xs = np.empty(2*n)
+                ys = np.empty(2*n)
+                m = 2*(n - (tail is not None))
+                xs[0:m:2] = first[start:stop]
+                xs[1:m:2] = last[start:stop]
+                ys[0:m:2] = low[start:stop]
+                ys[1:m:2] = high[start:stop]
+                if tail is not None:
+                    xs[m:], ys[m:] = tail[:2], tail[2:]
+                return xs, ys, k + 1
@@ -4,10 +4,17 @@ from PyQt5 import QtGui,QtCore
 import PyQt5.QtWidgets as qw 
 import pyqtgraph as pg
 import numpy as np
+from PlotBuffers import RingBuffer, MinMaxPyramid
+from misc_helpers import GlowItem
 
 class BoxedPlot(qw.QWidget):
-    def __init__(self, plot_title, color):
+    def __init__(self, plot_title, color, history=100000):
+        ''' history is how many points the current process trace keeps '''
         super().__init__()
+        self.history = history
+        self.buffer = None
+        self._buffer_trace = None
+        self.last_point = None
         masterLayout = qw.QVBoxLayout()
         self.pen = pg.mkPen(color, width=2)
 
@@ -29,28 +36,150 @@ class BoxedPlot(qw.QWidget):
     # def set_title(self,new_title):
 
 
+    def trace_buffer(self):
+        ''' Ring buffer behind self.trace, a fresh one whenever a process puts a new trace in '''
+        if self.buffer is None or self._buffer_trace is not self.trace:
+            self.buffer = RingBuffer(self.history,columns=2)
+            self._buffer_trace = self.trace
+        return self.buffer
+
     def update_plot(self,new_data):
         print(f'Add to plot {new_data}')
-        xdata,ydata = self.trace.getData()
-        xdata = np.append(xdata,t.time())
-        ydata = np.append(ydata,new_data)
+        buffer = self.trace_buffer()
+        buffer.append(t.time(),new_data)
+        xdata,ydata = buffer.view()
         self.trace.setData(x=xdata, y=ydata)
+        if self.glow is not None and not (self.glow_live and level == 0 and len(self.glow) and x_range[0] >= self.glow.first()):
+            ## the view left the live path (zoomed out, panned back): draw the glow for what is shown
+            self.glow.set_data(xdata, ydata)
+            self.glow_live = level == 0 and len(xdata) > 0 and xdata[-1] == self.buffer.last()[0]
+            self.glow_keep = max(self.num_points, len(xdata))
         # self.plot.getViewBox().autoRange()
 
     def update_xy(self,new_data,emphasize_last=True):
         # instead of time series updates x-y data
-        xdata,ydata = self.trace.getData()
-        xdata = np.append(xdata,new_data[0])
-        ydata = np.append(ydata,new_data[1])
+        if isinstance(self.trace,ScatterTrail):
+            ## only the new point is added, the trail marks the newest point itself
+            self.trace.append(new_data[0],new_data[1])
+            return
+        buffer = self.trace_buffer()
+        buffer.append(new_data[0],new_data[1])
+        xdata,ydata = buffer.view()
         self.trace.setData(x=xdata,y=ydata)
-        if emphasize_last:
+        if emphasize_last and self.last_point is not None:
             self.last_point.setData(x=[new_data[0]],y=[new_data[1]])
-        
+
+
+class ScatterTrail(pg.GraphicsObject):
+    '''
+    x-y scatter for slow processes like the dose P-T plot, keeping the newest trail points with older ones fading out.
+    The points are split into FADE_STEPS child ScatterPlotItems of trail/FADE_STEPS points, newest first, one brush each.
+    append() adds the point to the newest band only; when that band is full the oldest band is emptied and reused as the newest,
+    and the brushes move one step along. The cost per point stays the same however long the dose runs.
+    The newest point is marked with a cross.
+    '''
+    FADE_STEPS = 8
+
+    def __init__(self, color='b', size=10, trail=2000, last_color='#08F7FE', last_size=30):
+        super().__init__()
+        self.band_size = -(-trail//self.FADE_STEPS)
+        self.points = RingBuffer(self.band_size*self.FADE_STEPS,columns=2) # same points as the bands, for the bounds
+        self.size = size
+        self.last_size = last_size
+        self.brushes = []
+        for alpha in np.linspace(255,40,self.FADE_STEPS):
+            color = pg.mkColor(color)
+            color.setAlpha(int(alpha))
+            self.brushes.append(pg.mkBrush(color))
+        self.bands = [pg.ScatterPlotItem(symbol='o',size=size,pen=None,brush=brush) for brush in self.brushes]
+        for band in self.bands:
+            band.setParentItem(self)
+        self.last_pen = pg.mkPen(last_color,width=2)
+        self._bounds = None
+
+    def append(self, x, y):
+        self.prepareGeometryChange()
+        if len(self.bands[0].data) >= self.band_size:
+            oldest = self.bands.pop()
+            oldest.clear()
+            self.bands.insert(0,oldest)
+            for band, brush in zip(self.bands,self.brushes):
+                band.setBrush(brush)
+        self.bands[0].addPoints(x=[x],y=[y])
+        self.points.append(x,y)
+        self._bounds = None
+        self.informViewBoundsChanged()
+        self.update()
+
+    def clear(self):
+        self.prepareGeometryChange()
+        for band in self.bands:
+            band.clear()
+        self.points.clear()
+        self._bounds = None
+        self.informViewBoundsChanged()
+        self.update()
+
+    def bounds(self):
+        ''' (xmin, xmax, ymin, ymax) of the points shown, None when empty '''
+        if self._bounds is None and len(self.points):
+            x, y = self.points.view()
+            self._bounds = (np.nanmin(x), np.nanmax(x), np.nanmin(y), np.nanmax(y))
+        return self._bounds
+
+    def dataBounds(self, ax, frac=1.0, orthoRange=None):
+        bounds = self.bounds()
+        if bounds is None:
+            return (None, None)
+        return bounds[2*ax:2*ax + 2]
+
+    def pixelPadding(self):
+        return max(self.size, self.last_size)/2
+
+    def boundingRect(self):
+        bounds = self.bounds()
+        if bounds is None:
+            return QtCore.QRectF()
+        rect = QtCore.QRectF(bounds[0], bounds[2], bounds[1] - bounds[0], bounds[3] - bounds[2])
+        px, py = self.pixelVectors()
+        if px is None:
+            return rect
+        dx = abs(px.x())*self.pixelPadding()
+        dy = abs(py.y())*self.pixelPadding()
+        return rect.adjusted(-dx, -dy, dx, dy)
+
+    def paint(self, painter, *args):
+        ## the bands draw themselves, this only adds the cross on the newest point, fixed size in pixels
+        last = self.points.last()
+        if last is None:
+            return
+        center = painter.transform().map(QtCore.QPointF(*last))
+        r = self.last_size/2
+        painter.save()
+        painter.resetTransform()
+        painter.setPen(self.last_pen)
+        painter.drawLine(QtCore.QPointF(center.x() - r, center.y()), QtCore.QPointF(center.x() + r, center.y()))
+        painter.drawLine(QtCore.QPointF(center.x(), center.y() - r), QtCore.QPointF(center.x(), center.y() + r))
+        painter.restore()
+
+
 class LoggingPlot(qw.QWidget):
-    def __init__(self, plot_title, color, max_points):
+    SYMBOL_LIMIT = 1000 # above this many points on screen the trace is drawn as a plain line, no symbols or antialiasing
+
+    def __init__(self, plot_title, color, max_points, channel=None, history=300000, glow=False):
+        ''' channel is the SampleFrame channel shown by update_frame, defaults to plot_title
+        max_points is the visible window, history how many points are kept (300000 is about 3.5 days at 1 Hz)
+        glow draws the line with a GlowItem under it. While the view shows raw points up to the newest, the glow's path is
+        grown point by point as data arrives (and trimmed now and then), it is only rebuilt when the view moves off it '''
         super().__init__()
         masterLayout = qw.QVBoxLayout()
         self.num_points = max_points
+        self.store = MinMaxPyramid(history) # raw points plus min/max levels, see refresh
+        self.buffer = self.store.raw
+        self.detailed = True # symbols and antialiasing on
+        self._updating = False
+        self.time_axis = None # TimeAxis that scrolls this plot, if it shares one with other plots
+        self.channel = plot_title if channel is None else channel
         self.pen = pg.mkPen(color, width=1)
         self.brush = pg.mkBrush(color)
         layout = qw.QVBoxLayout()
@@ -60,10 +189,18 @@ class LoggingPlot(qw.QWidget):
         # self.trace = pg.PlotCurveItem(pen=self.pen)
         self.trace = pg.PlotDataItem(pen=self.pen,symbol='o',symbolBrush=self.brush) ## trying this to have points and lines
         self.plot.addItem(self.trace)
+        self.glow = None
+        self.glow_live = False # glow path holds the newest raw points and is extended by append
+        self.glow_keep = max_points # points kept when the live glow path is trimmed
+        if glow:
+            self.glow = GlowItem(self.trace,follow=False)
+            self.plot.addItem(self.glow,ignoreBounds=True)
         # self.trace.setSkipFiniteCheck(True)
         self.plot.getPlotItem().showGrid(x=True, y=True, alpha=0.5)
         if "qdarkstyle" in sys.modules:
             self.plot.setBackground((25, 35, 45))
+        ## zooming or panning (here or on a linked plot) picks the level of detail for the new range
+        self.plot.getViewBox().sigXRangeChanged.connect(self.on_range_changed)
 
         self.group.setLayout(layout)
         layout.addWidget(self.plot)
@@ -71,19 +208,160 @@ class LoggingPlot(qw.QWidget):
 
         self.setLayout(masterLayout)
 
-    def update_plot(self,new_data):
-        xdata,ydata = self.trace.getData()
-        if xdata is None:
-            xdata = np.array([t.time()])
-            ydata = np.array([new_data])
-        else:
-            xdata = np.append(xdata,t.time())
-            ydata = np.append(ydata,new_data)
-        # print(f'Add to plot: ({xdata},{ydata})')
+    def update_frame(self,frame):
+        self.update_frames([frame])
+
+    def update_frames(self,frames):
+        ''' Append every frame of a batch that has this channel, then redraw once '''
+        added = False
+        for frame in frames:
+            if frame.has(self.channel):
+                self.append(frame.time,frame[self.channel])
+                added = True
+        if added and self.time_axis is None:
+            self.follow()
+
+    def update_plot(self,new_data,timestamp=None):
+        if timestamp is None:
+            timestamp = t.time()
+        self.append(timestamp,new_data)
+        if self.time_axis is None:
+            self.follow()
+
+    def append(self,x,y):
+        self.store.append(x,y)
+        if self.glow_live:
+            self.glow.append(x,y)
+            if len(self.glow) > 2*self.glow_keep:
+                self.glow.set_data(*self.buffer.view(last=self.glow_keep))
+
+    def follow(self):
+        ''' Scroll to the newest num_points and redraw, plots on a TimeAxis are scrolled by it instead '''
+        xdata,ydata = self.buffer.view(last=self.num_points)
+        self._updating = True
+        try:
+            if len(self.buffer)>self.num_points:
+                self.plot.setXRange(xdata[0],xdata[-1])
+        finally:
+            self._updating = False
+        self.refresh((xdata[0],xdata[-1]))
+
+    def on_range_changed(self,viewbox,x_range):
+        if not self._updating and len(self.store):
+            self.refresh(x_range)
+
+    def refresh(self,x_range=None):
+        '''
+        Redraw the trace for x_range (default the current view) from the level of the store that fits the plot width:
+        every raw point when zoomed in, a min/max envelope of about two points per pixel over long runs.
+        '''
+        if x_range is None:
+            x_range = self.plot.getViewBox().viewRange()[0]
+        pixels = self.plot.getViewBox().width() or self.plot.width()
+        xdata,ydata,level = self.store.select(x_range[0],x_range[1],pixels)
+        detailed = level == 0 and len(xdata) <= self.SYMBOL_LIMIT
+        if detailed != self.detailed:
+            self.detailed = detailed
+            self.trace.opts['antialias'] = detailed
+            self.trace.setSymbol('o' if detailed else None)
         self.trace.setData(x=xdata, y=ydata)
-        if len(xdata)>self.num_points:
-            # print(len(xdata))
-            self.plot.setXRange(xdata[-self.num_points],xdata[-1])
-            # print(xdata[-1])
-        # self.plot.getViewBox().autoRange()
+        if self.glow is not None and not (self.glow_live and level == 0 and len(self.glow) and x_range[0] >= self.glow.first()):
+            ## the view left the live path (zoomed out, panned back): draw the glow for what is shown
+            self.glow.set_data(xdata, ydata)
+            self.glow_live = level == 0 and len(xdata) > 0 and xdata[-1] == self.buffer.last()[0]
+            self.glow_keep = max(self.num_points, len(xdata))
+
+
+class TimeAxis(QtCore.QObject):
+    '''
+    Visible time window shared by a group of LoggingPlots, all x-linked to the first one.
+    While following, update() moves the window once per display tick to the newest num_points of every plot.
+    Panning or zooming any of the plots freezes the window so history can be inspected while data keeps coming in,
+    follow() (or the plot's auto-range button) goes back to the latest data.
+    Usage:
+        axis = TimeAxis([temp_plot, pressure_plot])
+        refresh.add(temp_plot.update_frames)
+        refresh.add(pressure_plot.update_frames)
+        refresh.add(axis.update)
+    '''
+    following_changed = QtCore.pyqtSignal(bool)
+
+    def __init__(self, plots, parent=None):
+        super().__init__(parent)
+        self.plots = list(plots)
+        self.following = True
+        for plot in self.plots:
+            plot.time_axis = self
+            if plot is not self.plots[0]:
+                plot.plot.setXLink(self.plots[0].plot)
+            plot.plot.getViewBox().sigRangeChangedManually.connect(self.freeze)
+            plot.plot.getPlotItem().autoBtn.clicked.connect(self.follow)
+
+    def freeze(self, *args):
+        if self.following:
+            self.following = False
+            self.following_changed.emit(False)
+
+    def follow(self, *args):
+        if not self.following:
+            self.following = True
+            self.following_changed.emit(True)
+        self.update()
+
+    def window(self):
+        ''' (start, end) covering the newest num_points of every plot, None before there is any data '''
+        start, end = np.inf, -np.inf
+        for plot in self.plots:
+            xdata, ydata = plot.buffer.view(last=plot.num_points)
+            if len(xdata):
+                start = min(start, xdata[0])
+                end = max(end, xdata[-1])
+        return (start, end) if end >= start else None
+
+    def update(self, frames=None):
+        ''' Set the window on the linked plots once and redraw each of them, frames (from DisplayRefresh) aren't needed '''
+        x_range = self.window() if self.following else None
+        if x_range is not None and x_range[1] > x_range[0]:
+            for plot in self.plots:
+                plot._updating = True
+            try:
+                self.plots[0].plot.setXRange(*x_range)
+            finally:
+                for plot in self.plots:
+                    plot._updating = False
+        for plot in self.plots:
+            if len(plot.store):
+                plot.refresh(x_range)
+
+
+class DisplayRefresh(QtCore.QObject):
+    '''
+    Display refresh tick for the live plots. Frames are queued as they arrive and every consumer gets the whole batch
+    once per tick, so each plot redraws at most rate times a second however fast the instruments are sampled.
+    Usage:
+        refresh = DisplayRefresh(20)
+        refresh.add(plot.update_frames)
+        logging_thread.new_frame.connect(refresh.queue)
+    '''
+    def __init__(self, rate=20, parent=None):
+        super().__init__(parent)
+        self.pending = []
+        self.consumers = []
+        self.timer = QtCore.QTimer(self)
+        self.timer.setInterval(int(1000/rate))
+        self.timer.timeout.connect(self.flush)
+        self.timer.start()
+
+    def add(self, consumer):
+        ''' consumer is called with the list of frames received since the last tick, oldest first '''
+        self.consumers.append(consumer)
+
+    def queue(self, frame):
+        self.pending.append(frame)
 
+    def flush(self):
+        if not self.pending:
+            return
+        frames, self.pending = self.pending, []
+        for consumer in self.consumers:
+            consumer(frames)
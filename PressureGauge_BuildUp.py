@@ -1,5 +1,5 @@
 import re, pyvisa
-import serial
+import serial, time
 ''' from MKS 902B manual:
 Command syntax for an information query:
 @<device address><query>?;FF
@@ -30,11 +30,20 @@ pyvisa_connetion = pyvisa.ResourceManager.open_resource('ASL...INSTR',read_termi
 '''
 
 class GenericSerialDevice:
+    '''
+    Reads return as soon as the terminator arrives (the port timeout only bounds a silent device).
+    A failed attempt is retried after a bounded exponential backoff: initial_backoff_ms, times backoff_factor per retry, capped at max_backoff_ms.
+    Tune these per device; read_stats counts reads, retries and reads that gave up.
+    '''
     def __init__(self, logger, com_port=0, baudrate=9600, timeout=0.1, parity=serial.PARITY_NONE, bytesize=serial.EIGHTBITS,
-                 testing=False, name='serial device'):
+                 testing=False, name='serial device', terminator=b'\n', max_attempts=5, initial_backoff_ms=5, max_backoff_ms=100, backoff_factor=2):
         self.testing = testing
-        self.max_number_of_attempts_per_read = 5
-        self.min_ms_between_successive_reads = 50
+        self.max_number_of_attempts_per_read = max_attempts
+        self.initial_backoff_ms = initial_backoff_ms
+        self.max_backoff_ms = max_backoff_ms
+        self.backoff_factor = backoff_factor
+        self.terminator = terminator
+        self.read_stats = {'reads':0,'retries':0,'failures':0}
         # self.com_lock = Lock()
         self.com_port = com_port
         self.serial_baudrate = baudrate
@@ -99,9 +108,15 @@ class GenericSerialDevice:
         if self.testing:
             return ''
 
+        self.read_stats['reads'] += 1
+        backoff_ms = self.initial_backoff_ms
         for i in range(self.max_number_of_attempts_per_read):
-            time.sleep(self.min_ms_between_successive_reads / 1000)
-            response = self._serial_connection.readline()
+            if i > 0:
+                self.read_stats['retries'] += 1
+                time.sleep(backoff_ms / 1000)
+                backoff_ms = min(backoff_ms * self.backoff_factor, self.max_backoff_ms)
+            ## blocks until the terminator arrives or the port timeout runs out, no fixed wait on a good read
+            response = self._serial_connection.read_until(self.terminator)
 
             try:
                 str_response = response.decode()
@@ -113,6 +128,7 @@ class GenericSerialDevice:
                 self.logger.warning(f'Read attempt {i + 1}: failed to decode response of "{response}" from {self.name}')
                 self.logger.exception(ex)
 
+        self.read_stats['failures'] += 1
         self.logger.warning(f'{self.name} failed to perform read after {self.max_number_of_attempts_per_read} tries')
         return ""
 
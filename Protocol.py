@@ -0,0 +1,181 @@
+'''
+Wire protocol codecs for the MKS 902B/925 gauges and the Brooks 0254 MFC controller.
+Commands are built once per address/channel and replies are parsed directly on the bytes (no decode, no uncompiled regex).
+
+MKS (from the 902B manual):
+    query   @<address><command>?;FF      e.g. @254PR1?;FF
+    set     @<address><command>!<value>;FF
+    reply   @<address>ACK<value>;FF or @<address>NAK<code>;FF
+    PR1-PR3 give a plain float, PR4 is scientific notation (e.g. 7.360E+02), float() takes both
+
+Brooks 0254:
+    command AZ<address>.<port><body>     e.g. AZ29751.3K for the measured values of MFC2
+    reply   AZ,<address>.<port>,<type>,<fields...>,<sum><cr><lf>
+    <sum> is taken to be the 8-bit sum of every byte up to and including the comma before it, written as 2 hex digits.
+    That is a guess not yet checked against the 0254 manual or the hardware, so validation is off by default
+    (Brooks0254 validate_checksum=False) and the <sum> field is then not required either.
+'''
+import math, re
+from functools import lru_cache
+
+OK = 'ok'
+NAK = 'nak' # instrument answered but refused the command
+TIMEOUT = 'timeout' # no complete reply in time
+MALFORMED = 'malformed' # complete reply that doesn't follow the protocol
+CHECKSUM = 'checksum' # Brooks reply whose <sum> field doesn't match
+UNEXPECTED = 'unexpected' # well formed, but not the reply type that was asked for
+
+NAN = math.nan
+
+## ---------------- MKS 902B / 925 ----------------
+
+MKS_TERMINATOR = b';FF'
+
+
+class MKSCommands:
+    '''
+    Command bytes for one gauge address, built once so a poll is just a write of a ready-made bytes object.
+    pressure[i] is the PRi query, pressure[1] is what get_pressure uses.
+    '''
+    __slots__ = ('address','pressure','address_query')
+
+    def __init__(self, address):
+        self.address = address
+        self.pressure = tuple(f'@{address}PR{i}?;FF'.encode('ascii') for i in range(5)) # index 0 unused
+        self.address_query = f'@{address}AD?;FF'.encode('ascii')
+
+    def query(self, command):
+        return f'@{self.address}{command}?;FF'.encode('ascii')
+
+    def set(self, command, value):
+        return f'@{self.address}{command}!{value};FF'.encode('ascii')
+
+
+@lru_cache(maxsize=None)
+def mks_commands(address):
+    return MKSCommands(address)
+
+
+## one C-level match per reply: the last @xxxACK/NAK frame in the buffer (skips line noise in front of it), payload up to ;FF
+MKS_FRAME = re.compile(rb'@\d{3}(ACK|NAK)([^@]*);FF\Z')
+
+
+def parse_mks(reply):
+    '''
+    (status, payload) for a raw MKS reply, payload being the bytes between ACK/NAK and ;FF.
+    A reply without the ;FF terminator means the read ran out of time.
+    '''
+    match = MKS_FRAME.search(reply)
+    if match is None:
+        return (MALFORMED if reply.endswith(MKS_TERMINATOR) else TIMEOUT), reply
+    if match.group(1) == b'ACK':
+        return OK, match.group(2)
+    return NAK, match.group(2)
+
+
+def parse_mks_float(reply):
+    ''' (status, value) for a PR1-PR4 reply, NaN unless status is OK '''
+    match = MKS_FRAME.search(reply)
+    if match is None:
+        return (MALFORMED if reply.endswith(MKS_TERMINATOR) else TIMEOUT), NAN
+    ack, payload = match.groups()
+    if ack != b'ACK':
+        return NAK, NAN
+    try:
+        return OK, float(payload)
+    except ValueError:
+        return MALFORMED, NAN
+
+
+## ---------------- Brooks 0254 ----------------
+
+BROOKS_TYPE_RESPONSE = b'4'
+BROOKS_TYPE_BATCH_CONTROL_STATUS = b'5'
+
+
+class BrooksCommands:
+    ''' Command strings for one MFC channel on a controller address, built once '''
+    __slots__ = ('address','channel','input_port','output_port','measure','clear_totalizer','start_batch')
+
+    def __init__(self, address, channel):
+        self.address = address
+        self.channel = channel
+        self.input_port = 2*channel - 1
+        self.output_port = 2*channel
+        self.measure = f'AZ{address}.{self.input_port}K'
+        self.clear_totalizer = f'AZ{address}.{self.input_port}Z1'
+        self.start_batch = f'AZ{address}.{self.output_port}F*'
+
+    def program_input(self, pcode, value):
+        return f'AZ{self.address}.{self.input_port}P{pcode}={value}'
+
+    def program_output(self, pcode, value):
+        return f'AZ{self.address}.{self.output_port}P{pcode}={value}'
+
+    def read_output(self, pcode):
+        return f'AZ{self.address}.{self.output_port}P{pcode}?'
+
+
+@lru_cache(maxsize=None)
+def brooks_commands(address, channel):
+    return BrooksCommands(address, channel)
+
+
+def brooks_checksum(data):
+    return sum(data) & 0xFF
+
+
+def parse_brooks(reply, validate=False):
+    '''
+    (status, fields) for a raw Brooks reply (bytes, or str from pyvisa query), fields being the comma separated bytes.
+    With validate the <sum> field must match brooks_checksum of everything before it and is left out of fields,
+    without it the reply is split as it is.
+    '''
+    if isinstance(reply, str):
+        reply = reply.encode('ascii', 'replace')
+    body = reply.rstrip(b'\r\n')
+    if not body:
+        return TIMEOUT, []
+    if not body.startswith(b'AZ'):
+        return MALFORMED, []
+    if validate:
+        cut = body.rfind(b',')
+        if cut < 0:
+            return MALFORMED, []
+        try:
+            expected = int(body[cut+1:], 16)
+        except ValueError:
+            return MALFORMED, []
+        if brooks_checksum(body[:cut+1]) != expected:
+            return CHECKSUM, []
+        body = body[:cut]
+    return OK, body.split(b',')
+
+
+def parse_brooks_measured(reply, validate=False):
+    '''
+    (status, process value, totalizer) for a K poll reply, NaN unless status is OK.
+    Same checks as parse_brooks, inlined since this runs for every MFC on every poll.
+    '''
+    fields = reply.rstrip(b'\r\n').split(b',')
+    if len(fields) < (7 if validate else 6) or fields[0] != b'AZ':
+        return (TIMEOUT if not fields[0] else MALFORMED), NAN, NAN
+    if validate:
+        try:
+            expected = int(fields[-1], 16)
+        except ValueError:
+            return MALFORMED, NAN, NAN
+        if sum(reply[:reply.rindex(b',')+1]) & 0xFF != expected:
+            return CHECKSUM, NAN, NAN
+    if fields[2] != BROOKS_TYPE_RESPONSE:
+        return UNEXPECTED, NAN, NAN
+    try:
+        return OK, float(fields[5]), float(fields[4])
+    except ValueError:
+        return MALFORMED, NAN, NAN
+
+
+def brooks_reply(fields):
+    ''' Build a reply with a valid <sum>, the inverse of parse_brooks. Used for recorded replies and simulators '''
+    body = b','.join(field if isinstance(field, bytes) else str(field).encode('ascii') for field in fields) + b','
+    return body + f'{brooks_checksum(body):02X}'.encode('ascii') + b'\r\n'
@@ -58,6 +58,18 @@ class SetupTab(qw.QWidget):
         self.mks902.set_gauge_params(unit,addr,baud)
 
     def setupMFCs(self):
+        ## every parameter for all three MFCs goes to the controller as one pipelined batch
+        if self.testing:
+            try:
+                self.b0254.setup_all(self.getMFCSettings())
+            except:
+                print('Failed to program MFC')
+        else:
+            self.b0254.setup_all(self.getMFCSettings())
+
+    def getMFCSettings(self):
+        ''' {channel: setup_MFC keyword arguments} for the three MFCs, from the tree '''
+        settings = {}
         for i in range(3):
             gas_factor = self.ctrlTree.getMFCParamValue(i+1,'Gas Factor')
             rate_units_str = self.ctrlTree.getMFCParamValue(i+1,'Rate Units')
@@ -66,13 +78,9 @@ class SetupTab(qw.QWidget):
             func = self.ctrlTree.getMFCParamValue(i+1,'SP Function')
             if self.testing:
                 print(f'Try to program MFC{i+1} with gas factor {gas_factor}, rate units {rate_units_str},time base {time_base_str}, decimal point {decimal_point}, and SP function {func}')
-                try:
-                    rate_units = self.b0254.MEASUREMENT_UNITS[rate_units_str]
-                    time_base = self.b0254.RATE_TIME_BASE[time_base_str]
-                    self.b0254.MFC_list[i].setup_MFC(gas_factor,rate_units,time_base,decimal_point,func)
-                except:
-                    print('Failed to program MFC')
-            else:
-                rate_units = self.b0254.MEASUREMENT_UNITS[rate_units_str]
-                time_base = self.b0254.RATE_TIME_BASE[time_base_str]
-                self.b0254.MFC_list[i].setup_MFC(gas_factor,rate_units,time_base,decimal_point,func)
\ No newline at end of file
+            settings[self.b0254.MFC_list[i].channel] = dict(gas_factor=gas_factor,
+                                                            rate_units=self.b0254.MEASUREMENT_UNITS[rate_units_str],
+                                                            time_base=self.b0254.RATE_TIME_BASE[time_base_str],
+                                                            decimal_point=decimal_point,
+                                                            SP_func=self.b0254.SP_FUNCTION[func.lower()])
+        return settings
\ No newline at end of file
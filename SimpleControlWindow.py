@@ -138,7 +138,7 @@ class SimpleControlWindow(qw.QMainWindow):
         self.logging_thread.running = False
         self.logger.info(f'Closing serial connections and GUI window.')
         self.daq.close_connections()
-        self.b0254._connection.close()
+        self.b0254.close()
         self.mks902._connection.close()
         self.mks925._connection.close()
         event.accept()
@@ -0,0 +1,569 @@
+'''
+Local stand-ins for the lab instruments that speak the real protocols with realistic per-command latency and baud-rate limits,
+so the real driver and thread code can run (and be timed) without the cryostat:
+    MKSGaugeSimulator    MKS 902B/925 @xxxPR1?;FF frames over a pty, answers only when the host port is at the gauge's baud rate
+    Brooks0254Simulator  AZ...K / AZ...P01= replies with <sum> through SimulatedVisaResource, a pyvisa-like resource
+    Model335Simulator    lakeshore.Model335 look-alike answering KRDG?, HTR?, SETP?, RAMPST? and RAMP/SETP commands
+    SimulatedTask        nidaqmx.Task look-alike for the relay digital outputs
+A small Plant couples them: MFC flows fill the cryo chamber through relay0, relay2/scroll purge pump it down.
+
+install() swaps the simulators in underneath serial.Serial, pyvisa.ResourceManager, lakeshore.Model335 and nidaqmx.Task,
+so ControlWindow, SimpleControlWindow and the threads run unchanged. Call it before importing ControlWindow
+(it does 'from lakeshore import Model335'). POSIX only (pty).
+    python Simulators.py            # ControlWindow against simulated instruments
+    python Simulators.py --simple   # SimpleControlWindow
+'''
+import os, pty, tty, termios, select, re, math, random, threading, logging
+from time import monotonic, sleep
+import serial, pyvisa, nidaqmx, lakeshore
+import Protocol
+
+BITS_PER_BYTE = 10 # 8N1
+
+
+def wire_time(n_bytes, baudrate):
+    return n_bytes*BITS_PER_BYTE/baudrate
+
+
+class Plant:
+    '''
+    Very rough process model shared by the simulators, evaluated lazily whenever an instrument is read.
+    Cryo chamber: MFC flow comes in while relay0 is open, relay2 or the scroll purge line pumps it down.
+    Reaction side sits near atmosphere.
+    '''
+    VOLUME_SCC = 2000.0 # chamber volume, cc at 1 atm
+    PUMP_TAU = 4.0 # s
+    BASE_PRESSURE = 1e-3 # Torr
+    LEAK_RATE = 1e-3 # Torr/s with everything closed
+    ATMOSPHERE = 760.0
+
+    def __init__(self):
+        self.lock = threading.RLock()
+        self.relays = {} # line name: bool
+        self.flow_source = lambda: 0.0 # total sccm, set by Brooks0254Simulator
+        self.cryo_pressure = 750.0
+        self.reaction_pressure = self.ATMOSPHERE
+        self._last = monotonic()
+
+    def relay(self, line):
+        return self.relays.get(line, False)
+
+    def advance(self):
+        with self.lock:
+            now = monotonic()
+            dt, self._last = now - self._last, now
+            if dt <= 0:
+                return
+            p = self.cryo_pressure
+            if self.relay('Dev1/port0/line0'):
+                p += self.flow_source()/60*dt*self.ATMOSPHERE/self.VOLUME_SCC
+            if self.relay('Dev1/port0/line2') or self.relay('Dev1/port0/line3'):
+                p = self.BASE_PRESSURE + (p - self.BASE_PRESSURE)*math.exp(-dt/self.PUMP_TAU)
+            else:
+                p += self.LEAK_RATE*dt
+            self.cryo_pressure = min(max(p, self.BASE_PRESSURE), self.ATMOSPHERE)
+            self.reaction_pressure = self.ATMOSPHERE + random.gauss(0, 0.2)
+
+    def pressure(self, channel):
+        self.advance()
+        with self.lock:
+            value = self.cryo_pressure if channel == 'Cryo Pressure' else self.reaction_pressure
+        return value*(1 + random.gauss(0, 0.002))
+
+
+## ---------------- MKS 902B / 925 ----------------
+
+class MKSGaugeSimulator(threading.Thread):
+    '''
+    One gauge behind a pty; open self.port with pyserial like a COM port.
+    Replies take the gauge's turnaround plus the command and reply bytes at its baud rate. If the host port is set to a
+    different rate the frame is garbled and nothing comes back, and BR! switches the gauge after the ACK like the real one.
+    '''
+    TURNAROUND = {'PR':0.006, 'AD':0.004, 'U':0.01, 'BR':0.01, 'TST':0.01}
+    DEFAULT_TURNAROUND = 0.01
+    NAK_UNRECOGNIZED = b'160'
+    NAK_BAD_ARGUMENT = b'169'
+    BAUD_RATES = (4800, 9600, 19200, 38400, 57600, 115200, 230400)
+
+    def __init__(self, pressure, address='253', baudrate=9600, name='MKS'):
+        ''' pressure: callable returning the current pressure in Torr '''
+        super().__init__(name=f'Simulated{name}', daemon=True)
+        self.pressure = pressure
+        self.address = address
+        self.baudrate = baudrate
+        self.unit = b'TORR'
+        self.master, self._slave = pty.openpty()
+        tty.setraw(self._slave)
+        self.port = os.ttyname(self._slave)
+        self.commands = 0
+        self.running = True
+
+    def stop(self):
+        self.running = False
+
+    def _host_baud_ok(self):
+        speed = termios.tcgetattr(self._slave)[5]
+        return speed == getattr(termios, f'B{self.baudrate}', None)
+
+    def run(self):
+        buffer = b''
+        while self.running:
+            ready, _, _ = select.select([self.master], [], [], 0.1)
+            if not ready:
+                continue
+            try:
+                buffer += os.read(self.master, 256)
+            except OSError:
+                return
+            while Protocol.MKS_TERMINATOR in buffer:
+                frame, buffer = buffer.split(Protocol.MKS_TERMINATOR, 1)
+                self._handle(frame + Protocol.MKS_TERMINATOR)
+
+    def _handle(self, frame):
+        self.commands += 1
+        sleep(wire_time(len(frame), self.baudrate))
+        if not self._host_baud_ok():
+            return # framing errors on the gauge side, it never sees a valid command
+        match = re.search(rb'@(\d{3})([A-Z]+\d?)([?!])(.*);FF$', frame)
+        if match is None:
+            return
+        address, command, kind, argument = match.groups()
+        if address not in (self.address.encode(), b'254'):
+            return # another gauge on the line
+        text = command.decode()
+        turnaround = self.DEFAULT_TURNAROUND
+        for prefix, budget in self.TURNAROUND.items():
+            if text.startswith(prefix):
+                turnaround = budget
+                break
+        sleep(turnaround)
+        new_baud = None
+        ack, payload = True, self.NAK_UNRECOGNIZED
+        if kind == b'?' and command in (b'PR1', b'PR2', b'PR3'):
+            p = self.pressure()
+            payload = f'{p:.1f}'.encode() if p >= 100 else f'{p:.2E}'.encode()
+        elif kind == b'?' and command == b'PR4':
+            payload = f'{self.pressure():.3E}'.encode()
+        elif command == b'AD':
+            if kind == b'!':
+                self.address = argument.decode()
+            payload = self.address.encode()
+        elif command == b'U':
+            if kind == b'!':
+                self.unit = argument
+            payload = self.unit
+        elif command == b'BR' and kind == b'!':
+            if argument.isdigit() and int(argument) in self.BAUD_RATES:
+                new_baud, payload = int(argument), argument
+            else:
+                ack, payload = False, self.NAK_BAD_ARGUMENT
+        elif command == b'TST' and kind == b'!':
+            payload = argument
+        else:
+            ack = False
+        reply = b'@' + self.address.encode() + (b'ACK' if ack else b'NAK') + payload + Protocol.MKS_TERMINATOR
+        sleep(wire_time(len(reply), self.baudrate))
+        os.write(self.master, reply)
+        if new_baud is not None:
+            self.baudrate = new_baud
+
+
+## ---------------- Brooks 0254 ----------------
+
+class Brooks0254Simulator:
+    '''
+    Controller state and replies for up to four MFC channels on one address.
+    Process values follow the rate setpoint (P01) with a first order lag, batch mode (P02=2) stops at the P44 volume
+    after F*, valve override (P29) forces the valve shut (1) or open to full scale (2). The totalizer integrates scc.
+    '''
+    TURNAROUND = 0.015
+    TAU = 0.5 # s for the flow to follow the setpoint
+    FULL_SCALE = 100.0
+
+    def __init__(self, address='29751', baudrate=9600, channels=3, validate_checksum=False):
+        self.address = address
+        self.baudrate = baudrate
+        self.lock = threading.Lock()
+        self.params = {channel: {'01':0.0, '02':1, '09':self.FULL_SCALE, '29':0, '44':0.0} for channel in range(1, channels + 1)}
+        self.input_params = {channel: {} for channel in range(1, channels + 1)}
+        self.pv = {channel: 0.0 for channel in self.params}
+        self.totalizer = {channel: 0.0 for channel in self.params}
+        self.batch_running = {channel: False for channel in self.params}
+        self.validate_checksum = validate_checksum
+        self._last = monotonic()
+
+    def total_flow(self):
+        self.update()
+        with self.lock:
+            return sum(self.pv.values())
+
+    def _target(self, channel):
+        params = self.params[channel]
+        override = int(float(params['29']))
+        if override == 1:
+            return 0.0
+        if override == 2:
+            return float(params['09'])
+        if int(float(params['02'])) == 2 and not self.batch_running[channel]:
+            return 0.0
+        return min(float(params['01']), float(params['09']))
+
+    def update(self):
+        with self.lock:
+            now = monotonic()
+            dt, self._last = now - self._last, now
+            for channel in self.params:
+                target = self._target(channel)
+                pv = target + (self.pv[channel] - target)*math.exp(-dt/self.TAU)
+                self.totalizer[channel] += (self.pv[channel] + pv)/2*dt/60
+                self.pv[channel] = pv
+                if self.batch_running[channel] and self.totalizer[channel] >= float(self.params[channel]['44']):
+                    self.batch_running[channel] = False
+
+    def reply(self, command):
+        ''' Reply bytes for one command (str), None if it isn't addressed to this controller '''
+        match = re.fullmatch(r'AZ(\d{5})\.(\d{1,2})(.*)', command.strip())
+        if match is None or match.group(1) != self.address:
+            return None
+        port, body = int(match.group(2)), match.group(3)
+        channel = (port + 1)//2
+        if channel not in self.params:
+            return None
+        self.update()
+        origin = f'{self.address}.{port:02d}'
+        with self.lock:
+            if body == 'K' and port % 2 == 1:
+                return Protocol.brooks_reply(['AZ', origin, '4', 'K', f'{self.totalizer[channel]:.3f}', f'{self.pv[channel]:.3f}'])
+            if body == 'Z1' and port % 2 == 1:
+                self.totalizer[channel] = 0.0
+                return Protocol.brooks_reply(['AZ', origin, '4', 'Z', '1'])
+            if body == 'F*' and port % 2 == 0:
+                self.totalizer[channel] = 0.0
+                self.batch_running[channel] = True
+                return Protocol.brooks_reply(['AZ', origin, '4', 'F', '*'])
+            program = re.fullmatch(r'P(\d{2})([=?])(.*)', body)
+            if program is not None:
+                pcode, kind, value = program.groups()
+                params = self.params[channel] if port % 2 == 0 else self.input_params[channel]
+                if kind == '=':
+                    params[pcode] = value
+                return Protocol.brooks_reply(['AZ', origin, '4', f'P{pcode}', params.get(pcode, 0)])
+        return None
+
+
+class SimulatedVisaResource:
+    '''
+    The subset of a pyvisa serial resource the drivers use (write, read, read_raw, query, flush, close, timeout in ms).
+    Commands are answered in order; each reply becomes readable once the controller has had the command bytes,
+    its turnaround and the reply bytes at the simulated baud rate, so pipelined writes overlap like on the real link.
+    '''
+
+    def __init__(self, device, resource_name, read_termination=None, write_termination=None, **kwargs):
+        self.device = device
+        self.resource_name = resource_name
+        self.read_termination = read_termination
+        self.write_termination = write_termination
+        self.timeout = 2000
+        self._lock = threading.Lock()
+        self._replies = [] # (ready time, reply bytes)
+        self._busy_until = monotonic()
+        self.commands = 0
+
+    def write(self, message):
+        command = message.decode() if isinstance(message, bytes) else message
+        now = monotonic()
+        baud = self.device.baudrate
+        with self._lock:
+            self.commands += 1
+            start = max(now, self._busy_until)
+            received = start + wire_time(len(command) + 1, baud)
+            reply = self.device.reply(command)
+            if reply is None:
+                self._busy_until = received
+                return len(command)
+            ready = received + self.device.TURNAROUND + wire_time(len(reply), baud)
+            self._busy_until = ready
+            self._replies.append((ready, reply))
+        return len(command)
+
+    def read_raw(self, size=None):
+        with self._lock:
+            pending = self._replies.pop(0) if self._replies else None
+        timeout = self.timeout/1000
+        if pending is None or pending[0] - monotonic() > timeout:
+            sleep(timeout)
+            raise pyvisa.errors.VisaIOError(pyvisa.constants.StatusCode.error_timeout)
+        wait = pending[0] - monotonic()
+        if wait > 0:
+            sleep(wait)
+        return pending[1]
+
+    def read(self, **kwargs):
+        return self.read_raw().decode('ascii').rstrip('\r\n')
+
+    def query(self, message, delay=None):
+        self.write(message)
+        return self.read()
+
+    def flush(self, mask=None):
+        with self._lock:
+            self._replies.clear()
+
+    def clear(self):
+        self.flush()
+
+    def close(self):
+        self.flush()
+
+
+class SimulatedResourceManager:
+    ''' Stands in for pyvisa.ResourceManager: simulated resources by name, anything else goes to the real manager '''
+    resources = {} # resource name: Brooks0254Simulator
+    real_manager = None
+
+    def __init__(self, *args, **kwargs):
+        self._args = args
+        self._kwargs = kwargs
+
+    def list_resources(self, query='?*::INSTR'):
+        return tuple(self.resources)
+
+    def open_resource(self, resource_name, **kwargs):
+        if resource_name in self.resources:
+            return SimulatedVisaResource(self.resources[resource_name], resource_name, **kwargs)
+        return self.real_manager(*self._args, **self._kwargs).open_resource(resource_name, **kwargs)
+
+    def close(self):
+        pass
+
+
+## ---------------- Lakeshore 335 ----------------
+
+class Model335Simulator:
+    '''
+    Model335 look-alike (same constructor) answering the SCPI-style queries the control code sends, alone or ; joined.
+    Loop 1 ramps its setpoint at the RAMP rate (K/min) when enabled, input A follows the setpoint and input B lags input A.
+    '''
+    TURNAROUND = 0.01
+    PER_QUERY = 0.002
+    TAU_A = 20.0
+    TAU_B = 60.0
+
+    def __init__(self, baud_rate, serial_number=None, com_port=None, timeout=2.0, ip_address=None, tcp_port=None, **kwargs):
+        self.baud_rate = baud_rate
+        self.lock = threading.Lock()
+        self.temperature = {'A':295.0, 'B':295.0}
+        self.setpoint = 295.0 # active (ramping) setpoint
+        self.target = 295.0
+        self.ramp_enable = 0
+        self.ramp_rate = 0.0
+        self.heater = 0.0
+        self.queries = 0
+        self._last = monotonic()
+
+    def _update(self):
+        now = monotonic()
+        dt, self._last = now - self._last, now
+        if self.ramp_enable and self.ramp_rate > 0:
+            step = self.ramp_rate/60*dt
+            self.setpoint += max(-step, min(step, self.target - self.setpoint))
+        else:
+            self.setpoint = self.target
+        a, b = self.temperature['A'], self.temperature['B']
+        self.temperature['A'] = self.setpoint + (a - self.setpoint)*math.exp(-dt/self.TAU_A)
+        self.temperature['B'] = a + (b - a)*math.exp(-dt/self.TAU_B)
+        self.heater = max(0.0, min(100.0, 50 + 5*(self.setpoint - self.temperature['A'])))
+
+    def _answer(self, query):
+        query = query.strip().lstrip(':').upper()
+        name, _, argument = query.partition(' ')
+        argument = argument.strip()
+        if name == 'KRDG?':
+            return f'+{self.temperature.get(argument or "A", 0.0):.3f}'
+        if name == 'HTR?':
+            return f'+{self.heater:.3f}'
+        if name == 'SETP?':
+            return f'+{self.setpoint:.3f}'
+        if name == 'RAMPST?':
+            return str(int(self.ramp_enable and abs(self.target - self.setpoint) > 1e-6))
+        if name == 'RAMP?':
+            return f'{self.ramp_enable},{self.ramp_rate:.1f}'
+        if name == '*IDN?':
+            return 'LSCI,MODEL335,SIMULATED,1.0'
+        if name == 'SETP':
+            loop, value = argument.split(',')
+            self.target = float(value)
+            if not self.ramp_enable:
+                self.setpoint = self.target
+        elif name == 'RAMP':
+            loop, enable, rate = argument.split(',')
+            self.ramp_enable, self.ramp_rate = int(enable), float(rate)
+        return None
+
+    def _transact(self, text):
+        parts = [part for part in text.split(';') if part.strip()]
+        with self.lock:
+            self.queries += 1
+            sleep(wire_time(len(text) + 2, self.baud_rate) + self.TURNAROUND + self.PER_QUERY*(len(parts) - 1))
+            self._update()
+            replies = [reply for reply in (self._answer(part) for part in parts) if reply is not None]
+            reply = ';'.join(replies)
+            sleep(wire_time(len(reply) + 2, self.baud_rate))
+        return reply
+
+    def query(self, *queries, check_errors=True):
+        return self._transact(';'.join(queries))
+
+    def command(self, *commands, check_errors=True):
+        self._transact(';'.join(commands))
+
+    def get_kelvin_reading(self, input_channel):
+        return float(self.query(f'KRDG? {input_channel}'))
+
+    def get_heater_output(self, output):
+        return float(self.query(f'HTR? {output}'))
+
+    def get_control_setpoint(self, output):
+        return float(self.query(f'SETP? {output}'))
+
+    def set_control_setpoint(self, output, value):
+        self.command(f'SETP {output},{value}')
+
+    def set_setpoint_ramp_parameter(self, output, ramp_enable, rate_value):
+        self.command(f'RAMP {output},{int(ramp_enable)},{rate_value}')
+
+    def get_setpoint_ramp_status(self, output):
+        return bool(int(self.query(f'RAMPST? {output}')))
+
+    def disconnect_usb(self):
+        pass
+
+
+## ---------------- NI DAQ ----------------
+
+class _DOChannels:
+    def __init__(self, task):
+        self._task = task
+
+    def add_do_chan(self, lines, name_to_assign_to_lines='', line_grouping=None):
+        self._task.lines.append(lines)
+
+
+class SimulatedTask:
+    ''' nidaqmx.Task look-alike for on-demand digital output, writes set the relay state in the Plant '''
+    WRITE_LATENCY = 0.0005
+    plant = None
+
+    def __init__(self, new_task_name=''):
+        self.name = new_task_name
+        self.lines = []
+        self.do_channels = _DOChannels(self)
+        self.state = False
+
+    def write(self, data, auto_start=True, timeout=10.0):
+        sleep(self.WRITE_LATENCY)
+        self.state = bool(data)
+        if self.plant is not None:
+            with self.plant.lock:
+                self.plant.advance()
+                for line in self.lines:
+                    self.plant.relays[line] = self.state
+
+    def read(self, number_of_samples_per_channel=None, timeout=10.0):
+        return self.state
+
+    def close(self):
+        pass
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+## ---------------- wiring ----------------
+
+class SimulatedSerial(serial.Serial):
+    ''' serial.Serial that opens the simulator pty for a mapped port name (e.g. COM3) '''
+    port_map = {}
+
+    def __init__(self, port=None, *args, **kwargs):
+        super().__init__(self.port_map.get(port, port), *args, **kwargs)
+
+
+class Simulation:
+    ''' What install() started, for inspection and uninstall() '''
+
+    def __init__(self, plant, gauges, brooks, originals):
+        self.plant = plant
+        self.gauges = gauges # port name: MKSGaugeSimulator
+        self.brooks = brooks # resource name: Brooks0254Simulator
+        self.originals = originals
+
+    def uninstall(self):
+        serial.Serial = self.originals['serial']
+        pyvisa.ResourceManager = self.originals['pyvisa']
+        lakeshore.Model335 = self.originals['lakeshore']
+        nidaqmx.Task = self.originals['nidaqmx']
+        SimulatedTask.plant = None
+        for gauge in self.gauges.values():
+            gauge.stop()
+
+
+def install(gauges=None, brooks=('ASRL8::INSTR',), brooks_address='29751', lakeshore_baud=57600):
+    '''
+    Start the simulators and put them underneath serial.Serial, pyvisa.ResourceManager, lakeshore.Model335 and nidaqmx.Task.
+    gauges: {port name: channel} for the MKS gauges, default COM3 (902B, reaction) and COM5 (925, cryo)
+    Returns a Simulation; call its uninstall() to put the real libraries back.
+    '''
+    if gauges is None:
+        gauges = {'COM3':'Reaction Pressure', 'COM5':'Cryo Pressure'}
+    plant = Plant()
+    originals = {'serial':serial.Serial, 'pyvisa':pyvisa.ResourceManager, 'lakeshore':lakeshore.Model335, 'nidaqmx':nidaqmx.Task}
+
+    started = {}
+    for port, channel in gauges.items():
+        simulator = MKSGaugeSimulator(lambda channel=channel: plant.pressure(channel), baudrate=9600, name=port)
+        simulator.start()
+        SimulatedSerial.port_map[port] = simulator.port
+        started[port] = simulator
+    serial.Serial = SimulatedSerial
+
+    controllers = {name: Brooks0254Simulator(brooks_address) for name in brooks}
+    if controllers:
+        plant.flow_source = lambda: sum(controller.total_flow() for controller in controllers.values())
+    SimulatedResourceManager.resources = controllers
+    SimulatedResourceManager.real_manager = originals['pyvisa']
+    pyvisa.ResourceManager = SimulatedResourceManager
+
+    lakeshore.Model335 = Model335Simulator
+    SimulatedTask.plant = plant
+    nidaqmx.Task = SimulatedTask
+    return Simulation(plant, started, controllers, originals)
+
+
+if __name__ == '__main__':
+    import sys, argparse
+    from time import strftime
+    parser = argparse.ArgumentParser(description='Run the control windows against simulated instruments')
+    parser.add_argument('--simple', action='store_true', help='SimpleControlWindow instead of ControlWindow')
+    args = parser.parse_args()
+
+    simulation = install()
+    import qdarkstyle
+    import PyQt5.QtWidgets as qw
+    timestr = strftime('%Y%m%d-%H%M%S')
+    log_path = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'logs')
+    os.makedirs(log_path, exist_ok=True)
+    logging.basicConfig(filename=os.path.join(log_path, f'SimulatedControl_{timestr}.log'), level=logging.DEBUG)
+    logger = logging.getLogger(__name__)
+    app = qw.QApplication(sys.argv)
+    app.setStyleSheet(qdarkstyle.load_stylesheet())
+    if args.simple:
+        from SimpleControlWindow import SimpleControlWindow
+        window = SimpleControlWindow(logger=logger, save_csv=True)
+    else:
+        from ControlWindow import MainControlWindow
+        window = MainControlWindow(logger=logger, csv_path=f'{log_path}.csv', max_points=120, testing=False)
+    sys.exit(app.exec())
@@ -1,31 +1,56 @@
-from time import time, sleep,strftime
+from time import time, sleep, strftime, monotonic
 from PyQt5 import QtCore
 import numpy as np
-import csv
+import os, threading
+from Acquisition import AcquisitionEngine, SampleFrame, Deadline
+from Instruments import CryoTelemetry
+from BinaryLog import log_path_for, EXTENSION
+from LogWriter import LogWriterThread, LogMaintenanceThread
 # import pandas as pd
 
 class LoggingThread(QtCore.QThread):
     ''' Periodically asks for data from pressure gauge, furnace, and MFCS. Passes measured data and overpressure alarm to main window'''
-    new_rxn_temp_data = QtCore.pyqtSignal(float)
-    new_cryo_temp_data = QtCore.pyqtSignal(float)
-    new_flow_data = QtCore.pyqtSignal(tuple) ## not sure how I'll handle gases yet
-    new_rxn_pressure_data = QtCore.pyqtSignal(float)
-    new_cryo_pressure_data = QtCore.pyqtSignal(float)
+    new_frame = QtCore.pyqtSignal(object) ## SampleFrame, one per cycle
+    ## channels each engine task reads, see build_engine
+    TASK_CHANNELS = {'Reaction Pressure':('Reaction Pressure',),
+                     'Cryo Pressure':('Cryo Pressure',),
+                     'Temperatures':CryoTelemetry.FIELDS,
+                     'Flows':('H2S sccm','Ar sccm','H2 sccm')}
 
-    def __init__(self,logger,log_path,cryoControl, mfcControl, rxnGauge, cryoGauge,save_csv,delay=30,testing = False):
+    def __init__(self,logger,log_path,cryoControl, mfcControl, rxnGauge, cryoGauge,save_csv,delay=30,testing = False,rates=None,stats_interval=600,
+                 log_format='csv',writer_options=None,maintenance_options=None):
+        ''' delay is the default sample period (s) for every task.
+        rates optionally overrides it per task in Hz, e.g. {'Reaction Pressure':5, 'Flows':1, 'Temperatures':0.2}
+        Frames are emitted at the rate of the fastest task and the scheduler statistics are logged every stats_interval (s)
+        log_format 'csv' (default) writes log_path directly as before, 'binary' opts in to a BinaryLog next to log_path
+        (log_path with .cryolog, BinaryLog.py export makes the csv). Either way the file is written by a LogWriterThread,
+        writer_options are passed on to it (batch_rows, batch_interval, fsync, rotate_bytes, rotate_seconds, codec, ...)
+        Thinning old binary logs is opt-in, since downsampling replaces the full-resolution data for good: pass
+        maintenance_options (a dict, {} for the defaults: policy, interval, budget_bytes) to run a LogMaintenanceThread
+        over the binary logs in the same folder. None (default) leaves them alone'''
         super().__init__()
         self.logger = logger
         self.log_path = log_path
         self.testing = testing
         self.delay=delay
         self.save_csv = save_csv
+        self.log_format = log_format
+        self.writer_options = {} if writer_options is None else dict(writer_options)
+        self.log_writer = None
+        self.maintenance_options = maintenance_options
+        self.log_maintenance = None
+        self._log_dropping = False
+        self.rates = {} if rates is None else dict(rates)
+        self.stats_interval = stats_interval
+        self.engine = None
+        self.frame_deadline = Deadline(delay)
         # print(self.save_csv)
 
         if not self.testing:
             self.cryoControl = cryoControl
             self.rxnPressure = rxnGauge
             self.cryoPressure = cryoGauge
-            self.mfcControl = mfcControl
+            self.b0254 = mfcControl
 
         elif self.testing:
             try:
@@ -59,98 +84,174 @@ class LoggingThread(QtCore.QThread):
             self.log_path = f'logs/CryoTest_{timestr}.csv'
             
         self.running = False
+        self.latest_frame = None
+        self._frame_cond = threading.Condition()
+        self._last_good = {} # testing display: channel -> last value read
+        self._missing = set() # testing display: channels already reported as missing
+
+    def build_engine(self):
+        ''' One bus worker per physical port: MKS902 on COM3, MKS925 on COM5, Lakeshore on USB, Brooks on ASRL8.
+        Instruments that failed to connect are left as placeholder strings and get no worker.'''
+        engine = AcquisitionEngine(self.logger)
+        if not isinstance(self.rxnPressure, str):
+            engine.add_task(self.rxnPressure.com_port,'Reaction Pressure',self.read_rxn_pressure,self.task_rate('Reaction Pressure'))
+        if not isinstance(self.cryoPressure, str):
+            engine.add_task(self.cryoPressure.com_port,'Cryo Pressure',self.read_cryo_pressure,self.task_rate('Cryo Pressure'))
+        if self.cryoControl != 'Model335':
+            self.cryoTelemetry = CryoTelemetry(self.cryoControl)
+            engine.add_task('Model335','Temperatures',self.read_temperatures,self.task_rate('Temperatures'))
+        if self.b0254 != 'Brooks0254':
+            engine.add_task(self.b0254.resource_name,'Flows',self.read_flows,self.task_rate('Flows'))
+        return engine
+
+    def task_rate(self,name):
+        return self.rates.get(name,1/self.delay)
+
+    def frame_period(self):
+        ''' Frames go out as fast as the fastest task so no reading is dropped '''
+        if self.engine is None or not self.engine.workers:
+            return self.delay
+        return min(task.deadline.period for task in self.engine.tasks().values())
+
+    def set_delay(self,delay):
+        ''' Change the default period, tasks with their own rate in self.rates keep it '''
+        self.delay = delay
+        if self.engine is not None:
+            for name in self.engine.tasks():
+                if name not in self.rates:
+                    self.engine.set_rate(name,1/delay)
+
+    def scheduler_stats(self):
+        ''' Achieved period, jitter and missed deadlines per task, per-bus utilization, and the same for the frame loop '''
+        stats = self.engine.stats() if self.engine is not None else {}
+        stats['frames'] = self.frame_deadline.stats.summary()
+        if self.log_writer is not None:
+            stats['log writer'] = dict(self.log_writer.stats, backlog=self.log_writer.backlog())
+        if self.log_maintenance is not None:
+            stats['log maintenance'] = dict(self.log_maintenance.stats)
+        return stats
+
+    def log_scheduler_stats(self):
+        for name, summary in self.scheduler_stats().items():
+            self.logger.info(f'Scheduler {name}: ' + ', '.join(f'{key}={value:.4g}' for key, value in summary.items()))
+
+    def read_rxn_pressure(self):
+        ## read_pressure raises on timeout or a bad reply, so a failed read is left out of the frame instead of logged as -1
+        return {'Reaction Pressure':self.rxnPressure.read_pressure()}
+
+    def read_cryo_pressure(self):
+        return {'Cryo Pressure':self.cryoPressure.read_pressure()}
+
+    def read_temperatures(self):
+        ''' Temperatures, heater output, setpoint and ramp status in one query '''
+        return self.cryoTelemetry.read_dict()
+
+    def read_flows(self):
+        ''' All three MFCs in one transaction, H2S = MFC1, Ar = MFC2, H2 = MFC3 '''
+        readings = self.b0254.read_all()
+        flows = {}
+        for name, row in zip(('H2S sccm','Ar sccm','H2 sccm'),readings):
+            if row['status'] == self.b0254.STATUS_OK:
+                flows[name] = row['pv']
+        return flows
+
+    def display_frame(self,frame):
+        ''' Testing: the frame with every channel not read this cycle showing its last good value.
+        A channel only counts as missing if its instrument has no bus worker or its last read failed,
+        that is logged once (and again once it comes back), slower channels are just not due yet '''
+        display = frame.copy()
+        tasks = self.engine.tasks()
+        for name, channels in self.TASK_CHANNELS.items():
+            task = tasks.get(name)
+            failed = task is None or task.failed
+            for channel in channels:
+                if frame.has(channel):
+                    self._last_good[channel] = frame[channel]
+                if failed and channel not in self._missing:
+                    self._missing.add(channel)
+                    self.logger.warning(f'failed to log {channel}: ' + ('no instrument' if task is None else 'read failed')
+                                        + (', showing the last good value' if channel in self._last_good else ''))
+                elif not failed and channel in self._missing:
+                    self._missing.discard(channel)
+                    self.logger.info(f'{channel} is being logged again')
+        display.fill_missing(self._last_good)
+        return display
+
+    def wait_for_frame(self,after_seq=-1,timeout=None):
+        ''' Lets other threads (purge/dose) use the logged reading instead of querying the gauge again.
+        Returns the first frame newer than after_seq, or None on timeout'''
+        with self._frame_cond:
+            if self._frame_cond.wait_for(lambda: self.latest_frame is not None and self.latest_frame.seq > after_seq, timeout):
+                return self.latest_frame
+            return None
 
     def run(self):
         self.running=True
-        row = 0
+        seq = 0
+        self.engine = self.build_engine()
+        self.frame_deadline = Deadline(self.frame_period())
+        self.frame_deadline.next += self.frame_deadline.period ## give the buses one period before the first frame
+        self.engine.start()
+        next_stats = monotonic() + self.stats_interval
         while self.running:
+            ## wait for the absolute deadline so the period doesn't grow by the time spent writing
+            self.frame_deadline.set_period(self.frame_period())
+            wait = self.frame_deadline.remaining()
+            if wait > 0:
+                QtCore.QThread.msleep(int(wait*1000))
+            start = monotonic()
+            frame = SampleFrame.from_readings(seq,time(),self.engine.take())
+            seq += 1
+            with self._frame_cond:
+                self.latest_frame = frame
+                self._frame_cond.notify_all()
+
             if self.testing:
-                rng = np.random.default_rng()
-                try:
-                    cryo_pressure = self.cryoPressure.get_pressure()
-                    self.new_cryo_pressure_data.emit(cryo_pressure)
-                    self.new_rxn_pressure_data.emit(self.rxnPressure.get_pressure())
-                    log_dict = {
-                        'Time':strftime('%H:%M:%S'),
-                        'DateTime':strftime('%Y%m%d-%H%M%S'),
-                        'Reaction Pressure':self.rxnPressure.get_pressure(),
-                        'Cryo Pressure':self.cryoPressure.get_pressure(),
-                        }
-                except (OSError,AttributeError,TypeError) as e:
-                    print("failed to log pressure")
-                    self.logger.exception(e)
-                    self.new_cryo_pressure_data.emit(1*rng.random())
-                    self.new_rxn_pressure_data.emit(0.1*rng.random())
-                if self.cryoControl != 'Model335':
-                    try:
-                        cryo_temp = float(self.cryoControl.query('KRDG? A',check_errors=False))
-                        rxn_temp = float(self.cryoControl.query("KRDG? B", check_errors=False))
-                        self.new_cryo_temp_data.emit(cryo_temp)
-                        self.new_rxn_temp_data.emit(rxn_temp)
-                        log_dict['Cryo Temperature'] = cryo_temp
-                        log_dict['Reaction Temperature'] = rxn_temp
-                    except Exception as e:
-                        print("failed to log temperatures")
-                        self.new_cryo_temp_data.emit(170+rng.random())
-                        self.new_rxn_temp_data.emit(200+rng.random())
-
-                    # elif self.cryoControl == 'Model335':
-                    #     ## because pressure and temperature share x axis, wonder if this needs data to udpate
-                    #     self.new_cryo_temp_data.emit(0.0)
-                    #     self.new_rxn_temp_data.emit(0.0)
-                if self.b0254 != 'Brooks0254':
-                    try:
-                        Ar_sccm, tot, time = self.b0254.MFC2.get_measured_values()
-                        log_dict['Ar sccm'] = Ar_sccm
-                        H2S_sccm, tot, time = self.b0254.MFC1.get_measured_values()
-                        log_dict['H2S sccm'] = H2S_sccm
-                        self.new_flow_data.emit((Ar_sccm,H2S_sccm))
-                    except(OSError,AttributeError,TypeError) as e:
-                        print("failed to log flows")
-                        self.new_flow_data.emit((10*rng.random(),rng.random()))
-                   
-                if self.save_csv:
-                    # print(f"try to save to csv at {self.log_path}")
-                    with open(self.log_path,'a',newline='') as csvfile:
-                        w = csv.DictWriter(csvfile, log_dict.keys())
-                        if row == 0:
-                            w.writeheader()
-                        w.writerow(log_dict)
-                        row +=1 
-                
+                self.new_frame.emit(self.display_frame(frame))
             else:
-                self.new_cryo_pressure_data.emit(self.cryoPressure.get_pressure())
-                self.new_rxn_pressure_data.emit(self.rxnPressure.get_pressure())
-                log_dict = {
-                    'Time':strftime('%H%M%S'),
-                    'DateTime':strftime('%Y%m%d-%H%M%S'),
-                    'Reaction Pressure':self.rxnPressure.get_pressure(),
-                    'Cryo Pressure':self.cryoPressure.get_pressure(),
-                    }
-                if self.cryoControl != 'Model335':
-                    cryo_temp = float(self.cryoControl.query('KRDG? A',check_errors=False))
-                    rxn_temp = float(self.cryoControl.query("KRDG? B", check_errors=False))
-                    self.new_cryo_temp_data.emit(cryo_temp)
-                    self.new_rxn_temp_data.emit(rxn_temp)
-                    log_dict['Cryo Temperature'] = cryo_temp
-                    log_dict['Reaction Temperature'] = rxn_temp
-                if self.b0254 != 'Brooks0254':
-                    Ar_sccm, tot, time = self.b0254.MFC2.get_measured_values()
-                    log_dict['Ar sccm'] = Ar_sccm
-                    H2S_sccm, tot, time = self.b0254.MFC1.get_measured_values()
-                    log_dict['H2S sccm'] = H2S_sccm
-                    self.new_flow_data.emit((Ar_sccm,H2S_sccm))
-
-                if self.save_csv:
-                    # print(f"trying to write to csv at {self.log_path}")
-                    with open(self.log_path,'a',newline='') as csvfile:
-                            w = csv.DictWriter(csvfile, log_dict.keys())
-                            if row == 0:
-                                w.writeheader()
-                            w.writerow(log_dict)
-                            row +=1 
-            QtCore.QThread.msleep(self.delay*1000)
+                self.new_frame.emit(frame)
+
+            if self.save_csv:
+                self.save_frame(frame)
+            self.frame_deadline.advance(start,monotonic())
+            if monotonic() >= next_stats:
+                self.log_scheduler_stats()
+                next_stats += self.stats_interval
+        self.engine.stop()
+        self.log_scheduler_stats()
+        if self.log_writer is not None:
+            self.log_writer.close()
+            self.log_writer = None
+        if self.log_maintenance is not None:
+            self.log_maintenance.stop()
+            self.log_maintenance = None
 
+    def save_frame(self,frame):
+        ''' Hand the frame to the writer thread, this never waits on the disk.
+        If the writer has fallen behind and its queue is full the frame is dropped and that gets reported '''
+        if self.log_writer is None:
+            path = log_path_for(self.log_path) if self.log_format == 'binary' else self.log_path
+            self.log_writer = LogWriterThread(self.logger,path,log_format=self.log_format,**self.writer_options)
+            self.log_writer.start()
+            if self.log_format == 'binary' and self.maintenance_options is not None:
+                pattern = os.path.join(os.path.dirname(path), '*' + EXTENSION)
+                self.log_maintenance = LogMaintenanceThread(self.logger,pattern,active=self.log_writer.current_path,
+                                                            **self.maintenance_options)
+                self.log_maintenance.start()
+        if not self.log_writer.submit(frame):
+            if not self._log_dropping:
+                self.logger.warning(f'Log writer is behind ({self.log_writer.backlog()} frames queued), dropping frames from the log')
+                self._log_dropping = True
+        elif self._log_dropping:
+            self.logger.warning(f'Log writer caught up, {self.log_writer.stats["dropped"]} frames dropped so far')
+            self._log_dropping = False
+
+
+def next_frame(frames,after_seq):
+    ''' Newest SampleFrame from the logging thread after after_seq, or None if logging is not running '''
+    if frames is None or not frames.running:
+        return None
+    return frames.wait_for_frame(after_seq,timeout=frames.frame_period()+1)
 
 
 class PurgeThread(QtCore.QThread):
@@ -159,13 +260,18 @@ class PurgeThread(QtCore.QThread):
     new_pressure = QtCore.pyqtSignal(float)
     new_flow = QtCore.pyqtSignal(float)
 
-    def __init__(self,testing,logger,mfc,pgauge, DAQ):
-        ''' Takes reaction gauge, MFC, and relays '''
+    def __init__(self,testing,logger,mfc,pgauge, DAQ, frames=None, pressure_channel='Cryo Pressure'):
+        ''' Takes reaction gauge, MFC, and relays. 
+        frames is the LoggingThread, pressure_channel is the SampleFrame channel pgauge is logged under '''
         super().__init__()
         self.testing = testing
         self.logger = logger
         self.MFC = mfc ## really the MFC controller
         self.PGauge = pgauge
+        self.DAQ = DAQ
+        self.frames = frames
+        self.pressure_channel = pressure_channel
+        self.last_seq = -1
         self.running = False
 
     
@@ -228,7 +334,7 @@ class PurgeThread(QtCore.QThread):
         while self.waiting:
             if not self.running:
                 break
-            measured_pressure = self.PGauge.getPressure()
+            measured_pressure = self.read_pressure()
             self.new_pressure.emit(measured_pressure)
             if measured_pressure >= alarm_pressure:
                 self.DAQ.close_relay0()
@@ -247,14 +353,23 @@ class PurgeThread(QtCore.QThread):
                 time += delay/60 # total time in min, delay is in seconds 
                 # QtCore.QThread.msleep(self.delay*1000)
 
+    def read_pressure(self):
+        ''' Use the logged frame so the gauge isn't queried twice, only read the gauge directly if logging is off '''
+        frame = next_frame(self.frames,self.last_seq)
+        if frame is not None and frame.has(self.pressure_channel):
+            self.last_seq = frame.seq
+            return frame[self.pressure_channel]
+        return self.PGauge.get_pressure()
+
 class DoseThread(QtCore.QThread):
 
     message = QtCore.pyqtSignal(str)
     new_data = QtCore.pyqtSignal(object)
     
 
-    def __init__(self,testing,logger,MFC,pgauge, DAQ, cryo):
-        ''' Needs references to reaction gauge, MFC, relays, and cryo controller '''
+    def __init__(self,testing,logger,MFC,pgauge, DAQ, cryo, frames=None, pressure_channel='Cryo Pressure'):
+        ''' Needs references to reaction gauge, MFC, relays, and cryo controller
+        frames is the LoggingThread, pressure_channel is the SampleFrame channel pgauge is logged under '''
         super().__init__()
         self.testing = testing
         self.logger = logger
@@ -262,6 +377,10 @@ class DoseThread(QtCore.QThread):
         self.PGauge = pgauge
         self.cryo = cryo
         self.DAQ = DAQ
+        self.frames = frames
+        self.pressure_channel = pressure_channel
+        self.last_seq = -1
+        self.last_temperature = float('nan') # carried forward, temperatures are usually read slower than the pressure
         self.running = False
     
     def setup(self,gas_name,init_volume, init_rate, target_pressure, alarm_pressure, timeout = None):
@@ -316,8 +435,8 @@ class DoseThread(QtCore.QThread):
         while self.waiting:
             if not self.running:
                 break
-            measured_pressure = self.PGauge.get_pressure()
-            self.new_data.emit(measured_pressure)
+            temperature, measured_pressure = self.read_temperature_pressure()
+            self.new_data.emit((temperature,measured_pressure))
             if measured_pressure >= self.alarm_pressure:
                 self.DAQ.close_relay1()
                 self.active_MFC.set_sccm(0)
@@ -333,4 +452,15 @@ class DoseThread(QtCore.QThread):
                 sleep(delay)
                 time += delay/60 # time in minutes (scc/sccm), sleep in seconds
                 # QtCore.QThread.msleep(self.delay*1000)
+
+    def read_temperature_pressure(self):
+        ''' (reaction temperature, pressure) from the logged frame, only read the gauge directly if logging is off.
+        Frames without a fresh temperature (it runs at its own rate) get the last good one, NaN until there is one '''
+        frame = next_frame(self.frames,self.last_seq)
+        if frame is not None and frame.has('Reaction Temperature'):
+            self.last_temperature = frame['Reaction Temperature']
+        if frame is not None and frame.has(self.pressure_channel):
+            self.last_seq = frame.seq
+            return self.last_temperature, frame[self.pressure_channel]
+        return self.last_temperature, self.PGauge.get_pressure()
                 
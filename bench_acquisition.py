@@ -0,0 +1,250 @@
+'''
+End-to-end acquisition benchmarks: the real LoggingThread, drivers and LoggingPlot running against the instrument simulators.
+For each configuration of task rates it reports the frame cycle time, per-instrument query latency percentiles,
+samples per second, CPU per sample (this process, simulators included) and memory growth per hour,
+plus per-call latency of the individual driver methods.
+
+    python bench_acquisition.py                 # run and compare against bench_baseline.json if there is one
+    python bench_acquisition.py --save          # run and store the results as the new baseline
+    python bench_acquisition.py -d 30 -c '1 Hz' # longer run of one configuration
+
+Results are only comparable on the same machine; the baseline records where it was made.
+Rates and CPU are measured from the first frame on. Memory growth needs runs of a few minutes to mean anything,
+so it isn't counted as a regression for runs shorter than MEMORY_MIN_DURATION.
+'''
+import os
+os.environ.setdefault('QT_QPA_PLATFORM','offscreen')
+import argparse, json, logging, platform, sys, tempfile
+from time import perf_counter, process_time, monotonic, strftime
+import numpy as np
+import Simulators
+
+BASELINE = os.path.join(os.path.dirname(os.path.abspath(__file__)),'bench_baseline.json')
+
+## task rates in Hz for LoggingThread, see ControlWindow.CHANNEL_RATES
+CONFIGURATIONS = {
+    '1 Hz':{'Reaction Pressure':1,'Cryo Pressure':1,'Temperatures':1,'Flows':1},
+    'fast pressures':{'Reaction Pressure':10,'Cryo Pressure':10,'Temperatures':0.5,'Flows':2},
+    'all 20 Hz':{'Reaction Pressure':20,'Cryo Pressure':20,'Temperatures':20,'Flows':20},
+    }
+HIGHER_IS_BETTER = ('frames_per_s','samples_per_s')
+MEMORY_MIN_DURATION = 300 # s
+TASK_READS = {'Reaction Pressure':'read_rxn_pressure','Cryo Pressure':'read_cryo_pressure','Temperatures':'read_temperatures','Flows':'read_flows'}
+
+
+def rss_bytes():
+    ''' Resident set size from /proc, NaN where that isn't available '''
+    try:
+        with open('/proc/self/statm') as f:
+            return int(f.read().split()[1])*os.sysconf('SC_PAGE_SIZE')
+    except (OSError,ValueError):
+        return float('nan')
+
+
+def percentiles(samples):
+    ''' ms percentiles of a list of durations in s '''
+    if not samples:
+        return {'p50':float('nan'),'p90':float('nan'),'p99':float('nan'),'max':float('nan'),'n':0}
+    ms = np.asarray(samples)*1000
+    p50, p90, p99 = np.percentile(ms,[50,90,99])
+    return {'p50':p50,'p90':p90,'p99':p99,'max':ms.max(),'n':len(ms)}
+
+
+def timed(function, samples):
+    def wrapper(*args, **kwargs):
+        start = perf_counter()
+        try:
+            return function(*args, **kwargs)
+        finally:
+            samples.append(perf_counter() - start)
+    return wrapper
+
+
+class Instruments:
+    ''' Driver objects built the way ControlWindow builds them, on top of the simulators '''
+
+    def __init__(self, logger):
+        from Instruments import PressureGauge, Brooks0254
+        from lakeshore import Model335
+        self.mks902 = PressureGauge(False,logger,'COM3')
+        self.mks925 = PressureGauge(False,logger,'COM5')
+        self.b0254 = Brooks0254(False,logger,'ASRL8::INSTR')
+        self.ls335 = Model335(57600)
+
+    def close(self):
+        self.b0254.close()
+        self.mks902._connection.close()
+        self.mks925._connection.close()
+
+
+def bench_drivers(instruments, calls):
+    ''' Per-call latency of the driver methods on their own '''
+    from Instruments import CryoTelemetry
+    telemetry = CryoTelemetry(instruments.ls335)
+    command = instruments.mks902.commands.pressure[1]
+    cases = {
+        'PressureGauge.query':lambda: instruments.mks902.query(command),
+        'PressureGauge.read_pressure':instruments.mks902.read_pressure,
+        'MassFlowController.get_measured_values':instruments.b0254.MFC2.get_measured_values,
+        'Brooks0254.read_all':instruments.b0254.read_all,
+        'CryoTelemetry.read':telemetry.read,
+        }
+    results = {}
+    for name, call in cases.items():
+        samples = []
+        for i in range(calls):
+            start = perf_counter()
+            call()
+            samples.append(perf_counter() - start)
+        results[name] = percentiles(samples)
+    return results
+
+
+def bench_configuration(app, instruments, logger, rates, duration):
+    from PyQt5 import QtCore
+    from Threads import LoggingThread
+    from Plots import LoggingPlot
+
+    class FrameSink(QtCore.QObject):
+        ''' Receives frames in the GUI thread like ControlWindow does and times the plot update '''
+        def __init__(self):
+            super().__init__()
+            self.plot = LoggingPlot('Reaction Pressure','#08F7FE',120)
+            self.frames = []
+            self.received = []
+            self.plot_times = []
+            self.first = None # (monotonic, cpu, rss) at the first frame
+
+        @QtCore.pyqtSlot(object)
+        def on_frame(self, frame):
+            if self.first is None:
+                self.first = (monotonic(), process_time(), rss_bytes())
+            start = perf_counter()
+            self.plot.update_frame(frame)
+            self.plot_times.append(perf_counter() - start)
+            self.frames.append(frame)
+            self.received.append(monotonic())
+
+    with tempfile.TemporaryDirectory() as directory:
+        thread = LoggingThread(logger,os.path.join(directory,'bench.csv'),instruments.ls335,instruments.b0254,
+                               instruments.mks902,instruments.mks925,save_csv=True,delay=1,testing=False,rates=rates,stats_interval=1e9)
+        latencies = {task: [] for task in TASK_READS}
+        for task, method in TASK_READS.items():
+            setattr(thread,method,timed(getattr(thread,method),latencies[task]))
+        sink = FrameSink()
+        thread.new_frame.connect(sink.on_frame)
+
+        thread.start()
+        QtCore.QTimer.singleShot(int(duration*1000),app.quit)
+        app.exec()
+        end = (monotonic(), process_time(), rss_bytes())
+        thread.running = False
+        thread.wait()
+        stats = thread.scheduler_stats()
+
+    ## first to last frame received, so thread start-up isn't counted
+    frames = sink.frames[1:]
+    samples = sum(int(np.count_nonzero(~np.isnan(frame.values))) for frame in frames)
+    span = sink.received[-1] - sink.received[0] if len(sink.received) > 1 else 0
+    if span > 0:
+        rates = {'frames_per_s':len(frames)/span, 'samples_per_s':samples/span}
+        growth = (end[2] - sink.first[2])/(end[0] - sink.first[0])*3600/2**20
+    else:
+        rates = {'frames_per_s':float('nan'), 'samples_per_s':float('nan')}
+        growth = float('nan')
+    cpu = end[1] - sink.first[1] if sink.first is not None else float('nan')
+    return {
+        'cycle_ms':stats['frames']['achieved_period']*1000,
+        'cycle_jitter_ms':stats['frames']['jitter']*1000,
+        'missed_deadlines':sum(summary.get('missed',0) for summary in stats.values()),
+        **rates,
+        'cpu_us_per_sample':cpu/samples*1e6 if samples else float('nan'),
+        'rss_growth_mb_per_hour':growth,
+        'query_latency_ms':{task: percentiles(samples) for task, samples in latencies.items()},
+        'plot_update_ms':percentiles(sink.plot_times),
+        'bus_utilization':{name[4:]: summary['utilization'] for name, summary in stats.items() if name.startswith('bus:')},
+        }
+
+
+def flatten(results, prefix=''):
+    flat = {}
+    for key, value in results.items():
+        if isinstance(value, dict):
+            flat.update(flatten(value, f'{prefix}{key}/'))
+        elif isinstance(value, (int, float)) and not key == 'n':
+            flat[f'{prefix}{key}'] = float(value)
+    return flat
+
+
+def compare(results, baseline, tolerance, duration):
+    ''' Print every metric against the baseline, returns the names of the ones that got worse by more than tolerance '''
+    old = flatten(baseline['results'])
+    new = flatten(results)
+    regressions = []
+    print(f'\nCompared to baseline from {baseline["created"]} on {baseline["machine"]}')
+    if baseline.get('duration') != duration:
+        print(f'  note: baseline ran {baseline.get("duration")} s per configuration, this run {duration} s')
+    informational = ['bus_utilization','/max'] # single worst samples are too noisy to gate on
+    if min(duration, baseline.get('duration', 0)) < MEMORY_MIN_DURATION:
+        informational.append('rss_growth')
+    for name, value in new.items():
+        if name not in old or np.isnan(value) or np.isnan(old[name]) or old[name] == 0:
+            continue
+        change = (value - old[name])/abs(old[name])
+        worse = -change if name.split('/')[-1] in HIGHER_IS_BETTER else change
+        flag = ''
+        if worse > tolerance and not any(part in name for part in informational):
+            flag = '  <-- regression'
+            regressions.append(name)
+        print(f'  {name:<70}{old[name]:12.4g}{value:12.4g}{change*100:+8.1f}%{flag}')
+    return regressions
+
+
+def print_results(results):
+    for section, values in results.items():
+        print(f'\n[{section}]')
+        for name, value in flatten(values).items():
+            print(f'  {name:<60}{value:12.4g}')
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('-d','--duration',type=float,default=10,help='seconds per configuration')
+    parser.add_argument('-c','--config',action='append',choices=list(CONFIGURATIONS),help='configuration(s) to run, default all')
+    parser.add_argument('-n','--calls',type=int,default=50,help='calls per driver method')
+    parser.add_argument('--baseline',default=BASELINE,help='baseline json file')
+    parser.add_argument('--save',action='store_true',help='store these results as the baseline')
+    parser.add_argument('--tolerance',type=float,default=0.15,help='relative change counted as a regression')
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.WARNING)
+    logger = logging.getLogger('bench')
+    simulation = Simulators.install()
+    from PyQt5 import QtWidgets
+    app = QtWidgets.QApplication(sys.argv)
+    instruments = Instruments(logger)
+
+    results = {'drivers':bench_drivers(instruments,args.calls)}
+    for name in args.config or CONFIGURATIONS:
+        print(f'running {name} for {args.duration:g} s')
+        results[name] = bench_configuration(app,instruments,logger,CONFIGURATIONS[name],args.duration)
+    instruments.close()
+    simulation.uninstall()
+    print_results(results)
+
+    regressions = []
+    if os.path.exists(args.baseline) and not args.save:
+        with open(args.baseline) as f:
+            regressions = compare(results,json.load(f),args.tolerance,args.duration)
+    if args.save:
+        with open(args.baseline,'w') as f:
+            json.dump({'created':strftime('%Y-%m-%d %H:%M:%S'),'machine':f'{platform.node()} {platform.platform()} python {platform.python_version()}',
+                       'duration':args.duration,'results':results},f,indent=1)
+        print(f'\nSaved baseline to {args.baseline}')
+    if regressions:
+        print(f'\n{len(regressions)} metric(s) regressed by more than {args.tolerance*100:.0f}%')
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
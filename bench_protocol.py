@@ -0,0 +1,82 @@
+'''
+Microbenchmarks for the reply parsing in Protocol against the per-reply code it replaced.
+Runs on synthesized replies in the documented formats, no instruments needed:
+    python bench_protocol.py [-n 200000]
+Prints ns per reply for the old and new path and checks both give the same value.
+'''
+import argparse, re, timeit
+import Protocol
+
+## synthesized replies, not captured from the instruments: MKS 902B (address 253) in the format of the 902B manual,
+## Brooks 0254 (29751) built with Protocol.brooks_reply, so the <sum> is the guessed algorithm, not a real controller's
+MKS_REPLIES = {
+    'PR1':b'@253ACK736.0;FF',
+    'PR4':b'@253ACK7.360E+02;FF',
+    'PR1 low':b'@253ACK1.23E-03;FF',
+    }
+MKS_NAK = b'@253NAK160;FF'
+BROOKS_REPLIES = {
+    'MFC1 K':Protocol.brooks_reply(['AZ','29751.01','4','00','123.456','10.01']),
+    'MFC2 K':Protocol.brooks_reply(['AZ','29751.03','4','00','4567.890','250.0']),
+    'MFC3 K':Protocol.brooks_reply(['AZ','29751.05','4','00','0.000','0.0']),
+    }
+
+
+def legacy_mks(reply):
+    ''' What PressureGauge.get_pressure did per reply before Protocol '''
+    response = reply.decode()
+    if re.search('\\d*ACK',response) is None:
+        return -1
+    return float(re.split('ACK|;',response)[1])
+
+
+def legacy_brooks(reply):
+    ''' What MassFlowController.parse_measured_values did per reply (pyvisa query hands back a decoded str) '''
+    fields = reply.decode().strip().split(sep=',')
+    if len(fields) > 5 and fields[2] == '4':
+        return float(fields[5]), float(fields[4])
+    return None
+
+
+def legacy_mks_command(address):
+    return f'@{address}PR1?;FF'.encode()
+
+
+def bench(label, statement, number):
+    seconds = min(timeit.repeat(statement, number=number, repeat=5))
+    ns = seconds/number*1e9
+    print(f'  {label:<34}{ns:8.0f} ns')
+    return ns
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('-n', '--number', type=int, default=200000, help='calls per timing run')
+    args = parser.parse_args()
+    n = args.number
+
+    print('MKS replies')
+    for name, reply in MKS_REPLIES.items():
+        assert legacy_mks(reply) == Protocol.parse_mks_float(reply)[1], name
+        old = bench(f'{name} legacy', lambda: legacy_mks(reply), n)
+        new = bench(f'{name} Protocol.parse_mks_float', lambda: Protocol.parse_mks_float(reply), n)
+        print(f'  {"speedup":<34}{old/new:8.1f} x')
+    bench('NAK Protocol.parse_mks_float', lambda: Protocol.parse_mks_float(MKS_NAK), n)
+
+    print('MKS command')
+    commands = Protocol.mks_commands('253')
+    bench('legacy f-string + encode', lambda: legacy_mks_command('253'), n)
+    bench('prebuilt', lambda: commands.pressure[1], n)
+
+    print('Brooks replies')
+    for name, reply in BROOKS_REPLIES.items():
+        assert legacy_brooks(reply) == Protocol.parse_brooks_measured(reply)[1:], name
+        old = bench(f'{name} legacy', lambda: legacy_brooks(reply), n)
+        new = bench(f'{name} parse_brooks_measured', lambda: Protocol.parse_brooks_measured(reply), n)
+        print(f'  {"speedup":<34}{old/new:8.1f} x')
+        checked = bench(f'{name} with checksum', lambda: Protocol.parse_brooks_measured(reply, validate=True), n)
+        print(f'  {"speedup, checking <sum>":<34}{old/checked:8.1f} x')
+
+
+if __name__ == '__main__':
+    main()
@@ -1,18 +1,116 @@
 import numpy as np
 import pyqtgraph as pg
+from pyqtgraph.Qt import QtCore, QtGui
+
+class GlowItem(pg.GraphicsObject):
+    '''
+    Glow under a PlotDataItem: one cached QPainterPath of the item's data, stroked with layers of wider, fainter pens
+    (same look as the old ten overlay PlotDataItems, alpha 25 to 5 and 1 to 15 px).
+    With follow=True it tracks the item's data: points appended to the end are added to the cached path, anything
+    else rebuilds it. With follow=False the owner feeds it through append() and set_data() instead (see LoggingPlot).
+    No copy of the data is kept, just the path and the first/last x to recognise an append.
+    '''
+    LAYERS = 10
+
+    def __init__(self, dataItem, color=None, follow=True):
+        super().__init__()
+        self.dataItem = dataItem
+        color = QtGui.QColor(pg.mkPen(dataItem.opts['pen']).color() if color is None else pg.mkColor(color))
+        self.pens = []
+        for alpha, width in zip(np.linspace(25, 5, self.LAYERS, dtype=int), np.linspace(1, 15, self.LAYERS)):
+            color.setAlpha(int(alpha))
+            pen = QtGui.QPen(color, float(width))
+            pen.setCosmetic(True) # width in pixels whatever the zoom
+            self.pens.append(pen)
+        self.padding = max(pen.widthF() for pen in self.pens)/2
+        self.path = None
+        self._count = 0
+        self._first = None
+        self._last = None
+        self._joined = False # whether the next point is joined to the last one (False after a NaN)
+        self.setZValue(dataItem.zValue() - 1)
+        if follow:
+            dataItem.sigPlotChanged.connect(self.update_path)
+            self.update_path()
+
+    def __len__(self):
+        return self._count
+
+    def first(self):
+        ''' x of the oldest point in the path, None if empty '''
+        return self._first
+
+    def update_path(self, *args):
+        x, y = self.dataItem.getData()
+        if (x is not None and self.path is not None and len(x) > self._count and x[0] == self._first
+                and x[self._count - 1] == self._last):
+            ## same points as before plus some new ones at the end
+            for xi, yi in zip(x[self._count:].tolist(), y[self._count:].tolist()):
+                self.append(xi, yi)
+        else:
+            self.set_data(x, y)
+
+    def set_data(self, x, y):
+        ''' Rebuild the path from scratch '''
+        self.prepareGeometryChange()
+        if x is None or len(x) == 0:
+            self.path = None
+            self._count = 0
+            self._first = self._last = None
+        else:
+            self.path = pg.arrayToQPath(np.asarray(x, dtype=float), np.asarray(y, dtype=float), connect='finite')
+            self._count = len(x)
+            self._first = x[0]
+            self._last = x[-1]
+            self._joined = bool(np.isfinite(y[-1]))
+        self.update()
+
+    def append(self, x, y):
+        ''' Add one point to the end of the path, a NaN breaks the line like connect='finite' '''
+        if self.path is None:
+            self.path = QtGui.QPainterPath()
+            self._first = x
+        self._count += 1
+        self._last = x
+        if not np.isfinite(y):
+            self._joined = False
+            return
+        self.prepareGeometryChange()
+        if self._joined:
+            self.path.lineTo(x, y)
+        else:
+            self.path.moveTo(x, y)
+            self._joined = True
+        self.update()
+
+    def boundingRect(self):
+        if self.path is None:
+            return QtCore.QRectF()
+        rect = self.path.controlPointRect()
+        px, py = self.pixelVectors()
+        if px is None:
+            return rect
+        dx = abs(px.x())*self.padding
+        dy = abs(py.y())*self.padding
+        return rect.adjusted(-dx, -dy, dx, dy)
+
+    def paint(self, painter, *args):
+        if self.path is None:
+            return
+        painter.setRenderHint(painter.RenderHint.Antialiasing, bool(self.dataItem.opts.get('antialias', True)))
+        for pen in self.pens:
+            painter.setPen(pen)
+            painter.drawPath(self.path)
+
 
 def add_line_glow(pItem):
     '''Takes a pyqtgraph plot item and adds glow effect to all lines.
-    For ScatterPlotItem adds a line in the default gray'''
-    alphas = np.linspace(25,5, 10, dtype=int)
-    lws = np.linspace(1, 15, 10)
-    pDataItems = pItem.listDataItems()
-    for pDataItem in pDataItems:
-        color = pDataItem.opts['pen'].color().name()
-        (x_data, y_data) = pDataItem.getData()
-        for alpha, lw in zip(alphas,lws):
-            pen = pg.mkPen(color='{}{:02x}'.format(color, alpha),
-                        width=lw,
-                        connect="finite")
-
-            pItem.addItem(pg.PlotDataItem(x_data, y_data,pen=pen))       
+    One GlowItem per line, it follows the line's data as it is updated'''
+    glows = []
+    for pDataItem in pItem.listDataItems():
+        if pDataItem.opts.get('pen') is None:
+            continue
+        glow = GlowItem(pDataItem)
+        pItem.addItem(glow, ignoreBounds=True)
+        glows.append(glow)
+    return glows
@@ -2,13 +2,15 @@ import pandas as pd
 import matplotlib.pyplot as plt 
 import datetime as dt
 import matplotlib.dates as mdates
+from dateutil import tz
+from LogCache import read_csv
 
 
 path = r'C:\Users\oschn\MIT Dropbox\Olivia Schneble\jaramillogroupshared\Data\Jaramillo lab\Big tube furnace\log files\2025\20250729_Pb_sulfurization\TubeFurnaceGUI_20250729-135647.csv'
-df = pd.read_csv(r'C:\Users\oschn\Dropbox (MIT)\jaramillogroupshared\Data\Jaramillo lab\Big tube furnace\log files\2025\250522_Sn_sulfurization\TubeFurnaceGUI_20250522-164059.csv')
+df = read_csv(r'C:\Users\oschn\Dropbox (MIT)\jaramillogroupshared\Data\Jaramillo lab\Big tube furnace\log files\2025\250522_Sn_sulfurization\TubeFurnaceGUI_20250522-164059.csv')
 
 timestamp = df['Timestamp']
-time = [dt.datetime.fromtimestamp(ts) for ts in timestamp]
+time = pd.to_datetime(timestamp, unit='s', utc=True).tz_convert(tz.tzlocal()).tz_localize(None) # local time, like fromtimestamp
 
 T1 = df['Zone 1 Temperature']
 T2 = df['Zone 2 Temperature']
@@ -11,12 +11,15 @@
 
 
 #!/usr/bin/env python3
-import csv
 from datetime import datetime, timedelta
 from pathlib import Path
+from BinaryLog import EXTENSION
+from LogCache import read_csv
+from LogStore import LogStore
 
 # ==== EDIT THESE FOR YOUR CASE ====
-CSV_PATH = Path(r"C:\Users\JaramilloGroup\Documents\Python\ControlSoftware\logs\CryoTest_20260121-153222.csv")  # your CSV file
+CSV_PATH = Path(r"C:\Users\JaramilloGroup\Documents\Python\ControlSoftware\logs\CryoTest_20260121-153222.csv")  # your CSV file, or a .cryolog / folder of them
+TIME_RANGE = (None, None)    # binary logs only: (start, stop) datetimes to pull out of the log, None for open ended
 DATETIME_COL = "DateTime"    # column with format: YYYYMMDD-HHMMSS (e.g., 20251009-112607)
 REACTION_T_COL = "Reaction Temperature"
 REACTION_P_COL = "Reaction Pressure"
@@ -68,20 +71,28 @@ def ass_time(t: float) -> str:
     return f"{h:d}:{m:02d}:{s:02d}.{cs:02d}"
 
 def read_rows(csv_path: Path):
-    """Always read a comma-delimited CSV."""
-    with csv_path.open(newline="", encoding="utf-8-sig") as f:
-        rdr = csv.DictReader(f, delimiter=",")
-        rows = list(rdr)
-    return rows
+    """Rows of a comma-delimited CSV, parsed once and then read back from the parsed-log cache (LogCache.py).
+    A missing T or P column reads as NaN, rows whose DateTime doesn't parse are skipped."""
+    data = read_csv(csv_path, dates={DATETIME_COL: "%Y%m%d-%H%M%S"})
+    times = data[DATETIME_COL].tolist()  # NaT -> None
+    blank = [float("nan")] * len(times)
+    T = data[REACTION_T_COL].tolist() if REACTION_T_COL in data else blank
+    P = data[REACTION_P_COL].tolist() if REACTION_P_COL in data else blank
+    return [{"_dt": t, REACTION_T_COL: T, REACTION_P_COL: P}
+            for t, T, P in zip(times, T, P) if t is not None]
+
+def read_log_rows(log_path: Path):
+    """Rows of a binary log (or folder of them) in TIME_RANGE, only the two channels are read."""
+    data = LogStore(str(log_path)).read(*TIME_RANGE, [REACTION_T_COL, REACTION_P_COL])
+    return [{"_dt": datetime.fromtimestamp(t/1e9), REACTION_T_COL: T, REACTION_P_COL: P}
+            for t, T, P in zip(data["time_ns"].tolist(), data[REACTION_T_COL].tolist(), data[REACTION_P_COL].tolist())]
 
 def main():
-    rows = read_rows(CSV_PATH)
+    rows = read_log_rows(CSV_PATH) if CSV_PATH.is_dir() or CSV_PATH.suffix == EXTENSION else read_rows(CSV_PATH)
     if not rows:
         raise SystemExit("No rows found in CSV.")
 
-    # Parse datetimes and sort just in case
-    for r in rows:
-        r["_dt"] = parse_dt(r[DATETIME_COL])
+    # sort just in case
     rows.sort(key=lambda r: r["_dt"])
 
     base_dt = parse_dt(BASE_DATETIME.replace(" ", "").replace(":", "").replace("-", "")) if isinstance(BASE_DATETIME, str) else rows[0]["_dt"]
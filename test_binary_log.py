@@ -0,0 +1,116 @@
+'''
+Gorilla codec round trips (bit for bit, NaN, +-inf and -0.0 included) and reading a binary log that was cut short.
+
+    python -m pytest test_binary_log.py
+'''
+import os
+import numpy as np
+import pytest
+from BinaryLog import BinaryLog, BinaryLogWriter, CODECS, DTYPE, TIME_COLUMN
+
+COLUMNS = (TIME_COLUMN, 'a', 'b', 'c')
+
+
+def gorilla_round_trip(data, select=None):
+    encode, decode = CODECS['gorilla']
+    data = np.ascontiguousarray(data, dtype=DTYPE)
+    select = list(range(data.shape[0])) if select is None else select
+    return decode(encode(data), data.shape[0], data.shape[1], select)
+
+
+def assert_same_bits(a, b):
+    assert a.shape == b.shape
+    assert (np.asarray(a, DTYPE).view(np.uint64) == np.asarray(b, DTYPE).view(np.uint64)).all()
+
+
+@pytest.mark.parametrize('column', [
+    [0.0, -0.0, 0.0, -0.0],
+    [np.nan, 1.5, np.nan, np.nan, 2.25],
+    [np.inf, -np.inf, 1.0, np.inf, -np.inf],
+    [1.23, 1.24, np.nan, 1.26, -0.0, np.inf],   # a decimal column broken up by specials
+    [5e-324, -5e-324, 1.7976931348623157e308, -1.7976931348623157e308],
+    [0.1 + 0.2, 0.3, 1/3, np.pi],               # not exact decimals, stored as XOR words
+    [7.0]*9,
+    ])
+def test_gorilla_special_values(column):
+    data = np.array([np.arange(len(column))*1e9, column])
+    assert_same_bits(gorilla_round_trip(data), data)
+
+
+def test_gorilla_telemetry():
+    rng = np.random.default_rng(3)
+    rows = 1000
+    time = 1.7e18 + np.cumsum(rng.integers(999_000_000, 1_001_000_000, rows)).astype(float)
+    pressure = np.round(700 + np.cumsum(rng.normal(size=rows)), 2)
+    temperature = rng.normal(size=rows)
+    flow = np.where(rng.random(rows) < 0.1, np.nan, np.round(rng.uniform(0, 100, rows), 1))
+    data = np.array([time, pressure, temperature, flow])
+    assert_same_bits(gorilla_round_trip(data), data)
+    assert_same_bits(gorilla_round_trip(data, [3, 1]), data[[3, 1]])
+    assert_same_bits(gorilla_round_trip(data, [2, 2]), data[[2, 2]])
+
+
+def test_gorilla_empty_and_single_row():
+    assert gorilla_round_trip(np.empty((2, 0))).shape == (2, 0)
+    data = np.array([[1e18], [-0.0]])
+    assert_same_bits(gorilla_round_trip(data), data)
+
+
+def write_log(path, chunks, codec):
+    rng = np.random.default_rng(11)
+    blocks = []
+    with BinaryLogWriter(path, COLUMNS, codec=codec) as log:
+        for i in range(chunks):
+            block = np.array([1e18 + 1e9*np.arange(i*50, (i + 1)*50), *rng.normal(size=(3, 50))])
+            block[1, 7] = np.nan
+            log.write_chunk(block)
+            blocks.append(block)
+    return np.concatenate(blocks, axis=1)
+
+
+@pytest.mark.parametrize('codec', [None, 'zlib', 'gorilla'])
+def test_closed_log_round_trip(tmp_path, codec):
+    path = str(tmp_path/'run.cryolog')
+    data = write_log(path, 4, codec)
+    log = BinaryLog(path)
+    assert log.closed and log.rows == 200
+    assert_same_bits(log.read_block(), data)
+    assert log.summary()['b']['max'] == data[2].max()
+
+
+@pytest.mark.parametrize('codec', [None, 'gorilla'])
+@pytest.mark.parametrize('cut', [1, 16, 'trailer'])
+def test_truncated_trailer(tmp_path, codec, cut):
+    ''' A log whose index, summary or trailer was cut off reads back every chunk by walking the chunk headers '''
+    path = str(tmp_path/'run.cryolog')
+    data = write_log(path, 4, codec)
+    with open(path, 'rb') as f:
+        f.seek(-16, os.SEEK_END)
+        index_offset = int.from_bytes(f.read(8), 'little')
+    size = os.path.getsize(path)
+    with open(path, 'r+b') as f:
+        f.truncate(index_offset if cut == 'trailer' else size - cut)
+    log = BinaryLog(path)
+    assert not log.closed
+    assert log.summary() is None
+    assert_same_bits(log.read_block(), data)
+
+
+@pytest.mark.parametrize('codec', [None, 'gorilla'])
+def test_truncated_chunk_is_dropped_and_appended_over(tmp_path, codec):
+    ''' A crash in the middle of a chunk loses that chunk only, and a writer reopening the log carries on after the last whole one '''
+    path = str(tmp_path/'run.cryolog')
+    data = write_log(path, 4, codec)
+    last_chunk = BinaryLog(path).index[-1][0]
+    with open(path, 'r+b') as f:
+        f.truncate(last_chunk + 20)
+    log = BinaryLog(path)
+    assert log.rows == 150
+    assert_same_bits(log.read_block(), data[:, :150])
+
+    extra = np.array([1e18 + 1e9*np.arange(500, 510), *np.ones((3, 10))])
+    with BinaryLogWriter(path, COLUMNS, codec=codec) as writer:
+        writer.write_chunk(extra)
+    log = BinaryLog(path)
+    assert log.closed and log.rows == 160
+    assert_same_bits(log.read_block(), np.concatenate([data[:, :150], extra], axis=1))
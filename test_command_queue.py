@@ -0,0 +1,94 @@
+'''
+CommandQueue ordering and read coalescing, against a fake connection that holds the first command on the wire
+until the test has queued everything else.
+
+    python -m pytest test_command_queue.py
+'''
+import logging, threading
+import pytest
+from Instruments import CommandQueue
+
+
+class HeldConnection:
+    ''' pyvisa-like connection that records every query, the first one waits for release() '''
+
+    def __init__(self):
+        self.sent = []
+        self.on_wire = threading.Event()
+        self._release = threading.Event()
+
+    def query(self, command):
+        self.sent.append(command)
+        if len(self.sent) == 1:
+            self.on_wire.set()
+            self._release.wait(5)
+        return f'reply to {command}'
+
+    def release(self):
+        self._release.set()
+
+
+@pytest.fixture
+def held():
+    connection = HeldConnection()
+    queue = CommandQueue(connection, logging.getLogger('test'), name='held')
+    first = queue.submit('busy')
+    assert connection.on_wire.wait(5)
+    yield connection, queue, first
+    connection.release()
+    queue.close()
+
+
+def test_waiting_reads_are_coalesced(held):
+    connection, queue, first = held
+    a = queue.submit('AZ.1K')
+    b = queue.submit('AZ.1K')
+    other = queue.submit('AZ.2K')
+    assert a is b
+    assert queue.depth() == 2
+    connection.release()
+    assert a.result(5) == b.result(5) == 'reply to AZ.1K'
+    assert other.result(5) == 'reply to AZ.2K'
+    assert connection.sent.count('AZ.1K') == 1
+
+
+def test_setpoints_are_not_coalesced(held):
+    connection, queue, first = held
+    a = queue.submit('AZ.1P01=5', CommandQueue.SETPOINT)
+    b = queue.submit('AZ.1P01=5', CommandQueue.SETPOINT)
+    assert a is not b
+    connection.release()
+    a.result(5), b.result(5)
+    assert connection.sent.count('AZ.1P01=5') == 2
+
+
+def test_priority_order(held):
+    connection, queue, first = held
+    futures = [queue.submit('read 1'), queue.submit('setpoint 1', CommandQueue.SETPOINT), queue.submit('read 2'),
+               queue.submit('abort', CommandQueue.EMERGENCY), queue.submit('setpoint 2', CommandQueue.SETPOINT)]
+    assert queue.depth_by_priority() == {CommandQueue.EMERGENCY:1, CommandQueue.SETPOINT:2, CommandQueue.READ:2}
+    connection.release()
+    for future in futures:
+        future.result(5)
+    assert connection.sent == ['busy', 'abort', 'setpoint 1', 'setpoint 2', 'read 1', 'read 2']
+
+
+def test_read_after_send_is_queued_again(held):
+    connection, queue, first = held
+    connection.release()
+    first.result(5)
+    a = queue.submit('AZ.1K')
+    a.result(5)
+    b = queue.submit('AZ.1K')
+    assert b is not a
+    assert b.result(5) == 'reply to AZ.1K'
+
+
+def test_close_fails_waiting_commands(held):
+    connection, queue, first = held
+    waiting = queue.submit('AZ.1K')
+    queue.close()
+    with pytest.raises(OSError):
+        waiting.result(5)
+    with pytest.raises(OSError):
+        queue.submit('AZ.2K')
@@ -0,0 +1,87 @@
+'''
+RingBuffer wrap-around and the MinMaxPyramid envelope, checked against plain numpy on the same samples.
+
+    python -m pytest test_plot_buffers.py
+'''
+import numpy as np
+import pytest
+from PlotBuffers import RingBuffer, MinMaxPyramid
+
+
+def test_ring_buffer_wraps():
+    buffer = RingBuffer(5)
+    assert buffer.last() is None
+    for i in range(12):
+        buffer.append(i, 10*i)
+    x, y = buffer.view()
+    assert len(buffer) == 5
+    assert x.tolist() == [7, 8, 9, 10, 11]
+    assert y.tolist() == [70, 80, 90, 100, 110]
+    assert buffer.view(last=2)[0].tolist() == [10, 11]
+    assert buffer.last() == (11, 110)
+    assert not x.flags.writeable
+
+
+def test_ring_buffer_extend_across_the_end():
+    buffer = RingBuffer(5)
+    buffer.extend([0, 1, 2], [0, 1, 2])
+    buffer.extend([3, 4, 5, 6], [3, 4, 5, 6]) # fills the last two slots and wraps into the first two
+    assert buffer.view()[0].tolist() == [2, 3, 4, 5, 6]
+    buffer.extend(np.arange(7, 20), np.arange(7, 20)) # more than the capacity, only the newest are kept
+    assert buffer.view()[0].tolist() == [15, 16, 17, 18, 19]
+    buffer.append(20, 20)
+    assert buffer.view()[0].tolist() == [16, 17, 18, 19, 20]
+
+
+def test_ring_buffer_clear():
+    buffer = RingBuffer(3)
+    buffer.extend([1, 2, 3, 4], [1, 2, 3, 4])
+    buffer.clear()
+    assert len(buffer) == 0
+    buffer.append(5, 5)
+    assert buffer.view()[0].tolist() == [5]
+
+
+@pytest.fixture
+def series():
+    rng = np.random.default_rng(7)
+    x = np.arange(5003, dtype=float) # not a whole number of buckets, so the unfinished tail is used
+    y = np.cumsum(rng.normal(size=len(x)))
+    store = MinMaxPyramid(8192)
+    for xi, yi in zip(x, y):
+        store.append(xi, yi)
+    return x, y, store
+
+
+def test_pyramid_level_zero_is_raw(series):
+    x, y, store = series
+    xs, ys, level = store.select(100, 150, 1000)
+    assert level == 0
+    assert xs.tolist() == x[99:152].tolist() # one point of margin on each side
+    assert ys.tolist() == y[99:152].tolist()
+
+
+@pytest.mark.parametrize('pixels', [400, 100, 20])
+def test_pyramid_envelope(series, pixels):
+    x, y, store = series
+    xs, ys, level = store.select(x[0], x[-1], pixels)
+    assert level > 0
+    assert len(xs) <= pixels*MinMaxPyramid.POINTS_PER_PIXEL or level == len(store.levels)
+    ## every (first x, min), (last x, max) pair is exactly the extremes of the raw samples in its bucket
+    for first, last, low, high in zip(xs[0::2], xs[1::2], ys[0::2], ys[1::2]):
+        inside = (x >= first) & (x <= last)
+        assert y[inside].min() == low
+        assert y[inside].max() == high
+    ## and the buckets cover the whole series without gaps or overlaps
+    assert xs[0] == x[0] and xs[-1] == x[-1]
+    assert (xs[2::2] > xs[1:-1:2]).all()
+    assert sum(((x >= first) & (x <= last)).sum() for first, last in zip(xs[0::2], xs[1::2])) == len(x)
+
+
+def test_pyramid_envelope_of_a_range(series):
+    x, y, store = series
+    xs, ys, level = store.select(1000, 2000, 50)
+    assert level > 0
+    assert xs[0] <= 1000 and xs[-1] >= 2000
+    inside = (x >= 1000) & (x <= 2000)
+    assert ys.min() <= y[inside].min() and ys.max() >= y[inside].max()